@@ -7,7 +7,8 @@ except ImportError:
 if pd is not None:
     from tdda.constraints.pd.constraints import (discover_df,
                                                  verify_df,
-                                                 detect_df)
+                                                 detect_df,
+                                                 PandasCompiledVerifier)
 
 from tdda.constraints.db.constraints import (discover_db_table,
                                              verify_db_table,
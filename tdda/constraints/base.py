@@ -329,6 +329,11 @@ class FieldConstraints(object):
             k = keys[k]
         return self.constraints[k]
 
+    def __iter__(self):
+        keys = to_preferred_order(self.constraints.keys(),
+                                  STANDARD_FIELD_CONSTRAINTS)
+        return (self.constraints[k] for k in keys)
+
     def __str__(self):
         keys = [k for k in STANDARD_FIELD_CONSTRAINTS
                 if k in self.constraints]
@@ -733,7 +738,8 @@ class Detection(object):
     """
     Object to represent the result of running detect.
     """
-    def __init__(self, obj, n_passing_records, n_failing_records):
+    def __init__(self, obj, n_passing_records, n_failing_records,
+                 failure_index=None):
         """
         *obj*:
                             Object containing information about the detection,
@@ -744,10 +750,16 @@ class Detection(object):
 
         *n_failing_records:
                             Number of failing records.
+
+        *failure_index*:
+                            Optional object giving the positions of the
+                            records that failed each constraint, of a type
+                            specific to the data source.
         """
         self.obj = obj
         self.n_passing_records = n_passing_records
         self.n_failing_records = n_failing_records
+        self.failure_index = failure_index
 
 
 def constraint_class(kind):
@@ -782,7 +794,7 @@ def strip_lines(s):
 
 
 def verify(constraints, fieldnames, verifiers, VerificationClass=None,
-           detected_records_writer=None, **kwargs):
+           detected_records_writer=None, field_order=None, **kwargs):
     """
     Perform a verification of a set of constraints.
     This is primarily an internal function, intended to be used by
@@ -812,6 +824,11 @@ def verify(constraints, fieldnames, verifiers, VerificationClass=None,
                             DataFrame. If not provided, Verification
                             is used.
 
+        field_order         If provided, the names of the constrained fields,
+                            in the order in which they should be verified.
+                            Otherwise, they are ordered by their positions
+                            in fieldnames (with missing fields first).
+
         kwargs              Any keyword arguments provided are passed to
                             the VerificationClass chosen.
 
@@ -824,9 +841,8 @@ def verify(constraints, fieldnames, verifiers, VerificationClass=None,
               or kwargs.get('detect') is not None
               or kwargs.get('detect_in_place') is not None)
 
-    allfields = sorted(constraints.fields.keys(),
-                       key=lambda f: fieldnames.index(f) if f in fieldnames
-                                                         else -1)
+    allfields = field_order or constrained_field_order(constraints,
+                                                       fieldnames)
 
     if detect_outpath:
         # empty (and then remove) the detection output file first,
@@ -862,6 +878,17 @@ def verify(constraints, fieldnames, verifiers, VerificationClass=None,
     return results
 
 
+def constrained_field_order(constraints, fieldnames):
+    """
+    Returns the names of the fields that have constraints, in the order
+    in which they appear in fieldnames, preceded by any that don't
+    appear there at all.
+    """
+    positions = {f: i for (i, f) in reversed(list(enumerate(fieldnames)))}
+    return sorted(constraints.fields.keys(),
+                  key=lambda f: positions.get(f, -1))
+
+
 def detect(constraints, fieldnames, verifiers, VerificationClass=None,
            detected_records_writer=None, **kwargs):
     """
@@ -406,8 +406,9 @@ class BaseConstraintVerifier(BaseConstraintCalculator, BaseConstraintDetector):
             actual_values = self.get_unique_values(colname)
             exclusions = exclusions or []
 
-            violations = (set(actual_values) - set(allowed_values)
-                                             - set(exclusions))
+            violations = (set(actual_values)
+                          - self.allowed_values_set(colname, allowed_values)
+                          - set(exclusions))
             result = len(violations) == 0
 
         if detect and not bool(result):
@@ -415,6 +416,13 @@ class BaseConstraintVerifier(BaseConstraintCalculator, BaseConstraintDetector):
                                                   violations)
         return result
 
+    def allowed_values_set(self, colname, allowed_values):
+        """
+        Returns the values allowed by an allowed_values constraint on
+        the column, as a set.
+        """
+        return set(allowed_values)
+
     def verify_rex_constraint(self, colname, constraint, detect=False):
         """
         Verify whether a given column satisfies a given regular
@@ -539,6 +547,27 @@ class BaseConstraintDiscoverer(BaseConstraintCalculator):
         else:
             return None
 
+    def string_length_extremes(self, fieldname, uniqs=None):
+        """
+        Returns a triple (m, M, uniqs) where m and M are the minimum and
+        maximum lengths of the (non-null) strings in a string field, and
+        uniqs is the list of its distinct values, if it was available
+        (either because it was provided, or because it was needed here).
+
+        If there were too many values for the distinct values to have been
+        fetched already, they are fetched here. Subclasses can override this
+        to find the lengths in some other way, without fetching them.
+        """
+        if uniqs is None:
+            uniqs = self.calc_unique_values(fieldname, include_nulls=False)
+        if not uniqs:
+            return (None, None, uniqs)
+        if type(uniqs[0]) is unicode_string:
+            L = [len(v) for v in uniqs]
+        else:
+            L = [len(v.decode('UTF-8')) for v in uniqs]
+        return (min(L), max(L), uniqs)
+
     def discover_field_constraints(self, fieldname):
         min_constraint = max_constraint = None
         min_length_constraint = max_length_constraint = None
@@ -578,20 +607,12 @@ class BaseConstraintDiscoverer(BaseConstraintCalculator):
                     # We don't generate a min, max or sign constraints for
                     # strings. But we do generate min and max length
                     # constraints
-                    if (uniqs is None and n_unique > 0):
-                        # There were too many for us to have bothered getting
-                        # them all before, but we need them now.
-                        uniqs = self.calc_unique_values(fieldname,
-                                                        include_nulls=False)
-                    if uniqs:
-                        if type(uniqs[0]) is unicode_string:
-                            L = [len(v) for v in uniqs]
-                        else:
-                            L = [len(v.decode('UTF-8')) for v in uniqs]
-                        m = min(L)
-                        M = max(L)
-                        min_length_constraint = MinLengthConstraint(m)
-                        max_length_constraint = MaxLengthConstraint(M)
+                    if uniqs or n_unique > 0:
+                        (m, M, uniqs) = self.string_length_extremes(fieldname,
+                                                                    uniqs)
+                        if m is not None:
+                            min_length_constraint = MinLengthConstraint(m)
+                            max_length_constraint = MaxLengthConstraint(M)
                 else:
                     # Non-string fields all potentially get min and max values
                     m = self.calc_min(fieldname)
@@ -621,9 +642,9 @@ class BaseConstraintDiscoverer(BaseConstraintCalculator):
                 no_duplicates_constraint = NoDuplicatesConstraint()
 
         if type_ == 'string' and self.inc_rex:
-            rex_constraint = RexConstraint(self.find_rexes(fieldname,
-                                                           values=uniqs,
-                                                           seed=self.seed))
+            rexes = self.find_rexes(fieldname, values=uniqs, seed=self.seed)
+            if rexes is not None:   # None if no rexes could be found
+                rex_constraint = RexConstraint(rexes)
 
         constraints = [c for c in [type_constraint,
                                    min_constraint, max_constraint,
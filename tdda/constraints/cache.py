@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+
+"""
+Persistent caching of verification results.
+
+A :py:class:`VerificationCache` keeps, on disk, the column statistics
+calculated while verifying an input (a file or a database table) and the
+result of each constraint checked, together with a *version* for the
+input, such as a file's size and modification time. When the same input
+is verified again, and its version has not changed, the cached results
+are used, so an unchanged input verifies without being read at all, and
+if some of the constraints have changed, only those need to be checked
+(usually from cached statistics).
+
+A column's statistics and results are cached separately for each value
+of its type constraint, since that can change how its values are
+prepared before they are checked (for example, by repairing a numeric
+column whose constraints say it holds strings).
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import datetime
+import hashlib
+import json
+import os
+import sys
+
+from tdda.constraints.base import verify
+from tdda.referencetest.referencetest import atomic_write
+
+if sys.version_info[0] >= 3:
+    unicode_string = str
+else:
+    unicode_string = unicode
+
+
+# Largest list of values (such as the distinct values of a column)
+# kept in the cache
+MAX_CACHED_VALUES = 1000
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class VerificationCache(object):
+    """
+    An on-disk cache of the statistics and constraint results from
+    verifying a single input.
+
+    Inputs:
+
+        *cache_dir*:
+                The directory for the cache, which is shared by all
+                inputs. It is created if it does not exist.
+        *identity*:
+                A string identifying the input (such as its path).
+        *version*:
+                A string that changes whenever the input does (see
+                :py:func:`file_fingerprint`). If this is ``None``,
+                nothing is cached.
+    """
+    def __init__(self, cache_dir, identity, version):
+        self.identity = identity
+        self.version = version
+        key = hashlib.sha1(identity.encode('utf-8')).hexdigest()
+        self.path = os.path.join(cache_dir, key + '.json')
+        self.entry = self.load()
+
+    def load(self):
+        """
+        Reads the cached entry for this input, returning an empty one if
+        there is none, or if it is for a different version of the input.
+        """
+        entry = None
+        if self.version is not None and os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    entry = json.load(f)
+            except ValueError:
+                entry = None   # corrupt; just start again
+        if (entry is None or entry.get('identity') != self.identity
+                or entry.get('version') != self.version):
+            entry = {
+                'identity': self.identity,
+                'version': self.version,
+                'columns': None,
+                'stats': {},
+                'results': {},
+            }
+        return entry
+
+    def save(self):
+        """
+        Writes the entry for this input, atomically, since several
+        processes may be verifying the same input at once.
+        """
+        if self.version is None:
+            return
+        cache_dir = os.path.dirname(self.path)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        def write(tmppath):
+            with open(tmppath, 'w') as f:
+                json.dump(self.entry, f)
+        atomic_write(self.path, write)
+
+    def verify(self, constraints, make_verifier, settings='',
+               original_values=None, VerificationClass=None, **kwargs):
+        """
+        Verify constraints, using cached results where possible.
+
+        Inputs:
+
+            *constraints*:
+                    A :py:class:`~tdda.constraints.base.DatasetConstraints`
+                    object.
+            *make_verifier*:
+                    A function returning a
+                    :py:class:`~tdda.constraints.baseconstraints.BaseConstraintVerifier`
+                    for the input. It is only called if some result is
+                    not in the cache.
+            *settings*:
+                    A string describing any settings (such as epsilon)
+                    that affect the results; results are only reused
+                    for the same settings.
+            *original_values*:
+                    If *make_verifier* changes the constraints (for
+                    example, repairing their types), a dictionary mapping
+                    (field name, constraint kind) to the constraint value
+                    before it was changed, so that results are cached
+                    under the value as given.
+
+        Other keyword arguments are passed to the *VerificationClass*.
+        """
+        if original_values is None:
+            original_values = dict(((name, c.kind), c.value)
+                                   for name in constraints.fields
+                                   for c in constraints.fields[name])
+        results = self.entry['results'].setdefault(settings, {})
+
+        def type_key(colname):
+            # the column's type constraint, as given, or None if that
+            # can't be cached
+            for c in constraints.fields.get(colname, []):
+                if c.kind == 'type':
+                    value = original_values.get((colname, c.kind), c.value)
+                    break
+            else:
+                value = None
+            try:
+                return json.dumps(cache_value(value), sort_keys=True)
+            except ValueError:
+                return None
+
+        def result_key(colname, constraint):
+            # None for constraints whose results can't be cached
+            value = original_values.get((colname, constraint.kind),
+                                        constraint.value)
+            coltype = type_key(colname)
+            try:
+                value = cache_value(value)
+            except ValueError:
+                return None
+            if coltype is None:
+                return None
+            return json.dumps([constraint.kind, value, coltype],
+                              sort_keys=True, default=str)
+
+        def cached_verifier(colname, constraint, detect=False):
+            key = result_key(colname, constraint)
+            if key is None or key not in results.get(colname, {}):
+                raise CacheMiss()
+            return results[colname][key]
+
+        if self.entry['columns'] is not None:
+            try:
+                return verify(constraints, self.entry['columns'],
+                              dict((kind, cached_verifier)
+                                   for kind in constraint_kinds(constraints)),
+                              VerificationClass=VerificationClass, **kwargs)
+            except CacheMiss:
+                pass
+
+        verifier = make_verifier()
+        for colname, typestats in self.entry['stats'].items():
+            stats = typestats.get(type_key(colname))
+            if stats is None:
+                continue   # only calculated with a different type
+            colcache = verifier.cache_values(colname)
+            for stat, value in stats.items():
+                colcache.setdefault(stat, from_cache_value(value))
+
+        def caching_verifier(f):
+            def verify_and_cache(colname, constraint, detect=False):
+                key = result_key(colname, constraint)
+                if key is None:
+                    return f(colname, constraint, detect)
+                colresults = results.setdefault(colname, {})
+                if key not in colresults:
+                    colresults[key] = bool(f(colname, constraint, detect))
+                return colresults[key]
+            return verify_and_cache
+
+        verifiers = dict((kind, caching_verifier(f))
+                         for kind, f in verifier.verifiers().items())
+        columns = list(verifier.get_column_names())
+        v = verify(constraints, columns, verifiers,
+                   VerificationClass=VerificationClass, **kwargs)
+        self.entry['columns'] = columns
+        for colname, stats in cacheable_stats(verifier.cache).items():
+            coltype = type_key(colname)
+            if coltype is not None:
+                colstats = self.entry['stats'].setdefault(colname, {})
+                colstats[coltype] = stats
+        self.save()
+        return v
+
+
+def constraint_kinds(constraints):
+    return set(c.kind for name in constraints.fields
+               for c in constraints.fields[name])
+
+
+def cacheable_stats(cache):
+    """
+    Returns the statistics from a verifier's cache that can be saved
+    as JSON.
+    """
+    stats = {}
+    for colname, values in cache.items():
+        colstats = {}
+        for stat, value in values.items():
+            try:
+                colstats[stat] = cache_value(value)
+            except ValueError:
+                pass
+        stats[colname] = colstats
+    return stats
+
+
+def cache_value(value):
+    """
+    Converts a statistic or constraint value to a form that can be saved
+    as JSON, raising ValueError if it can't be.
+
+    Lists of values are only kept if they are short lists of strings,
+    since only those are sure to compare the same way after being read
+    back (unlike, for example, NaN).
+    """
+    if isinstance(value, datetime.datetime):
+        if value.utcoffset() is not None:
+            return {'datetime_tz': value.strftime(DATETIME_FORMAT + '%z')}
+        return {'datetime': value.strftime(DATETIME_FORMAT)}
+    elif hasattr(value, 'tolist'):
+        value = value.tolist()     # numpy scalars and arrays
+    if isinstance(value, (list, tuple)):
+        if (len(value) > MAX_CACHED_VALUES
+                or not all(isinstance(v, unicode_string) for v in value)):
+            raise ValueError('values cannot be cached')
+        return list(value)
+    elif value is None or isinstance(value, (bool, int, float,
+                                             unicode_string)):
+        return value
+    elif sys.version_info[0] < 3 and isinstance(value, (long, str)):
+        return value
+    raise ValueError('%s value cannot be cached' % type(value))
+
+
+def from_cache_value(value):
+    if isinstance(value, dict):
+        if 'datetime' in value:
+            return datetime.datetime.strptime(value['datetime'],
+                                              DATETIME_FORMAT)
+        elif 'datetime_tz' in value:
+            return datetime.datetime.strptime(value['datetime_tz'],
+                                              DATETIME_FORMAT + '%z')
+    return value
+
+
+def file_fingerprint(path, content_hash=False):
+    """
+    Returns an (identity, version) pair for a file, for use with a
+    :py:class:`VerificationCache`. The version is its size and modification
+    time, and, if *content_hash* is set, a hash of its contents (which
+    means reading the whole file, but guards against changes that keep
+    the same size and modification time).
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    version = '%d:%r' % (st.st_size, st.st_mtime)
+    if content_hash:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        version += ':' + h.hexdigest()
+    return ('file:' + path, version)
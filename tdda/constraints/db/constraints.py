@@ -13,6 +13,10 @@ The top-level functions are:
         Verify (check) a single database table, against a set of previously
         discovered constraints.
 
+    :py:func:`~tdda.constraints.db.constraints.verify_db_tables`:
+        Verify (check) several database tables, each against its own
+        set of constraints, concurrently.
+
     :py:func:`~tdda.constraints.detect_db_table`:
         For detection of failing records in a single database table,
         but not yet implemented for databases.
@@ -21,7 +25,17 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
+import datetime
+import decimal
+import fnmatch
+import json
+import math
+import os
+import re
 import sys
+import threading
+
+from collections import OrderedDict
 
 from tdda.constraints.base import (
     DatasetConstraints,
@@ -35,17 +49,36 @@ from tdda.constraints.baseconstraints import (
     MAX_CATEGORIES,
 )
 
-from tdda.constraints.db.drivers import DatabaseHandler
+from tdda.constraints.cache import VerificationCache
+from tdda.constraints.db.drivers import (DatabaseHandler, ConnectionPool,
+                                         DEFAULT_SCHEMA_SAMPLE_SIZE)
 from tdda import rexpy
+from tdda.referencetest.referencetest import atomic_write
 
 if sys.version_info[0] >= 3:
     long = int
 
 
+# Default number of tables verified at once (and so the number of database
+# connections used) by verify_db_tables
+DEFAULT_DB_WORKERS = 4
+
+# Largest number of distinct values in a column that will be saved in the
+# state from an incremental verification
+MAX_INCREMENTAL_UNIQUES = 1000
+
+# Largest number of distinct values of a column used to discover regular
+# expressions for it; beyond this, a random sample of them is used, so that
+# memory use is bounded (and the expressions found are then checked against
+# all of the column's values).
+MAX_REX_EXAMPLES = 100000
+
+
 class DatabaseConstraintCalculator(BaseConstraintCalculator):
-    def __init__(self, tablename, testing=False):
+    def __init__(self, tablename, testing=False, rex_distinct=False):
         self.tablename = tablename
         self.testing = testing
+        self.rex_distinct = rex_distinct
 
     def is_null(self, value):
         return self.db_value_is_null(value)
@@ -54,7 +87,7 @@ class DatabaseConstraintCalculator(BaseConstraintCalculator):
         return self.db_value_to_datetime(value)
 
     def column_exists(self, colname):
-        return colname in self.get_column_names()
+        return self.check_column_exists(self.tablename, colname)
 
     def get_column_names(self):
         return self.get_database_column_names(self.tablename)
@@ -100,13 +133,48 @@ class DatabaseConstraintCalculator(BaseConstraintCalculator):
         raise Exception('database should not require all_non_nulls_boolean')
 
     def find_rexes(self, colname, values=None, seed=None):
-        if not values:
-            values = self.get_database_unique_values(self.tablename, colname)
-        return rexpy.extract(values, seed=seed)
+        if values:
+            return rexpy.extract(values, seed=seed)
+        # Feed the distinct values to the extractor a batch at a time,
+        # rather than fetching them all first, keeping at most
+        # MAX_REX_EXAMPLES of them.
+        extractor = rexpy.Extractor([], extract=False, seed=seed,
+                                    max_examples=MAX_REX_EXAMPLES)
+        for batch in self.iter_database_unique_values(self.tablename,
+                                                      colname):
+            extractor.add(batch)
+        extractor.extract()
+        rexes = extractor.results.rex
+        if extractor.n_distinct > MAX_REX_EXAMPLES:
+            # Found from a sample, so values left out of it may not match;
+            # in that case, no rex constraint is discovered at all.
+            if not self.all_values_match(colname, rexes):
+                return None
+        return rexes
+
+    def all_values_match(self, colname, rexes):
+        """
+        Checks whether every non-null value in a column matches at least
+        one of the regular expressions given.
+        """
+        if self.dbtype != 'mongodb':
+            return self.get_database_rex_match(self.tablename, colname,
+                                               rexes, distinct=True)
+        # no regular expression matching in the database, so check
+        # the distinct values a batch at a time
+        compiled = [re.compile(r, rexpy.RE_FLAGS) for r in rexes]
+        for batch in self.iter_database_unique_values(self.tablename,
+                                                      colname,
+                                                      sorted_values=False):
+            for value in batch:
+                if not any(r.match(value) for r in compiled):
+                    return False
+        return True
 
     def calc_rex_constraint(self, colname, constraint, detect=False):
         return not self.get_database_rex_match(self.tablename, colname,
-                                               constraint.value)
+                                               constraint.value,
+                                               distinct=self.rex_distinct)
 
 
 class DatabaseConstraintDetector(BaseConstraintDetector):
@@ -127,7 +195,7 @@ class DatabaseConstraintVerifier(DatabaseConstraintCalculator,
     for verifying every type of constraint against a single database table.
     """
     def __init__(self, dbtype, db, tablename, epsilon=None,
-                 type_checking='strict', testing=False):
+                 type_checking='strict', testing=False, rex_distinct=False):
         """
         Inputs:
 
@@ -141,15 +209,345 @@ class DatabaseConstraintVerifier(DatabaseConstraintCalculator,
                     A table name, referring to a table that exists in the
                     database and is accessible. It can either be a simple
                     name, or a schema-qualified name of the form `schema.name`.
+            *rex_distinct*:
+                    If set, rex constraints are checked against each
+                    distinct value in a column once, rather than against
+                    every row.
         """
         DatabaseHandler.__init__(self, dbtype, db)
         tablename = self.resolve_table(tablename)
 
-        DatabaseConstraintCalculator.__init__(self, tablename, testing)
+        DatabaseConstraintCalculator.__init__(self, tablename, testing,
+                                              rex_distinct)
         DatabaseConstraintDetector.__init__(self, tablename)
         BaseConstraintVerifier.__init__(self, epsilon=epsilon,
                                         type_checking=type_checking)
 
+    def verify_allowed_values_constraint(self, colname, constraint,
+                                         detect=False):
+        """
+        Verify whether a given column satisfies the constraint on allowed
+        (string) values provided.
+
+        For string columns, this is checked in the database, by counting
+        the non-null values that are not in the allowed list, so the
+        column's distinct values never need to be fetched.
+        """
+        if not self.column_exists(colname):
+            return False
+        if (constraint.value is None
+                or self.get_tdda_type(colname) != 'string'):
+            return BaseConstraintVerifier.verify_allowed_values_constraint(
+                        self, colname, constraint, detect=detect)
+        n_disallowed = self.get_database_n_disallowed(self.tablename, colname,
+                                                      constraint.value)
+        return n_disallowed == 0
+
+
+class DatabaseIncrementalVerifier(DatabaseConstraintVerifier):
+    """
+    A :py:class:`DatabaseIncrementalVerifier` object verifies constraints
+    against a database table to which rows are only ever appended, using
+    a *watermark* column (such as an ingestion timestamp or a serial ID)
+    whose values increase as rows are added.
+
+    Each verification records, in its *state* attribute, the values of
+    the statistics it needed (minima and maxima, null counts, small sets
+    of distinct values, and whether each rex and allowed_values constraint
+    held), along with the largest watermark value seen. Given that state
+    from a previous verification of the table, only rows beyond that
+    watermark are aggregated, and their statistics are merged with the
+    saved ones.
+
+    The saved state is only used if the number of rows up to its watermark
+    is unchanged (so that no rows have been deleted, or added late); and
+    any statistic it does not hold, or that cannot be merged (such as the
+    number of distinct values in a column with too many of them to save),
+    is calculated from the whole table, so the results are always the
+    same as for a full verification, provided rows up to the watermark
+    are not updated in place.
+    """
+    def __init__(self, dbtype, db, tablename, watermark_column, state=None,
+                 epsilon=None, type_checking='strict', testing=False,
+                 rex_distinct=False):
+        """
+        Inputs:
+
+            *dbtype*, *db*, *tablename*:
+                    As for :py:class:`DatabaseConstraintVerifier`.
+            *watermark_column*:
+                    The name of the watermark column.
+            *state*:
+                    The *state* from a previous verification of the table,
+                    or ``None`` to verify the whole table.
+        """
+        DatabaseConstraintVerifier.__init__(self, dbtype, db, tablename,
+                                            epsilon=epsilon,
+                                            type_checking=type_checking,
+                                            testing=testing,
+                                            rex_distinct=rex_distinct)
+        if self.dbtype == 'mongodb':
+            raise Exception('Incremental verification is not supported '
+                            'for MongoDB')
+        self.watermark_column = watermark_column
+        self.previous = state
+        self.incremental = False
+        self.state = None
+
+    def verify(self, constraints, **kwargs):
+        self.prepare()
+        return DatabaseConstraintVerifier.verify(self, constraints, **kwargs)
+
+    def prepare(self):
+        """
+        Find the current watermark, and decide whether the previous state
+        can be used, restricting the table to the rows beyond its
+        watermark if so.
+        """
+        self.cache = {}
+        self.unrestrict_table(self.tablename)
+        self.watermark = self.get_database_max(self.tablename,
+                                               self.watermark_column)
+        self.after = None
+        state = self.previous
+        if (state and state.get('table') == self.tablename
+                and state.get('watermark_column') == self.watermark_column
+                and state.get('watermark') is not None):
+            after = from_state_value(state['watermark'])
+            self.restrict_table(self.tablename, self.watermark_column,
+                                upto=after)
+            if self.get_database_nrows(self.tablename) == state['n_records']:
+                self.after = after
+        self.incremental = self.after is not None
+        self.restrict_table(self.tablename, self.watermark_column,
+                            after=self.after, upto=self.watermark)
+        n_records = self.get_database_nrows(self.tablename)
+        if self.incremental:
+            n_records += state['n_records']
+        self.state = OrderedDict((
+            ('table', self.tablename),
+            ('watermark_column', self.watermark_column),
+            ('watermark', state_value(self.watermark)),
+            ('n_records', n_records),
+            ('fields', OrderedDict()),
+        ))
+
+    def over_full_table(self, f):
+        """
+        Returns the result of calling f() with the table restricted to
+        all of the rows up to the current watermark, rather than just
+        the new ones.
+        """
+        if not self.incremental:
+            return f()
+        self.restrict_table(self.tablename, self.watermark_column,
+                            upto=self.watermark)
+        try:
+            return f()
+        finally:
+            self.restrict_table(self.tablename, self.watermark_column,
+                                after=self.after, upto=self.watermark)
+
+    def previous_field(self, colname):
+        if not self.incremental:
+            return {}
+        return self.previous['fields'].get(colname, {})
+
+    def record(self, colname, stat, value):
+        fields = self.state['fields']
+        if colname not in fields:
+            fields[colname] = OrderedDict()
+        fields[colname][stat] = state_value(value)
+
+    def merged(self, colname, stat, calc, merge):
+        """
+        Returns the value of a statistic for the column, over all the rows,
+        by merging its value for the new rows with its saved value, using
+        the function merge, if possible. The statistic is calculated with
+        calc(self, colname).
+        """
+        previous = self.previous_field(colname)
+        if stat in previous:
+            value = merge(from_state_value(previous[stat]),
+                          calc(self, colname))
+        else:
+            value = self.over_full_table(lambda: calc(self, colname))
+        self.record(colname, stat, value)
+        return value
+
+    def merged_check(self, colname, kind, constraint_value, check):
+        """
+        Returns whether a constraint of the given kind and value, that
+        can only be checked directly, is satisfied by all the rows: if it
+        was satisfied at the previous verification, only the new rows
+        need to be checked with check().
+        """
+        previous = self.previous_field(colname).get('checks', {}).get(kind)
+        if previous is not None and previous['value'] == constraint_value:
+            ok = not previous['failed'] and check()
+        else:
+            ok = self.over_full_table(check)
+        checks = self.state['fields'].setdefault(colname, OrderedDict())
+        checks.setdefault('checks', OrderedDict())[kind] = OrderedDict((
+            ('value', constraint_value),
+            ('failed', not ok),
+        ))
+        return ok
+
+    def get_nrecords(self):
+        return self.state['n_records']
+
+    def calc_min(self, colname):
+        return self.merged(colname, 'min',
+                           DatabaseConstraintVerifier.calc_min, lesser)
+
+    def calc_max(self, colname):
+        return self.merged(colname, 'max',
+                           DatabaseConstraintVerifier.calc_max, greater)
+
+    def calc_min_length(self, colname):
+        return self.merged(colname, 'min_length',
+                           DatabaseConstraintVerifier.calc_min_length, lesser)
+
+    def calc_max_length(self, colname):
+        return self.merged(colname, 'max_length',
+                           DatabaseConstraintVerifier.calc_max_length, greater)
+
+    def calc_null_count(self, colname):
+        return self.merged(colname, 'null_count',
+                           DatabaseConstraintVerifier.calc_null_count, add)
+
+    def calc_non_null_count(self, colname):
+        return self.merged(colname, 'non_null_count',
+                           DatabaseConstraintVerifier.calc_non_null_count, add)
+
+    def calc_unique_values(self, colname, include_nulls=True):
+        def calc(self, colname):
+            return DatabaseConstraintVerifier.calc_unique_values(
+                       self, colname, include_nulls=include_nulls)
+        stat = 'uniques' if include_nulls else 'non_null_uniques'
+        values = self.merged(colname, stat, calc, union)
+        if len(values) > MAX_INCREMENTAL_UNIQUES:
+            del self.state['fields'][colname][stat]
+        return values
+
+    def calc_nunique(self, colname):
+        # The number of distinct values can only be merged by way of the
+        # values themselves, if they were saved.
+        if 'uniques' in self.previous_field(colname):
+            return len([v for v in self.get_unique_values(colname)
+                        if v is not None])
+        return self.over_full_table(
+                    lambda: DatabaseConstraintVerifier.calc_nunique(
+                                self, colname))
+
+    def calc_rex_constraint(self, colname, constraint, detect=False):
+        check = lambda: not DatabaseConstraintVerifier.calc_rex_constraint(
+                                self, colname, constraint)
+        return not self.merged_check(colname, 'rex', constraint.value, check)
+
+    def verify_allowed_values_constraint(self, colname, constraint,
+                                         detect=False):
+        if (not self.column_exists(colname) or constraint.value is None
+                or self.get_tdda_type(colname) != 'string'):
+            return DatabaseConstraintVerifier.verify_allowed_values_constraint(
+                        self, colname, constraint, detect=detect)
+        check = lambda: (DatabaseConstraintVerifier.
+                             verify_allowed_values_constraint(
+                                 self, colname, constraint, detect=detect))
+        return self.merged_check(colname, 'allowed_values', constraint.value,
+                                 check)
+
+
+def lesser(x, y):
+    # the smaller of two values, either of which may be None
+    return y if x is None else x if y is None else min(x, y)
+
+
+def greater(x, y):
+    # the larger of two values, either of which may be None
+    return y if x is None else x if y is None else max(x, y)
+
+
+def add(x, y):
+    return x + y
+
+
+def union(x, y):
+    # the distinct values in either of two lists of values
+    values = set(x) | set(y)
+    return sorted(values, key=lambda v: (v is not None, v))
+
+
+def state_value(value):
+    """
+    Converts a value to a form that can be saved as JSON, in
+    the state from a :py:class:`DatabaseIncrementalVerifier`.
+
+    Dates, datetimes (including any timezone offset) and decimals are
+    saved as tagged ISO-format strings, so that they are read back as
+    the same type.
+    """
+    if isinstance(value, datetime.datetime):
+        return {'datetime': value.isoformat()}
+    elif isinstance(value, datetime.date):
+        return {'date': value.isoformat()}
+    elif isinstance(value, decimal.Decimal):
+        return {'decimal': str(value)}
+    elif isinstance(value, (list, tuple)):
+        return [state_value(v) for v in value]
+    return value
+
+
+def from_state_value(value):
+    """
+    Converts a value saved by :py:func:`state_value` back again.
+    """
+    if isinstance(value, dict):
+        if 'datetime' in value:
+            return parse_isoformat(value['datetime'])
+        elif 'date' in value:
+            return parse_isoformat(value['date']).date()
+        elif 'decimal' in value:
+            return decimal.Decimal(value['decimal'])
+    elif isinstance(value, list):
+        return [from_state_value(v) for v in value]
+    return value
+
+
+def parse_isoformat(s):
+    if hasattr(datetime.datetime, 'fromisoformat'):
+        return datetime.datetime.fromisoformat(s)
+    # older pythons: only naive values are supported
+    if 'T' not in s:
+        return datetime.datetime.strptime(s, '%Y-%m-%d')
+    fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in s else '%Y-%m-%dT%H:%M:%S'
+    return datetime.datetime.strptime(s, fmt)
+
+
+def load_incremental_state(path):
+    """
+    Reads the state saved from an incremental verification, returning
+    ``None`` if there is none.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_incremental_state(path, state):
+    """
+    Saves the state from an incremental verification.
+
+    The state is written to a temporary file which is then renamed
+    into place, so an interrupted run cannot leave a partial state file.
+    """
+    def write(tmppath):
+        with open(tmppath, 'w') as f:
+            json.dump(state, f, indent=4)
+    atomic_write(path, write)
+
 
 class DatabaseVerification(Verification):
     """
@@ -161,6 +559,48 @@ class DatabaseVerification(Verification):
         Verification.__init__(self, *args, **kwargs)
 
 
+class DatabaseVerifications(object):
+    """
+    A :py:class:`DatabaseVerifications` object holds the results of
+    verifying several database tables (see :py:func:`verify_db_tables`).
+
+    Its *verifications* attribute is an ordered dictionary mapping each
+    table name to its :py:class:`DatabaseVerification`, and its *errors*
+    attribute is an ordered dictionary mapping the name of each table that
+    could not be verified to the reason. It also has attributes *passes*
+    and *failures*, for the totals over all the tables that were verified.
+    """
+    def __init__(self, verifications, errors=None):
+        self.verifications = verifications
+        self.errors = errors or OrderedDict()
+        self.passes = sum(v.passes for v in verifications.values())
+        self.failures = sum(v.failures for v in verifications.values())
+
+    def failing_tables(self):
+        """
+        Returns a list of the names of the tables with any failures.
+        """
+        return [name for name, v in self.verifications.items()
+                if v.failures > 0]
+
+    def __str__(self):
+        parts = []
+        for name, v in self.verifications.items():
+            parts.append('TABLE %s:\n\n%s\n' % (name, str(v)))
+        for name, error in self.errors.items():
+            parts.append('TABLE %s:\n\nNot verified: %s\n' % (name, error))
+        nfailing = len(self.failing_tables())
+        parts.append('OVERALL SUMMARY:\n\n'
+                     'Tables passing: %d\n'
+                     'Tables failing: %d\n'
+                     'Tables not verified: %d\n'
+                     'Constraints passing: %d\n'
+                     'Constraints failing: %d'
+                     % (len(self.verifications) - nfailing, nfailing,
+                        len(self.errors), self.passes, self.failures))
+        return '\n'.join(parts)
+
+
 class DatabaseConstraintDiscoverer(DatabaseConstraintCalculator,
                                    BaseConstraintDiscoverer,
                                    DatabaseHandler):
@@ -176,6 +616,15 @@ class DatabaseConstraintDiscoverer(DatabaseConstraintCalculator,
         BaseConstraintDiscoverer.__init__(self, inc_rex=inc_rex, seed=seed)
         self.tablename = tablename
 
+    def string_length_extremes(self, fieldname, uniqs=None):
+        # If the distinct values haven't already been fetched, calculate
+        # the length extremes without fetching them.
+        if uniqs is not None:
+            return BaseConstraintDiscoverer.string_length_extremes(
+                        self, fieldname, uniqs)
+        return (self.calc_min_length(fieldname),
+                self.calc_max_length(fieldname), None)
+
 
 def types_compatible(x, y, colname):
     """
@@ -201,6 +650,8 @@ def types_compatible(x, y, colname):
 
 def verify_db_table(dbtype, db, tablename, constraints_path, epsilon=None,
                     type_checking='strict', testing=False, report='all',
+                    watermark_column=None, state_path=None,
+                    rex_distinct=False, cache_dir=None, change_token=None,
                     **kwargs):
     """
     Verify that (i.e. check whether) the database table provided
@@ -277,6 +728,47 @@ def verify_db_table(dbtype, db, tablename, constraints_path, epsilon=None,
                             when being run as part of an automated test.
                             It suppresses type-compatibility warnings.
 
+        *watermark_column*:
+                            For a table to which rows are only ever
+                            appended, the name of a column whose values
+                            increase as rows are added (such as an
+                            ingestion timestamp or a serial ID). If this
+                            is given, the verification is incremental:
+                            the statistics it needs are saved to
+                            *state_path*, and the next verification only
+                            aggregates the rows added since then (see
+                            :py:class:`~tdda.constraints.db.constraints.DatabaseIncrementalVerifier`).
+
+        *state_path*:
+                            The file for the state saved by incremental
+                            verification. By default, this is the
+                            constraints path, with its extension replaced
+                            by ``.tddastate``.
+
+        *rex_distinct*:
+                            Boolean flag. If set, rex constraints are
+                            checked against the distinct values in each
+                            column (with SELECT DISTINCT), rather than
+                            against every row, which is quicker for
+                            columns with many repeated values.
+
+        *cache_dir*:
+                            If provided, the column statistics and
+                            constraint results are cached in this
+                            directory, and reused when the table is
+                            verified again without having changed (see
+                            :py:class:`~tdda.constraints.cache.VerificationCache`).
+                            This can't be combined with incremental
+                            verification.
+
+        *change_token*:
+                            A string that changes whenever the table
+                            does, for deciding whether cached results can
+                            be reused. By default, this is derived from
+                            the database itself, where possible
+                            (see :py:meth:`~tdda.constraints.db.drivers.SQLDatabaseHandler.get_database_change_token`);
+                            otherwise nothing is cached.
+
     Returns:
 
         :py:class:`~tdda.constraints.db.constraints.DatabaseVerification` object.
@@ -300,16 +792,264 @@ def verify_db_table(dbtype, db, tablename, constraints_path, epsilon=None,
         print('Constraints failing: %d\\n' % v.failures)
         print(str(v))
     """
-    dbv = DatabaseConstraintVerifier(dbtype, db, tablename, epsilon=epsilon,
-                                     type_checking=type_checking,
-                                     testing=testing)
+    if watermark_column and cache_dir:
+        raise Exception('Incremental verification and result caching '
+                        'cannot be used together')
+    if watermark_column:
+        if state_path is None:
+            state_path = os.path.splitext(constraints_path)[0] + '.tddastate'
+        state = load_incremental_state(state_path)
+        dbv = DatabaseIncrementalVerifier(dbtype, db, tablename,
+                                          watermark_column, state=state,
+                                          epsilon=epsilon,
+                                          type_checking=type_checking,
+                                          testing=testing,
+                                          rex_distinct=rex_distinct)
+    else:
+        dbv = DatabaseConstraintVerifier(dbtype, db, tablename,
+                                         epsilon=epsilon,
+                                         type_checking=type_checking,
+                                         testing=testing,
+                                         rex_distinct=rex_distinct)
     if not dbv.check_table_exists(tablename):
         print('No table %s' % tablename, file=sys.stderr)
         sys.exit(1)
     constraints = DatasetConstraints(loadpath=constraints_path)
-    return dbv.verify(constraints,
-                      VerificationClass=DatabaseVerification,
-                      report=report, **kwargs)
+    if cache_dir:
+        token = change_token or dbv.get_database_change_token(dbv.tablename)
+        identity = '%s:%s:%s:%s' % (dbtype, db.host or '', db.database or '',
+                                    dbv.tablename)
+        cache = VerificationCache(cache_dir, identity, token)
+        settings = 'epsilon=%r type_checking=%r' % (epsilon, type_checking)
+        return cache.verify(constraints, lambda: dbv, settings=settings,
+                            VerificationClass=DatabaseVerification,
+                            report=report, **kwargs)
+    v = dbv.verify(constraints,
+                   VerificationClass=DatabaseVerification,
+                   report=report, **kwargs)
+    if watermark_column:
+        save_incremental_state(state_path, dbv.state)
+    return v
+
+
+def verify_db_tables(dbtype, connect, tables, workers=DEFAULT_DB_WORKERS,
+                     epsilon=None, type_checking='strict', testing=False,
+                     report='all', rex_distinct=False, **kwargs):
+    """
+    Verify several database tables, each against its own constraints,
+    using up to *workers* tables at a time, each with its own database
+    connection.
+
+    Mandatory Inputs:
+
+        *dbtype*:
+                            Type of database.
+        *connect*:
+                            A function (taking no arguments) that returns
+                            a new database connection object, as returned
+                            by :py:func:`~tdda.constraints.db.drivers.database_connection`
+                            with *shared* set, since each connection may
+                            be used by more than one thread (one at a time).
+                            Connections are kept in a pool, so at most
+                            *workers* of them are made.
+        *tables*:
+                            A list of (tablename, constraints_path) pairs.
+                            See :py:func:`table_manifest` and
+                            :py:func:`matching_tables` for ways of
+                            constructing this.
+
+    Optional Inputs:
+
+        *workers*:
+                            The maximum number of tables to verify at the
+                            same time.
+
+    The other optional inputs are as for :py:func:`verify_db_table`.
+
+    Returns:
+
+        :py:class:`~tdda.constraints.db.constraints.DatabaseVerifications`
+        object, with the results for the tables in the order given.
+        Tables that don't exist, or that could not be verified for any
+        other reason, are recorded in its *errors* attribute rather than
+        stopping the other tables from being verified.
+    """
+    tables = list(tables)
+    pool = ConnectionPool(connect, max(1, min(workers, len(tables))))
+    results = [None] * len(tables)
+    next_index = [0]
+    lock = threading.Lock()
+
+    def verify_table(tablename, constraints_path):
+        db = None
+        try:
+            db = pool.acquire()
+            dbv = DatabaseConstraintVerifier(dbtype, db, tablename,
+                                             epsilon=epsilon,
+                                             type_checking=type_checking,
+                                             testing=testing,
+                                             rex_distinct=rex_distinct)
+            if not dbv.check_table_exists(dbv.tablename):
+                return 'No table %s' % tablename
+            constraints = DatasetConstraints(loadpath=constraints_path)
+            return dbv.verify(constraints,
+                              VerificationClass=DatabaseVerification,
+                              report=report, **kwargs)
+        except Exception as e:
+            return '%s: %s' % (e.__class__.__name__, str(e))
+        finally:
+            if db is not None:
+                pool.release(db)
+
+    def worker():
+        while True:
+            with lock:
+                i = next_index[0]
+                next_index[0] += 1
+            if i >= len(tables):
+                return
+            results[i] = verify_table(*tables[i])
+
+    threads = [threading.Thread(target=worker) for i in range(pool.size)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        pool.close()
+
+    verifications = OrderedDict()
+    errors = OrderedDict()
+    for (tablename, constraints_path), result in zip(tables, results):
+        if isinstance(result, Verification):
+            verifications[tablename] = result
+        else:
+            errors[tablename] = result or 'Verification did not complete'
+    return DatabaseVerifications(verifications, errors)
+
+
+def table_manifest(path):
+    """
+    Read a manifest of database tables to verify, from a JSON file.
+
+    The file should contain either an object mapping table names to
+    constraints files, or a list of [tablename, constraints_path] pairs.
+    Relative constraints paths are taken to be relative to the directory
+    containing the manifest.
+
+    Returns a list of (tablename, constraints_path) pairs, suitable
+    for passing to :py:func:`verify_db_tables`.
+    """
+    with open(path) as f:
+        manifest = json.load(f, object_pairs_hook=OrderedDict)
+    pairs = manifest.items() if isinstance(manifest, dict) else manifest
+    dirname = os.path.dirname(os.path.abspath(path))
+    return [(table, os.path.join(dirname, constraints_path))
+            for (table, constraints_path) in pairs]
+
+
+def matching_tables(dbtype, db, pattern, constraints_dir='.'):
+    """
+    Find the database tables whose names match a (shell-style, wildcard)
+    pattern, such as ``sales_*`` or ``myschema.*``, for which there is
+    a constraints file called ``<tablename>.tdda`` in *constraints_dir*.
+
+    Returns a list of (tablename, constraints_path) pairs, suitable
+    for passing to :py:func:`verify_db_tables`.
+    """
+    dbh = DatabaseHandler(dbtype, db)
+    schema = pattern.split('.')[0] if '.' in pattern else None
+    pairs = []
+    for tablename in dbh.get_database_table_names(schema):
+        if not (fnmatch.fnmatchcase(tablename, pattern)
+                or fnmatch.fnmatchcase(tablename.split('.')[-1], pattern)):
+            continue
+        path = os.path.join(constraints_dir, tablename + '.tdda')
+        if not os.path.exists(path):
+            path = os.path.join(constraints_dir,
+                                tablename.split('.')[-1] + '.tdda')
+        if os.path.exists(path):
+            pairs.append((tablename, path))
+    return pairs
+
+
+def widen_sampled_constraints(disco, constraints, fraction):
+    """
+    Widen min, max and max_nulls constraints discovered from a sample
+    of a table's rows (see :py:func:`discover_db_table`), to allow for
+    values in the rest of the table.
+
+    Min and max values (for numeric and date fields) are widened by the
+    average gap between sampled values, (max - min) / (n - 1), which is
+    an estimate of how far beyond the sample the true extremes lie.
+    They are not widened past what the field's sign constraint allows,
+    since the sign of the values in a field is rarely accidental.
+
+    A sample with k nulls (out of a fraction f of the table) is consistent
+    with up to about (k + 3) / f nulls in the table, as a whole, so
+    max_nulls is widened to that.
+
+    Nothing is widened if the sample is the whole table.
+    """
+    if fraction >= 1:
+        return
+    for name, field in constraints.fields.items():
+        kinds = field.constraints
+        if 'min' in kinds and 'max' in kinds:
+            m = kinds['min'].value
+            M = kinds['max'].value
+            n = disco.calc_non_null_count(name)
+            if (n > 1 and type(m) in (int, long, float, datetime.datetime)
+                    and type(m) is type(M) and m < M):
+                gap = (M - m) / (n - 1)
+                wm = m - gap
+                wM = M + gap
+                if type(m) in (int, long):
+                    wm = int(math.floor(wm))
+                    wM = int(math.ceil(wM))
+                if 'sign' in kinds:
+                    (wm, wM) = sign_limits(kinds['sign'].value, m, M,
+                                           wm, wM)
+                kinds['min'].value = wm
+                kinds['max'].value = wM
+        if 'max_nulls' in kinds:
+            k = kinds['max_nulls'].value
+            kinds['max_nulls'].value = int(math.ceil((k + 3) / fraction))
+
+
+def sign_limits(sign, m, M, wm, wM):
+    """
+    Limit widened min and max values (wm and wM, widened from m and M) so
+    that they are still consistent with the sign constraint discovered.
+
+    Integers stop at the nearest value of the right sign; real values
+    that would reach or cross zero are only widened half way to it.
+    """
+    is_int = type(m) in (int, long)
+    if sign == 'positive' and wm <= 0:
+        wm = 1 if is_int else m / 2
+    elif sign == 'non-negative':
+        wm = max(wm, type(m)(0))
+    if sign == 'negative' and wM >= 0:
+        wM = -1 if is_int else M / 2
+    elif sign == 'non-positive':
+        wM = min(wM, type(M)(0))
+    return (wm, wM)
+
+
+def confirm_constraints(dbtype, db, tablename, constraints):
+    """
+    Verify constraints against a full database table, and remove any that
+    are not satisfied.
+    """
+    dbv = DatabaseConstraintVerifier(dbtype, db, tablename, testing=True)
+    v = dbv.verify(constraints, VerificationClass=DatabaseVerification)
+    for name, results in v.fields.items():
+        field = constraints.fields[name]
+        for kind, satisfied in results.items():
+            if satisfied is False and kind in field.constraints:
+                del field.constraints[kind]
 
 
 def detect_db_table(dbtype, db, tablename, constraints_path, epsilon=None,
@@ -322,7 +1062,10 @@ def detect_db_table(dbtype, db, tablename, constraints_path, epsilon=None,
                               'for databases.')
 
 
-def discover_db_table(dbtype, db, tablename, inc_rex=False, seed=None):
+def discover_db_table(dbtype, db, tablename, inc_rex=False, seed=None,
+                      sample=None, sample_method=None, confirm=True,
+                      schema_sample_size=DEFAULT_SCHEMA_SAMPLE_SIZE,
+                      confirm_schema=False):
     """
     Automatically discover potentially useful constraints that characterize
     the database table provided.
@@ -336,6 +1079,41 @@ def discover_db_table(dbtype, db, tablename, inc_rex=False, seed=None):
         *tablename*:
             a table name
 
+    Optional Input:
+
+        *sample*:
+            If specified, this is the (approximate) fraction of the
+            table's rows from which the constraints are discovered, rather
+            than using all of them. See
+            :py:meth:`~tdda.constraints.db.drivers.SQLDatabaseHandler.sample_table`
+            for how the sample is taken. This is not supported for MongoDB.
+
+            Because the sample may not include the most extreme values
+            in the table, discovered min and max constraints are widened
+            by the average spacing between the sampled values, and
+            max_nulls constraints are widened to an upper bound on the
+            number of nulls that could have been missed.
+
+        *sample_method*:
+            For PostgreSQL, ``system`` (the default) or ``bernoulli``.
+
+        *confirm*:
+            If sampling, the constraints kept from the sample are then
+            verified against the full table, and any that do not hold are
+            dropped, so that the constraints returned are all satisfied by
+            the table. Set this to ``False`` to skip this (and just get the
+            constraints from the sample).
+
+        *schema_sample_size*:
+            For MongoDB, the number of documents sampled to find the
+            fields in the collection, and the types of their values.
+            Fields missing from the sample are only included if they
+            are needed by name. Set this to ``None`` to use every document.
+
+        *confirm_schema*:
+            For MongoDB, find the fields and their types from every
+            document, rather than from a sample.
+
     Possible return values:
 
     -  :py:class:`~tdda.constraints.base.DatasetConstraints` object
@@ -441,10 +1219,22 @@ def discover_db_table(dbtype, db, tablename, inc_rex=False, seed=None):
     if not disco.check_table_exists(tablename):
         print('No table %s' % tablename, file=sys.stderr)
         sys.exit(1)
+    if dbtype == 'mongodb':
+        disco.sample_schema(schema_sample_size, confirm=confirm_schema)
+    if sample:
+        disco.sample_table(disco.tablename, sample, method=sample_method,
+                           seed=seed)
+        n_selected = disco.get_nrecords()
     constraints = disco.discover()
+    if constraints and sample:
+        widen_sampled_constraints(disco, constraints, sample)
+        disco.unrestrict_table(disco.tablename)
+        if confirm:
+            confirm_constraints(dbtype, db, disco.tablename, constraints)
     if constraints:
-        nrows = disco.get_nrows(tablename)
-        constraints.set_stats(n_records=nrows, n_selected=nrows)
+        nrows = disco.get_nrows(tablename) if confirm or not sample else None
+        constraints.set_stats(n_records=nrows,
+                              n_selected=n_selected if sample else nrows)
         constraints.set_dates_user_host_creator()
         constraints.set_rdbms('%s:%s:%s:%s' % (dbtype or '', db.host or '',
                                                db.user, db.database))
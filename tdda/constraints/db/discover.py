@@ -25,6 +25,18 @@ Parameters:
   * constraints.tdda, if provided, specifies the name of a file to
     which the generated constraints will be written.
 
+Use --sample FRACTION to discover constraints from a random sample of
+roughly that fraction of the table's rows, rather than the whole table.
+Minimum and maximum values are widened to allow for values not seen in
+the sample, and the resulting constraints are then checked against the
+full table, dropping any that fail; use --no-confirm to skip that check.
+Use --seed N to make the sample repeatable.
+
+For MongoDB, the fields in a collection (and the types of their values)
+are found from a random sample of its documents; use --schema-sample N
+to set the number of documents sampled (default 1000), or
+--confirm-schema to use every document.
+
 '''
 
 import os
@@ -71,10 +83,39 @@ def get_params(args):
     parser.add_argument('table', nargs=1, help='database table name')
     parser.add_argument('constraints', nargs='?',
                         help='name of constraints file to create')
+    parser.add_argument('--sample', type=float, metavar='FRACTION',
+                        help='discover from a sample of about this '
+                             'fraction of the rows')
+    parser.add_argument('--sample-method', choices=['system', 'bernoulli'],
+                        help='sampling method, where the database '
+                             'supports a choice')
+    parser.add_argument('--seed', type=int,
+                        help='seed for repeatable sampling')
+    parser.add_argument('--no-confirm', action='store_true',
+                        help='do not check sampled constraints against '
+                             'the full table')
+    parser.add_argument('--schema-sample', type=int, metavar='N',
+                        help='number of MongoDB documents sampled to find '
+                             'fields')
+    parser.add_argument('--confirm-schema', action='store_true',
+                        help='find MongoDB fields from every document')
     params = {}
     flags = database_arg_flags(discover_flags, parser, args, params)
     params['table'] = flags.table[0] if flags.table else None
     params['constraints_path'] = flags.constraints
+    if flags.sample is not None:
+        if not 0 < flags.sample <= 1:
+            print('--sample must be between 0 and 1', file=sys.stderr)
+            sys.exit(1)
+        params['sample'] = flags.sample
+        params['sample_method'] = flags.sample_method
+        params['confirm'] = not flags.no_confirm
+    if flags.seed is not None:
+        params['seed'] = flags.seed
+    if flags.schema_sample is not None:
+        params['schema_sample_size'] = flags.schema_sample
+    if flags.confirm_schema:
+        params['confirm_schema'] = True
     return params
 
 
@@ -9,10 +9,15 @@ from __future__ import print_function
 
 import datetime
 import getpass
+import itertools
 import json
 import os
+import random
 import re
 import sys
+import threading
+
+from collections import OrderedDict
 
 try:
     import pgdb
@@ -37,6 +42,11 @@ try:
 except ImportError:
     pymongo = None
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 
 from tdda.constraints.base import UNICODE_TYPE
 from tdda.constraints.baseconstraints import unicode_string, long_type
@@ -44,6 +54,28 @@ from tdda.constraints.flags import (discover_parser, discover_flags,
                                     verify_parser, verify_flags)
 
 
+# Maximum number of values in a single SQL IN (...) list
+MAX_SQL_IN_LIST = 1000
+
+# Number of rows fetched at a time when streaming query results
+DEFAULT_FETCH_SIZE = 10000
+
+# Number of documents sampled to find the fields in a MongoDB collection
+DEFAULT_SCHEMA_SAMPLE_SIZE = 1000
+
+# TDDA types for BSON types (as named by MongoDB's $type)
+BSON_TDDA_TYPES = {
+    'bool': 'bool',
+    'int': 'int',
+    'long': 'int',
+    'double': 'real',
+    'decimal': 'real',
+    'string': 'string',
+    'date': 'date',
+    'timestamp': 'date',
+}
+
+
 DATABASE_USAGE = '''
 
 Database connection flags:
@@ -141,10 +173,13 @@ def database_arg_flags(create_flags, parser, args, params):
 
 def database_connection(table=None, conn=None, dbtype=None, db=None,
                         host=None, port=None, user=None, password=None,
-                        schema=None):
+                        schema=None, shared=False):
     """
     Connect to a database, using an appropriate driver for the type
     of database specified.
+
+    If *shared* is set, the connection may be used by several threads,
+    one at a time, as it is when it is made for a :py:class:`ConnectionPool`.
     """
     if conn:
         defaults = ConnectionSpec(conn)
@@ -195,7 +230,7 @@ def database_connection(table=None, conn=None, dbtype=None, db=None,
     dbtypelower = dbtype.lower()
     if dbtypelower in DATABASE_CONNECTORS:
         connector = DATABASE_CONNECTORS[dbtypelower]
-        conn = connector(host, port, db, user, password)
+        conn = connector(host, port, db, user, password, shared=shared)
         if conn is None:
             sys.exit(1)   # error message already reported
         return Connection(conn, schema, host=host, port=port, database=db,
@@ -205,7 +240,8 @@ def database_connection(table=None, conn=None, dbtype=None, db=None,
         sys.exit(1)
 
 
-def database_connection_postgres(host, port, db, user, password):
+def database_connection_postgres(host, port, db, user, password,
+                                 shared=False):
     if pgdb:
         if port is not None:
             host = host + ':' + str(port)
@@ -216,7 +252,8 @@ def database_connection_postgres(host, port, db, user, password):
         sys.exit(1)
 
 
-def database_connection_mysql(host, port, db, user, password):
+def database_connection_mysql(host, port, db, user, password,
+                              shared=False):
     if MySQLdb:
         # TODO: should provide support for MySQL 'option-files' too.
         if host is None:
@@ -239,17 +276,28 @@ def database_connection_mysql(host, port, db, user, password):
         print('MySQL driver not available', file=sys.stderr)
 
 
-def database_connection_sqlite(host, port, db, user, password):
+def database_connection_sqlite(host, port, db, user, password,
+                               shared=False):
     if sqlite3:
-        conn = sqlite3.connect(db)
+        # sqlite only allows a connection to be used by the thread that
+        # made it, unless it is explicitly shared (one at a time)
+        conn = sqlite3.connect(db, check_same_thread=not shared)
         conn.create_function('regexp', 2, regex_matcher)
+        try:
+            conn.create_function('tdda_rex_match', 2, rex_matcher,
+                                 deterministic=True)
+        except (TypeError, sqlite3.NotSupportedError):
+            # older python or sqlite versions can't mark functions as
+            # deterministic
+            conn.create_function('tdda_rex_match', 2, rex_matcher)
         return conn
     else:
         print('sqlite driver not available', file=sys.stderr)
         sys.exit(1)
 
 
-def database_connection_mongodb(host, port, db, user, password):
+def database_connection_mongodb(host, port, db, user, password,
+                                shared=False):
     if pymongo:
         if host is None:
             host = 'localhost'
@@ -275,6 +323,27 @@ def regex_matcher(expr, item):
         return re.match(expr, item) is not None
 
 
+# Compiled regular expressions used by rex_matcher, keyed by pattern
+compiled_rexes = {}
+
+
+def rex_matcher(pattern, item):
+    """
+    Implementation of the Sqlite tdda_rex_match(pattern, item) function,
+    used to check rex constraints. Unlike REGEXP, the pattern (which
+    combines all of a constraint's alternatives) is only compiled once,
+    rather than being looked up again for each value.
+    """
+    if item is None:
+        return False
+    rex = compiled_rexes.get(pattern)
+    if rex is None:
+        if len(compiled_rexes) >= 1000:
+            compiled_rexes.clear()
+        rex = compiled_rexes[pattern] = re.compile(pattern)
+    return rex.match(item) is not None
+
+
 class ConnectionSpec:
     """
     Class for reading a connection specification file.
@@ -311,6 +380,53 @@ class Connection:
         self.database = database
         self.user = user
 
+    def close(self):
+        # (connections to MongoDB databases don't need to be closed)
+        if hasattr(type(self.connection), 'close'):
+            self.connection.close()
+
+
+class ConnectionPool:
+    """
+    A bounded pool of database connections, for use by several threads.
+
+    *connect* is a function (taking no arguments) that returns a new
+    :py:class:`Connection`, made with *shared* set so that it can be
+    used from any thread (see :py:func:`database_connection`). Connections are only made when they are needed,
+    and there are never more than *size* of them. A connection taken from
+    the pool with :py:meth:`acquire` is only used by one thread at a time,
+    until it is given back with :py:meth:`release`.
+    """
+    def __init__(self, connect, size):
+        if size < 1:
+            raise Exception('Connection pool size must be at least 1')
+        self.connect = connect
+        self.size = size
+        self.idle = queue.Queue()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if len(self.connections) < self.size:
+                conn = self.connect()
+                self.connections.append(conn)
+                return conn
+        return self.idle.get()
+
+    def release(self, conn):
+        self.idle.put(conn)
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+
 
 class DatabaseHandler:
     """
@@ -337,11 +453,17 @@ class SQLDatabaseHandler:
     """
     Common database SQL support
     """
+    cursor_ids = itertools.count(1)   # for naming server-side cursors
+
     def __init__(self, dbtype, db):
         self.dbtype = dbtype
         self.db = db.connection
         self.schema = db.schema
+        self.host = db.host
+        self.database = db.database
         self.cursor = db.connection.cursor()
+        self.lengths = {}
+        self.subsets = {}
 
     def quoted(self, name):
         # quote a columnname
@@ -365,6 +487,52 @@ class SQLDatabaseHandler:
         self.cursor.execute(sql)
         return self.cursor.fetchall()
 
+    def execute_batches(self, sql, batchsize=DEFAULT_FETCH_SIZE):
+        """
+        Execute a SQL query, yielding its rows in lists of (at most)
+        batchsize rows, so that the full result never has to be held
+        in memory at once.
+
+        For PostgreSQL, this uses a server-side cursor, declared in SQL
+        (so that it works with any driver); for MySQL, it uses an
+        unbuffered cursor; SQLite cursors already fetch rows lazily.
+        """
+        if self.dbtype in ('postgres', 'postgresql'):
+            name = 'tdda_cursor_%d' % next(SQLDatabaseHandler.cursor_ids)
+            cursor = self.db.cursor()
+            cursor.execute('DECLARE %s NO SCROLL CURSOR FOR %s' % (name, sql))
+            try:
+                while True:
+                    cursor.execute('FETCH FORWARD %d FROM %s'
+                                   % (batchsize, name))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                cursor.execute('CLOSE %s' % name)
+                cursor.close()
+        else:
+            cursor = self.unbuffered_cursor()
+            try:
+                cursor.execute(sql)
+                while True:
+                    rows = cursor.fetchmany(batchsize)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                cursor.close()
+
+    def unbuffered_cursor(self):
+        # a cursor that doesn't fetch all the results of a query
+        # to the client when it's executed, where the driver supports that.
+        if self.dbtype == 'mysql':
+            cursors = getattr(MySQLdb, 'cursors', None)
+            if cursors is not None and hasattr(cursors, 'SSCursor'):
+                return self.db.cursor(cursors.SSCursor)
+        return self.db.cursor()
+
     def db_value_is_null(self, value):
         return value is None
 
@@ -431,6 +599,25 @@ class SQLDatabaseHandler:
             raise Exception('Permission denied')
         return self.execute_scalar(sql) > 0
 
+    def get_database_table_names(self, schema=None):
+        """
+        Returns the (schema-qualified, where applicable) names of the
+        tables and views in a schema (or the default schema).
+        """
+        if self.dbtype in ('postgres', 'postgresql', 'mysql'):
+            schema = schema or self.default_schema()
+            sql = '''SELECT table_name FROM information_schema.tables
+                     WHERE table_schema = %s
+                     ORDER BY table_name;''' % self.literal(schema)
+            return ['%s.%s' % (schema, r[0]) for r in self.execute_all(sql)]
+        elif self.dbtype == 'sqlite':
+            sql = '''SELECT name FROM sqlite_master
+                     WHERE (type = 'table' OR type = 'view')
+                     ORDER BY name;'''
+            return [r[0] for r in self.execute_all(sql)]
+        else:
+            raise Exception('Unsupported database type %s' % self.dbtype)
+
     def get_nrows(self, tablename):
         (schema, table) = self.split_name(tablename)
         if schema:
@@ -457,6 +644,85 @@ class SQLDatabaseHandler:
         else:
             raise Exception('Unsupported database type')
 
+    def check_column_exists(self, tablename, colname):
+        return colname in self.get_database_column_names(tablename)
+
+    def get_database_change_token(self, tablename):
+        """
+        Returns a string that changes whenever the contents of a table
+        change, derived from the database itself, or ``None`` if
+        there is no reliable way of doing that.
+
+        For SQLite, this is the size and modification time of the
+        database file (and its write-ahead log). SQLite's own data_version
+        can't be used, since it is only meaningful within a single
+        connection.
+
+        For PostgreSQL, it is the server's current write-ahead log
+        position, together with the table's storage file number (which
+        changes if it is truncated or rewritten). The table statistics
+        views can't be used, since they are updated asynchronously, so
+        could hide a change; the log position changes as soon as the table
+        does, but also whenever anything else on the server is written,
+        so on a busy server it is better to supply a token. Tables that
+        aren't logged (unlogged and temporary tables) get no token.
+
+        For MySQL, it is the table's creation and update times, when the
+        storage engine records the latter. MySQL 8 caches these for a day
+        by default, so the session is first told not to. Since the update
+        time is only recorded to the second, there is no token if the
+        table has been updated within the last couple of seconds.
+        """
+        if self.dbtype == 'sqlite':
+            if not self.database or not os.path.isfile(self.database):
+                return None
+            parts = []
+            for path in (self.database, self.database + '-wal'):
+                if os.path.exists(path):
+                    st = os.stat(path)
+                    parts.append('%d:%r' % (st.st_size, st.st_mtime))
+            return ':'.join(parts)
+        elif self.dbtype in ('postgres', 'postgresql'):
+            version = int(self.execute_scalar('SHOW server_version_num'))
+            if version < 100000:
+                return None     # the log functions were renamed in 10
+            sql = '''
+                SELECT c.relfilenode,
+                       CASE WHEN pg_is_in_recovery()
+                            THEN pg_last_wal_replay_lsn()
+                            ELSE pg_current_wal_insert_lsn()
+                       END,
+                       c.relpersistence
+                FROM pg_class c
+                WHERE c.oid = %s::regclass;
+                ''' % self.literal(tablename)
+            rows = self.execute_all(sql)
+            if not rows or rows[0][2] != 'p':
+                return None
+            rows = [rows[0][:2]]
+        elif self.dbtype == 'mysql':
+            try:
+                self.cursor.execute('SET SESSION '
+                                    'information_schema_stats_expiry = 0')
+            except Exception:
+                pass            # not MySQL 8, so statistics aren't cached
+            (schema, table) = self.split_name(tablename)
+            sql = '''
+                SELECT CREATE_TIME, UPDATE_TIME,
+                       TIMESTAMPDIFF(SECOND, UPDATE_TIME, NOW())
+                FROM INFORMATION_SCHEMA.TABLES
+                WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s;
+                ''' % (self.literal(schema) if schema else 'DATABASE()',
+                       self.literal(table))
+            rows = self.execute_all(sql)
+            if rows and (rows[0][1] is None or rows[0][2] is None
+                         or rows[0][2] < 2):
+                return None
+            rows = [rows[0][:2]] if rows else rows
+        else:
+            return None
+        return ':'.join(str(x) for x in rows[0]) if rows else None
+
     def get_database_column_type(self, tablename, colname):
         typeMap = {
             'int'                        : 'int',
@@ -524,18 +790,94 @@ class SQLDatabaseHandler:
         dtype = typeMap[typeresult.lower()]
         return dtype
 
+    def relation(self, tablename):
+        """
+        The SQL relation that statistics for a table are calculated from:
+        the table itself, unless it is being sampled or restricted.
+        """
+        return self.subsets.get(tablename, tablename)
+
+    def sample_table(self, tablename, fraction, method=None, seed=None):
+        """
+        From now on, calculate statistics for the table from a sample of
+        (approximately) the given fraction of its rows, rather than from
+        all of them.
+
+        For PostgreSQL, the sample is taken with TABLESAMPLE, using *method*
+        ``system`` (the default, which samples whole blocks) or
+        ``bernoulli`` (which samples individual rows), and for SQLite, rows
+        are chosen by a hash of their rowid; in both cases, the same rows
+        are used for every statistic. For MySQL, rows are chosen with a
+        seeded RAND(), whose values depend on the order in which each query
+        reads the rows, so different statistics may come from (slightly)
+        different samples.
+        """
+        if not 0 < fraction <= 1:
+            raise Exception('Sample fraction must be in the range (0, 1]')
+        if seed is None:
+            seed = random.randint(0, 2 ** 31 - 1)
+        if self.dbtype in ('postgres', 'postgresql'):
+            method = (method or 'system').upper()
+            if method not in ('SYSTEM', 'BERNOULLI'):
+                raise Exception('Unknown sampling method %s' % method)
+            sample = ('(SELECT * FROM %s TABLESAMPLE %s (%r) REPEATABLE (%d))'
+                      % (tablename, method, fraction * 100, seed))
+        elif self.dbtype == 'sqlite':
+            sample = ('(SELECT * FROM %s WHERE '
+                      '((rowid + %d) * 1103515245) %% 2147483648 < %d)'
+                      % (tablename, seed % 1048576,
+                         int(fraction * 2147483648)))
+        elif self.dbtype == 'mysql':
+            sample = ('(SELECT * FROM %s WHERE RAND(%d) < %r)'
+                      % (tablename, seed, fraction))
+        else:
+            raise Exception('Sampling is not supported for database type %s'
+                            % self.dbtype)
+        self.subsets[tablename] = sample + ' AS tdda_sample'
+
+    def restrict_table(self, tablename, colname, after=None, upto=None):
+        """
+        From now on, calculate statistics for the table only from the
+        rows whose value in *colname* is greater than *after* (if given)
+        and no greater than *upto* (if given).
+
+        Rows where *colname* is null are included only if *after* is
+        not given.
+        """
+        name = self.quoted(colname)
+        conditions = []
+        if after is not None:
+            conditions.append('%s > %s' % (name, self.literal(after)))
+        if upto is not None:
+            upto = '%s <= %s' % (name, self.literal(upto))
+            if after is None:
+                upto = '(%s OR %s IS NULL)' % (upto, name)
+            conditions.append(upto)
+        if conditions:
+            self.subsets[tablename] = ('(SELECT * FROM %s WHERE %s) '
+                                       'AS tdda_subset'
+                                       % (tablename, ' AND '.join(conditions)))
+        else:
+            self.unrestrict_table(tablename)
+
+    def unrestrict_table(self, tablename):
+        """
+        Go back to calculating statistics for the table from all its rows.
+        """
+        self.subsets.pop(tablename, None)
+
     def get_database_nrows(self, tablename):
-        sql = 'SELECT COUNT(*) FROM %s' % tablename
+        sql = 'SELECT COUNT(*) FROM %s' % self.relation(tablename)
         return self.execute_scalar(sql)
 
     def get_database_nnull(self, tablename, colname):
         sql = ('SELECT COUNT(*) FROM %s WHERE %s IS NULL'
-               % (tablename, self.quoted(colname)))
+               % (self.relation(tablename), self.quoted(colname)))
         return self.execute_scalar(sql)
 
     def get_database_nnonnull(self, tablename, colname):
         sql = ('SELECT COUNT(*) FROM %s WHERE %s IS NOT NULL'
-               % (tablename, self.quoted(colname)))
+               % (self.relation(tablename), self.quoted(colname)))
         return self.execute_scalar(sql)
 
     def get_database_min(self, tablename, colname):
@@ -543,9 +885,10 @@ class SQLDatabaseHandler:
         if ctype == 'bool':
             asint = self.cast_bool_to_int(self.quoted(colname))
             expr = self.cast_int_to_bool('MIN(%s)' % asint)
-            sql = 'SELECT %s FROM %s' % (expr, tablename)
+            sql = 'SELECT %s FROM %s' % (expr, self.relation(tablename))
         else:
-            sql = 'SELECT MIN(%s) FROM %s' % (self.quoted(colname), tablename)
+            sql = 'SELECT MIN(%s) FROM %s' % (self.quoted(colname),
+                                              self.relation(tablename))
         result = self.execute_scalar(sql)
         if ctype == 'date' and type(result) is str:
             result = datetime.datetime.strptime(result, '%Y-%m-%d %H:%M:%S')
@@ -556,55 +899,132 @@ class SQLDatabaseHandler:
         if ctype == 'bool':
             asint = self.cast_bool_to_int(self.quoted(colname))
             expr = self.cast_int_to_bool('MAX(%s)' % asint)
-            sql = 'SELECT %s FROM %s' % (expr, tablename)
+            sql = 'SELECT %s FROM %s' % (expr, self.relation(tablename))
         else:
-            sql = 'SELECT MAX(%s) FROM %s' % (self.quoted(colname), tablename)
+            sql = 'SELECT MAX(%s) FROM %s' % (self.quoted(colname),
+                                              self.relation(tablename))
         result = self.execute_scalar(sql)
         if ctype == 'date' and type(result) is str:
             result = datetime.datetime.strptime(result, '%Y-%m-%d %H:%M:%S')
         return result
 
     def get_database_min_length(self, tablename, colname):
-        return self.extreme_length(tablename, colname, min, 'MIN')
+        return self.length_extremes(tablename, colname)[0]
 
     def get_database_max_length(self, tablename, colname):
-        return self.extreme_length(tablename, colname, max, 'MAX')
-
-    def extreme_length(self, tablename, colname, agg, sqlagg):
-        if self.dbtype == 'mysql':
-            uniqs = self.get_database_unique_values(tablename, colname)
-            if uniqs:
-                if type(uniqs[0]) is unicode_string:
-                    L = [len(v) for v in uniqs]
-                else:
-                    L = [len(v.decode('UTF-8')) for v in uniqs]
-                x = agg([len(s) for s in uniqs])
-            else:
-                return None
-        else:
-            sql = 'SELECT %s(LENGTH(%s)) FROM %s' % (sqlagg,
-                                                     self.quoted(colname),
-                                                     tablename)
-            return self.execute_scalar(sql)
+        return self.length_extremes(tablename, colname)[1]
+
+    def length_extremes(self, tablename, colname):
+        # The minimum and maximum string lengths in a column, found with
+        # a single query the first time either of them is needed.
+        source = self.relation(tablename)
+        key = (source, colname)
+        if key not in self.lengths:
+            # MySQL's LENGTH is in bytes, so use CHAR_LENGTH there
+            length = 'CHAR_LENGTH' if self.dbtype == 'mysql' else 'LENGTH'
+            expr = '%s(%s)' % (length, self.quoted(colname))
+            sql = 'SELECT MIN(%s), MAX(%s) FROM %s' % (expr, expr, source)
+            self.cursor.execute(sql)
+            self.lengths[key] = tuple(self.cursor.fetchall()[0])
+        return self.lengths[key]
 
     def get_database_nunique(self, tablename, colname):
         colname = self.quoted(colname)
         sql = ('SELECT COUNT(DISTINCT %s) FROM %s WHERE %s IS NOT NULL'
-               % (colname, tablename, colname))
+               % (colname, self.relation(tablename), colname))
         return self.execute_scalar(sql)
 
     def get_database_unique_values(self, tablename, colname,
                                    sorted_values=True, include_nulls=False):
+        values = []
+        for batch in self.iter_database_unique_values(
+                            tablename, colname, sorted_values=sorted_values,
+                            include_nulls=include_nulls):
+            values.extend(batch)
+        return values
+
+    def iter_database_unique_values(self, tablename, colname,
+                                    sorted_values=True, include_nulls=False,
+                                    batchsize=DEFAULT_FETCH_SIZE):
+        """
+        Yields the distinct values of a column in lists of (at most)
+        batchsize values.
+        """
         colname = self.quoted(colname)
         whereclause = ('' if include_nulls
                        else 'WHERE %s IS NOT NULL' % colname)
         orderby = ('ORDER BY %s ASC' % colname) if sorted_values else ''
-        sql = 'SELECT DISTINCT %s FROM %s %s %s' % (colname, tablename,
+        sql = 'SELECT DISTINCT %s FROM %s %s %s' % (colname,
+                                                    self.relation(tablename),
                                                     whereclause, orderby)
-        result = self.execute_all(sql)
-        return [x[0] for x in result]
+        for rows in self.execute_batches(sql, batchsize=batchsize):
+            yield [x[0] for x in rows]
+
+    def literal(self, value):
+        # a value as a SQL literal
+        if value is None:
+            return 'NULL'
+        elif isinstance(value, bool):
+            return '1' if value else '0'
+        elif isinstance(value, (int, long_type, float)):
+            return repr(value)
+        if not isinstance(value, unicode_string):
+            value = str(value)
+        if self.dbtype == 'mysql':
+            value = value.replace('\\', '\\\\')
+        return "'%s'" % value.replace("'", "''")
 
-    def get_database_rex_match(self, tablename, colname, rexes):
+    def not_in_condition(self, tablename, colname, values):
+        # SQL condition for a (non-null) column value not being any of
+        # the values given. Long lists are split into several NOT IN
+        # clauses, to keep each of them to a reasonable size.
+        name = self.quoted(colname)
+        value = name
+        literal = self.literal
+        if self.dbtype == 'mysql':
+            # MySQL's default collations ignore case and trailing spaces,
+            # so compare bytes there, to match exactly as Python does,
+            # with the values encoded in the column's character set.
+            value = 'CAST(%s AS BINARY)' % name
+            charset = self.column_charset(tablename, colname)
+            if charset:
+                literal = lambda v: ('CONVERT(%s USING %s)'
+                                     % (self.literal(v), charset))
+        values = [v for v in values if v is not None]
+        chunks = [values[i:i + MAX_SQL_IN_LIST]
+                  for i in range(0, len(values), MAX_SQL_IN_LIST)]
+        conditions = ['%s IS NOT NULL' % name]
+        conditions += ['%s NOT IN (%s)'
+                       % (value, ', '.join(literal(v) for v in chunk))
+                       for chunk in chunks]
+        return ' AND '.join(conditions)
+
+    def column_charset(self, tablename, colname):
+        # the character set of a MySQL string column
+        (schema, table) = self.split_name(tablename)
+        sql = '''
+            SELECT CHARACTER_SET_NAME FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s
+             AND COLUMN_NAME = %s;
+            ''' % (self.literal(schema) if schema else 'DATABASE()',
+                   self.literal(table), self.literal(colname))
+        return self.execute_scalar(sql)
+
+    def get_database_n_disallowed(self, tablename, colname, allowed_values):
+        sql = ('SELECT COUNT(*) FROM %s WHERE %s'
+               % (self.relation(tablename),
+                  self.not_in_condition(tablename, colname, allowed_values)))
+        return self.execute_scalar(sql)
+
+    def get_database_rex_match(self, tablename, colname, rexes,
+                               distinct=False):
+        """
+        Checks whether every non-null value in a column matches at least
+        one of the regular expressions given.
+
+        If *distinct* is set, each distinct value is only checked once,
+        which is quicker for columns with many repeated values.
+        """
         if rexes is None:      # a null value is not considered to be an
             return True        # active constraint, so is always satisfied
         name = self.quoted(colname)
@@ -616,15 +1036,22 @@ class SQLDatabaseHandler:
             rexes = [r.replace('\\d', '[0-9]') for r in rexes]
             rexprs = ["(%s REGEXP '%s')" % (name, r) for r in rexes]
         elif self.dbtype == 'sqlite':
-            # sqlite doesn't support regular expressions unless the
-            # regexp() user-defined function is available - but we have
-            # arranged for that in the database_connection_mongodb function.
-            rexprs = ["(%s REGEXP '%s')" % (name, r) for r in rexes]
+            # sqlite doesn't support regular expressions unless a
+            # user-defined function is available - but we have arranged
+            # for that in the database_connection_sqlite function. It takes
+            # all the alternatives at once, so there's one call per row.
+            pattern = '|'.join('(?:%s)' % r for r in rexes)
+            rexprs = ['tdda_rex_match(%s, %s)' % (self.literal(pattern),
+                                                  name)]
         else:
             raise Exception('Unsupported database type')
 
+        source = self.relation(tablename)
+        if distinct:
+            source = ('(SELECT DISTINCT %s FROM %s WHERE %s IS NOT NULL) '
+                      'AS tdda_distinct' % (name, source, name))
         sql = ('SELECT COUNT(*) FROM %s WHERE %s IS NOT NULL AND NOT(%s)'
-               % (tablename, name, ' OR '.join(rexprs)))
+               % (source, name, ' OR '.join(rexprs)))
         return self.execute_scalar(sql) == 0
 
     def cast_bool_to_int(self, s):
@@ -653,22 +1080,30 @@ class MongoDBDatabaseHandler:
     def __init__(self, dbtype, db):
         self.dbtype = dbtype
         self.db = db
+        self.collections = {}
+        self.sample_schema(None)   # every document, unless discovering
 
     def find_collection(self, tablename):
         """
         Search through the collections hierarchy to resolve dotted names
         """
+        if tablename in self.collections:
+            return self.collections[tablename]
         parts = tablename.split('.')
         collection = self.db.connection
         for p in parts:
             if p not in collection.collection_names():
                 raise Exception('collection %s does not exist' % tablename)
             collection = collection[p]
+        self.collections[tablename] = collection
         return collection
 
     def resolve_table(self, name):
         return name
 
+    def get_database_table_names(self, schema=None):
+        return sorted(self.db.connection.collection_names())
+
     def check_table_exists(self, tablename):
         try:
             self.find_collection(tablename)
@@ -676,94 +1111,207 @@ class MongoDBDatabaseHandler:
         except:
             return False
 
+    def sample_schema(self, size=DEFAULT_SCHEMA_SAMPLE_SIZE, confirm=False):
+        """
+        Set how the fields (and their types) in collections are found:
+        from a random sample of *size* documents, or, if *size* is ``None``
+        or *confirm* is set, from every document.
+
+        Handlers use every document unless this is called; only discovery
+        (see :py:func:`~tdda.constraints.db.constraints.discover_db_table`)
+        uses a sample, so verification never depends on which documents
+        were sampled. Fields that do not occur in a sample are still found
+        when asked for by name.
+        """
+        self.schema_sample_size = None if confirm else size
+        self.schemas = {}
+        self.stats = {}
+
+    def get_database_schema(self, tablename):
+        """
+        Returns an ordered dictionary mapping the name of each field in
+        a collection to its type histogram: a dictionary mapping the
+        names of the BSON types of its values to the number of documents
+        with a value of that type (including 'null').
+
+        These are found with a single aggregation pipeline, over every
+        document, or over a sample of them (see :py:meth:`sample_schema`).
+        """
+        if tablename not in self.schemas:
+            self.schemas[tablename] = self.calc_schema(
+                                          tablename, self.schema_sample_size)
+        return self.schemas[tablename]
+
+    def calc_schema(self, tablename, size=None, colname=None):
+        collection = self.find_collection(tablename)
+        if colname is None:
+            pipeline = [{'$sample': {'size': size}}] if size else []
+            pipeline += [
+                {'$project': {'kv': {'$objectToArray': '$$ROOT'}}},
+                {'$unwind': '$kv'},
+                {'$group': {'_id': {'k': '$kv.k', 't': {'$type': '$kv.v'}},
+                            'n': {'$sum': 1}}},
+            ]
+        else:
+            pipeline = [
+                {'$match': {colname: {'$exists': True}}},
+                {'$group': {'_id': {'k': colname,
+                                    't': {'$type': '$' + colname}},
+                            'n': {'$sum': 1}}},
+            ]
+        histograms = {}
+        for row in collection.aggregate(pipeline, allowDiskUse=True):
+            key = row['_id']
+            histograms.setdefault(key['k'], {})[key['t']] = row['n']
+        return OrderedDict((k, histograms[k]) for k in sorted(histograms))
+
+    def get_database_type_histogram(self, tablename, colname):
+        """
+        Returns the type histogram (see :py:meth:`get_database_schema`)
+        for a single field, or ``None`` if the collection has no such field.
+        """
+        schema = self.get_database_schema(tablename)
+        if colname not in schema:
+            if not self.check_column_exists(tablename, colname):
+                return None
+            schema.update(self.calc_schema(tablename, colname=colname))
+        return schema[colname]
+
     def get_database_column_names(self, tablename):
+        return list(self.get_database_schema(tablename).keys())
+
+    def get_database_change_token(self, tablename):
+        # MongoDB doesn't record when collections change
+        return None
+
+    def check_column_exists(self, tablename, colname):
+        if colname in self.get_database_schema(tablename):
+            return True
+        # it may just not have been in the sample
         collection = self.find_collection(tablename)
-        try:
-            keys = collection.aggregate([
-                {'$project': {'arrayofkeyvalue': {'$objectToArray': '$$ROOT'}}},
-                {'$unwind': '$arrayofkeyvalue'},
-                {'$group': {'_id': None,
-                            'allkeys': {'$addToSet': '$arrayofkeyvalue.k'}}}
-            ]).next()['allkeys'];
-            return keys
-        except:
-            # sometimes the aggregate approach above doesn't work (for
-            # reasons that aren't completely clear), so here's an alternative
-            # approach, which is slower.
-            mapfn = '''function() {
-                            var keys = [];
-                            for (var k in this) {
-                                keys.push(k);
-                            }
-                            emit(null, keys);
-                       }'''
-            redfn = '''function(key, values) {
-                           var keyset = {};
-                           for (var i = 0; i < values.length; i++) {
-                               for (var j = 0; j < values[i].length; j++) {
-                                   keyset[values[i][j]] = true;
-                               }
-                           }
-                           var keys = [];
-                          for (var k in keyset) {
-                               if (k != '_id') {
-                                   keys.push(k);
-                               }
-                           }
-                           return JSON.stringify(keys);
-                       }'''
-            mr = collection.map_reduce(mapfn, redfn, 'inline')
-            v = mr.find_one()['value']
-            # the map/reduce op returns a json repr of the list of keys
-            return json.loads(v)
+        return collection.find_one({colname: {'$exists': True}},
+                                   projection={'_id': 1}) is not None
 
     def get_database_column_type(self, tablename, colname):
-        collection = self.find_collection(tablename)
-        doc = collection.find_one({colname: {'$ne': None}})
-        if doc:
-            val = doc[colname]
-            valtype = type(val)
-            if valtype == bool:
-                return 'bool'
-            elif valtype in (int, long_type):
-                return 'int'
-            elif valtype == float:
-                return 'real'
-            elif valtype in (str, UNICODE_TYPE):
-                return 'string'
-            elif isinstance(val, datetime.datetime):
-                return 'date'
-            elif isinstance(val, datetime.date):
-                return 'date'
-            else:
-                return 'other'
-        else:
+        """
+        The TDDA type of a field, from the types of its (non-null) values:
+        the most common type, except that fields with a mixture of integer
+        and real values are real.
+        """
+        histogram = self.get_database_type_histogram(tablename, colname)
+        counts = {}
+        for bsontype, n in (histogram or {}).items():
+            if bsontype != 'null':
+                tddatype = BSON_TDDA_TYPES.get(bsontype, 'other')
+                counts[tddatype] = counts.get(tddatype, 0) + n
+        if not counts:
             return None
+        elif set(counts) == set(['int', 'real']):
+            return 'real'
+        return sorted(counts, key=lambda t: (-counts[t], t))[0]
 
     def get_nrows(self, tablename):
         return self.get_database_nrows(tablename)
 
-    def get_database_nrows(self, tablename):
+    def field_statistics(self, tablename):
+        """
+        Returns the statistics for every field in a collection (see
+        :py:meth:`calc_field_statistics`), calculating them the first
+        time they are needed.
+        """
+        if tablename not in self.stats:
+            self.stats[tablename] = self.calc_field_statistics(tablename)
+        return self.stats[tablename]
+
+    def calc_field_statistics(self, tablename, colnames=None):
+        """
+        Calculates statistics for every field in a collection, with a
+        single aggregation pipeline, so that the collection is only read
+        once, rather than once for each statistic of each field.
+
+        Returns a dictionary with the number of documents as *n*, and,
+        as *fields*, a dictionary mapping each field name to a dictionary
+        of its statistics: *nnull*, *nnonnull*, *nunique*, *min*, *max*,
+        *min_length* and *max_length* (the last two over string values
+        only). Missing values count as nulls.
+
+        By default, this is for all the fields found by
+        :py:meth:`get_database_schema`; otherwise, for the fields in
+        *colnames*.
+
+        The number of distinct values of each field is found in its own
+        facet of the pipeline, and the others by a single $group.
+        """
         collection = self.find_collection(tablename)
-        return collection.count()
+        if colnames is None:
+            colnames = self.get_database_column_names(tablename)
+        group = {'_id': None, 'n': {'$sum': 1}}
+        facets = {}
+        for i, colname in enumerate(colnames):
+            value = '$' + colname
+            isnull = {'$eq': [{'$ifNull': [value, None]}, None]}
+            length = {'$cond': [{'$eq': [{'$type': value}, 'string']},
+                                {'$strLenCP': value}, None]}
+            group['nnull_%d' % i] = {'$sum': {'$cond': [isnull, 1, 0]}}
+            group['min_%d' % i] = {'$min': value}
+            group['max_%d' % i] = {'$max': value}
+            group['minlen_%d' % i] = {'$min': length}
+            group['maxlen_%d' % i] = {'$max': length}
+            facets['nunique_%d' % i] = [
+                {'$match': {colname: {'$ne': None}}},
+                {'$group': {'_id': value}},
+                {'$count': 'n'},
+            ]
+        facets['stats'] = [{'$group': group}]
+        result = collection.aggregate([{'$facet': facets}],
+                                      allowDiskUse=True).next()
+        stats = result['stats'][0] if result['stats'] else {}
+        n = stats.get('n', 0)
+        fields = {}
+        for i, colname in enumerate(colnames):
+            nnull = stats.get('nnull_%d' % i, 0)
+            nunique = result['nunique_%d' % i]
+            minlen = stats.get('minlen_%d' % i)
+            maxlen = stats.get('maxlen_%d' % i)
+            fields[colname] = {
+                'nnull': nnull,
+                'nnonnull': n - nnull,
+                'nunique': nunique[0]['n'] if nunique else 0,
+                'min': stats.get('min_%d' % i),
+                'max': stats.get('max_%d' % i),
+                'min_length': int(minlen) if minlen is not None else None,
+                'max_length': int(maxlen) if maxlen is not None else None,
+            }
+        return {'n': n, 'fields': fields}
+
+    def field_statistic(self, tablename, colname, stat):
+        # a single statistic for a field, from the statistics for all of
+        # them; a field that is not in the collection is entirely null.
+        stats = self.field_statistics(tablename)
+        if (colname not in stats['fields']
+                and self.check_column_exists(tablename, colname)):
+            # a field that was not in the sample used to find the fields
+            fieldstats = self.calc_field_statistics(tablename, [colname])
+            stats['fields'].update(fieldstats['fields'])
+        if colname in stats['fields']:
+            return stats['fields'][colname][stat]
+        elif stat == 'nnull':
+            return stats['n']
+        elif stat in ('nnonnull', 'nunique'):
+            return 0
+        return None
+
+    def get_database_nrows(self, tablename):
+        return self.field_statistics(tablename)['n']
 
     def get_database_nnull(self, tablename, colname):
-        collection = self.find_collection(tablename)
-        return collection.find({colname: {'$eq': None}}).count()
+        return self.field_statistic(tablename, colname, 'nnull')
 
     def get_database_nnonnull(self, tablename, colname):
-        collection = self.find_collection(tablename)
-        return collection.find({colname: {'$ne': None}}).count()
+        return self.field_statistic(tablename, colname, 'nnonnull')
 
     def get_database_nunique(self, tablename, colname):
-        collection = self.find_collection(tablename)
-        agg = collection.aggregate([
-            {'$match': {colname: {'$exists': True}}},
-            {'$match': {colname: {'$ne': None}}},
-            {'$group': {'_id': '$' + colname}},
-            {'$group': {'_id': None, 'nunique': {'$sum': 1}}},
-        ], allowDiskUse=True)
-        return agg.next()['nunique']
+        return self.field_statistic(tablename, colname, 'nunique')
 
     def get_database_unique_values(self, tablename, colname,
                                    sorted_values=True, include_nulls=False):
@@ -783,43 +1331,32 @@ class MongoDBDatabaseHandler:
         else:
             return non_null_values
 
+    def iter_database_unique_values(self, tablename, colname,
+                                    sorted_values=True, include_nulls=False,
+                                    batchsize=None):
+        # MongoDB returns distinct values all at once
+        values = self.get_database_unique_values(tablename, colname,
+                                                 sorted_values=sorted_values,
+                                                 include_nulls=include_nulls)
+        if values:
+            yield values
+
+    def get_database_n_disallowed(self, tablename, colname, allowed_values):
+        collection = self.find_collection(tablename)
+        query = {colname: {'$ne': None, '$nin': list(allowed_values)}}
+        return collection.count_documents(query)
+
     def get_database_min_length(self, tablename, colname):
-        return self.extreme_length(tablename, colname, min, 'min')
+        return self.field_statistic(tablename, colname, 'min_length')
 
     def get_database_max_length(self, tablename, colname):
-        return self.extreme_length(tablename, colname, max, 'max')
-
-    def extreme_length(self, tablename, colname, agg, aggstr):
-        collection = self.find_collection(tablename)
-        if self.get_database_column_type(tablename, colname) == 'string':
-            values = self.get_database_unique_values(tablename, colname)
-            v = agg([len(v) for v in values]) if values else None
-        else:
-            mapfn = '''function() {
-                           emit(null, this.name ? this.name.length : null);
-                       }'''
-            redfn = '''function(key, values) {
-                           return Math.%s.apply(Math, values);
-                       }''' % aggstr
-            mr = collection.map_reduce(mapfn, redfn, 'inline')
-            v = mr.find_one()['value']
-        return int(v) if v is not None else None
+        return self.field_statistic(tablename, colname, 'max_length')
 
     def get_database_min(self, tablename, colname):
-        collection = self.find_collection(tablename)
-        agg = collection.aggregate([
-            {'$match': {colname: {'$exists': True}}},
-            {'$group': {'_id': None, 'min': {'$min': '$' + colname}}},
-        ], allowDiskUse=True)
-        return agg.next()['min']
+        return self.field_statistic(tablename, colname, 'min')
 
     def get_database_max(self, tablename, colname):
-        collection = self.find_collection(tablename)
-        agg = collection.aggregate([
-            {'$match': {colname: {'$exists': True}}},
-            {'$group': {'_id': None, 'max': {'$max': '$' + colname}}},
-        ])
-        return agg.next()['max']
+        return self.field_statistic(tablename, colname, 'max')
 
     def db_value_is_null(self, value):
         return value is None
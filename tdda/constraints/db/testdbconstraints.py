@@ -22,9 +22,14 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
+import datetime
+import decimal
 import json
 import os
+import shutil
 import sys
+import tempfile
+import threading
 import unittest
 
 try:
@@ -55,8 +60,19 @@ pymongo = None  # The tests don't yet work for MongoDB
 
 from tdda.referencetest.referencetestcase import ReferenceTestCase, tag
 
+from tdda.constraints.base import DatasetConstraints
 from tdda.constraints.db.drivers import database_connection, DatabaseHandler
+from tdda.constraints.db import constraints as dbc
 from tdda.constraints.db.constraints import (verify_db_table,
+                                             DatabaseConstraintDiscoverer,
+                                             DatabaseIncrementalVerifier,
+                                             state_value,
+                                             from_state_value,
+                                             load_incremental_state,
+                                             save_incremental_state,
+                                             verify_db_tables,
+                                             table_manifest,
+                                             matching_tables,
                                              discover_db_table)
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -111,6 +127,59 @@ class TestDatabaseHandlers:
                           'Halogen', 'Lanthanoid', 'Metalloid', 'Noble gas',
                           'Nonmetal', 'Poor metal', 'Transition metal'])
 
+    def test_handler_length_extremes(self):
+        elements = self.dbh.resolve_table('elements')
+        self.assertEqual(self.dbh.get_database_min_length(elements, 'Name'),
+                         3)
+        self.assertEqual(self.dbh.get_database_max_length(elements, 'Name'),
+                         13)
+
+    def test_handler_unique_value_batches(self):
+        elements = self.dbh.resolve_table('elements')
+        batches = list(self.dbh.iter_database_unique_values(
+                            elements, 'ChemicalSeries', batchsize=4))
+        self.assertEqual([len(b) for b in batches], [4, 4, 2])
+        self.assertEqual(sum(batches, []),
+                         self.dbh.get_database_unique_values(elements,
+                                                             'ChemicalSeries'))
+
+    def test_handler_rex_match(self):
+        elements = self.dbh.resolve_table('elements')
+        for distinct in (False, True):
+            self.assertTrue(self.dbh.get_database_rex_match(
+                                elements, 'Symbol', ['^[A-Z]$', '^[A-Z][a-z]$',
+                                                     '^[A-Z][a-z][a-z]$'],
+                                distinct=distinct))
+            self.assertFalse(self.dbh.get_database_rex_match(
+                                elements, 'Symbol', ['^[A-Z]$', '^[A-Z][a-z]$'],
+                                distinct=distinct))
+            self.assertFalse(self.dbh.get_database_rex_match(
+                                elements, 'Symbol', ["^[A-Z]'$"],
+                                distinct=distinct))
+
+    def test_handler_disallowed_values(self):
+        elements = self.dbh.resolve_table('elements')
+        allowed = ['Actinoid', 'Alkali metal', 'Alkaline earth metal',
+                   'Halogen', 'Lanthanoid', 'Metalloid', "Noble gas's",
+                   'Nonmetal', 'Poor metal']
+        n_noble = self.dbh.get_database_n_disallowed(
+                             elements, 'ChemicalSeries',
+                             allowed + ['Transition metal'])
+        self.assertTrue(n_noble > 0)
+        values = allowed + ['Transition metal', 'Noble gas']
+        self.assertEqual(self.dbh.get_database_n_disallowed(
+                             elements, 'ChemicalSeries', values),
+                         0)
+        # values only match exactly, regardless of the database collation
+        n_values = self.dbh.get_database_n_disallowed(elements,
+                                                      'ChemicalSeries', [])
+        self.assertTrue(n_values > n_noble)
+        for near in ([v.upper() for v in values],
+                     [v + ' ' for v in values]):
+            self.assertEqual(self.dbh.get_database_n_disallowed(
+                                 elements, 'ChemicalSeries', near),
+                             n_values)
+
 
 @unittest.skipIf(sqlite3 is None, 'sqlite3 not available')
 class TestSQLiteDBHandlers(ReferenceTestCase, TestDatabaseHandlers):
@@ -212,6 +281,211 @@ class TestSQLiteDBConstraintVerifiers(ReferenceTestCase,
         cls.dbh = DatabaseHandler('sqlite', cls.db)
 
 
+@unittest.skipIf(sqlite3 is None, 'sqlite3 not available')
+class TestSQLiteDBMultiTableVerification(unittest.TestCase):
+    def setUp(self):
+        self.dbfile = os.path.join(TESTDATA_DIR, 'example.db')
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def connect(self):
+        return database_connection(dbtype='sqlite', db=self.dbfile,
+                                   shared=True)
+
+    def test_verify_tables(self):
+        constraints_file = os.path.join(TESTDATA_DIR, 'elements92.tdda')
+        tables = [('elements', constraints_file),
+                  ('does_not_exist', constraints_file)]
+        result = verify_db_tables('sqlite', self.connect, tables, workers=2,
+                                  testing=True)
+        self.assertEqual(list(result.verifications.keys()), ['elements'])
+        self.assertEqual(list(result.errors.keys()), ['does_not_exist'])
+        self.assertEqual(result.passes, 57)
+        self.assertEqual(result.failures, 15)
+        self.assertEqual(result.failing_tables(), ['elements'])
+        self.assertTrue('Tables not verified: 1' in str(result))
+
+    def test_shared_connections(self):
+        def count_elements(db, results):
+            try:
+                cursor = db.connection.cursor()
+                cursor.execute('SELECT COUNT(*) FROM elements')
+                results.append(cursor.fetchall()[0][0])
+            except sqlite3.ProgrammingError:
+                results.append(None)
+
+        for shared in (False, True):
+            db = database_connection(dbtype='sqlite', db=self.dbfile,
+                                     shared=shared)
+            results = []
+            thread = threading.Thread(target=count_elements,
+                                      args=(db, results))
+            thread.start()
+            thread.join()
+            db.connection.close()
+            self.assertEqual(results, [118] if shared else [None])
+
+    def test_table_manifest(self):
+        manifest = os.path.join(self.tmpdir, 'manifest.json')
+        with open(manifest, 'w') as f:
+            json.dump({'elements': 'elements.tdda'}, f)
+        self.assertEqual(table_manifest(manifest),
+                         [('elements',
+                           os.path.join(self.tmpdir, 'elements.tdda'))])
+
+    def test_matching_tables(self):
+        constraints_file = os.path.join(self.tmpdir, 'elements.tdda')
+        shutil.copy(os.path.join(TESTDATA_DIR, 'elements92.tdda'),
+                    constraints_file)
+        db = self.connect()
+        self.assertEqual(matching_tables('sqlite', db, 'elem*', self.tmpdir),
+                         [('elements', constraints_file)])
+        self.assertEqual(matching_tables('sqlite', db, 'x*', self.tmpdir), [])
+        db.close()
+
+
+@unittest.skipIf(sqlite3 is None, 'sqlite3 not available')
+class TestSQLiteDBIncrementalVerification(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dbfile = os.path.join(self.tmpdir, 'example.db')
+        shutil.copy(os.path.join(TESTDATA_DIR, 'example.db'), self.dbfile)
+        self.conn = sqlite3.connect(self.dbfile)
+        self.execute('CREATE TABLE growing AS '
+                     'SELECT * FROM elements WHERE Z <= 92')
+        self.constraints_file = os.path.join(TESTDATA_DIR, 'elements92.tdda')
+        self.state_file = os.path.join(self.tmpdir, 'elements92.tddastate')
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.tmpdir)
+
+    def execute(self, sql):
+        self.conn.execute(sql)
+        self.conn.commit()
+
+    def verify(self, incremental=True):
+        db = database_connection(dbtype='sqlite', db=self.dbfile)
+        kwargs = {'watermark_column': 'Z', 'state_path': self.state_file}
+        return verify_db_table('sqlite', db, 'growing', self.constraints_file,
+                               testing=True, **(kwargs if incremental else {}))
+
+    def load_state(self):
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def test_incremental_matches_full(self):
+        v = self.verify()
+        self.assertEqual(v.failures, 0)
+        state = self.load_state()
+        self.assertEqual(state['watermark'], 92)
+        self.assertEqual(state['n_records'], 92)
+
+        self.execute('INSERT INTO growing SELECT * FROM elements WHERE Z > 92')
+        db = database_connection(dbtype='sqlite', db=self.dbfile)
+        dbv = DatabaseIncrementalVerifier('sqlite', db, 'growing', 'Z',
+                                          state=state, testing=True)
+        constraints = DatasetConstraints(loadpath=self.constraints_file)
+        v = dbv.verify(constraints)
+        self.assertTrue(dbv.incremental)
+        full = self.verify(incremental=False)
+        self.assertEqual((v.passes, v.failures), (full.passes, full.failures))
+        self.assertEqual(v.failures, 15)
+        self.assertEqual(v.fields, full.fields)
+        self.assertEqual(dbv.state['watermark'], 118)
+        self.assertEqual(dbv.state['n_records'], 118)
+
+    def test_incremental_after_deletion(self):
+        self.verify()
+        self.execute('DELETE FROM growing WHERE Z = 1')
+        self.execute('INSERT INTO growing SELECT * FROM elements WHERE Z > 92')
+        db = database_connection(dbtype='sqlite', db=self.dbfile)
+        dbv = DatabaseIncrementalVerifier('sqlite', db, 'growing', 'Z',
+                                          state=self.load_state(),
+                                          testing=True)
+        constraints = DatasetConstraints(loadpath=self.constraints_file)
+        v = dbv.verify(constraints)
+        self.assertFalse(dbv.incremental)
+        full = self.verify(incremental=False)
+        self.assertEqual(v.fields, full.fields)
+        self.assertEqual(dbv.state['n_records'], 117)
+
+    def test_state_values(self):
+        utc = datetime.timezone.utc
+        plus5 = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+        values = [
+            datetime.date(2020, 2, 29),
+            decimal.Decimal('12345678901234567890.125'),
+            datetime.datetime(2020, 2, 29, 12, 30, 15),
+            datetime.datetime(2020, 2, 29, 12, 30, 15, 250, tzinfo=utc),
+            datetime.datetime(2020, 2, 29, 12, 30, tzinfo=plus5),
+            [datetime.date(2021, 1, 1), decimal.Decimal('-0.5')],
+        ]
+        state = {'watermark': state_value(values[3]),
+                 'fields': {'x': {'values': state_value(values)}}}
+        save_incremental_state(self.state_file, state)
+        # written atomically, leaving no temporary file behind
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['elements92.tddastate', 'example.db'])
+        state = load_incremental_state(self.state_file)
+        self.assertEqual(from_state_value(state['watermark']), values[3])
+        restored = from_state_value(state['fields']['x']['values'])
+        self.assertEqual(restored, values)
+        self.assertEqual([type(v) for v in restored],
+                         [type(v) for v in values])
+        self.assertEqual(restored[4].utcoffset(), values[4].utcoffset())
+
+
+@unittest.skipIf(sqlite3 is None, 'sqlite3 not available')
+class TestSQLiteDBVerificationCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dbfile = os.path.join(self.tmpdir, 'example.db')
+        shutil.copy(os.path.join(TESTDATA_DIR, 'example.db'), self.dbfile)
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.constraints_file = os.path.join(TESTDATA_DIR, 'elements92.tdda')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def verify(self, **kwargs):
+        db = database_connection(dbtype='sqlite', db=self.dbfile)
+        v = verify_db_table('sqlite', db, 'elements', self.constraints_file,
+                            testing=True, **kwargs)
+        db.close()
+        return v
+
+    def delete_transuranics(self):
+        conn = sqlite3.connect(self.dbfile)
+        conn.execute('DELETE FROM elements WHERE Z > 92')
+        conn.commit()
+        conn.close()
+
+    def test_cached_verification(self):
+        full = self.verify()
+        v1 = self.verify(cache_dir=self.cache_dir)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        v2 = self.verify(cache_dir=self.cache_dir)
+        for v in (v1, v2):
+            self.assertEqual((v.passes, v.failures), (57, 15))
+            self.assertEqual(v.fields, full.fields)
+
+        self.delete_transuranics()
+        v3 = self.verify(cache_dir=self.cache_dir)
+        self.assertEqual(v3.failures, 0)
+
+    def test_cached_verification_with_token(self):
+        self.verify(cache_dir=self.cache_dir, change_token='v1')
+        self.delete_transuranics()
+        # the token says nothing has changed, so the cached results are used
+        v = self.verify(cache_dir=self.cache_dir, change_token='v1')
+        self.assertEqual(v.failures, 15)
+        v = self.verify(cache_dir=self.cache_dir, change_token='v2')
+        self.assertEqual(v.failures, 0)
+
+
 class TestDatabaseConstraintDiscoverers:
     """
     Mix-in class, to be used in a subclass that also inherits ReferenceTestCase
@@ -260,6 +534,63 @@ class TestDatabaseConstraintDiscoverers:
                                                     '"dataset":',
                                                     '"tddafile":'])
 
+    def test_discover_elements_sampled(self):
+        # constraints from a sample, confirmed against the full table
+        elements = self.dbh.resolve_table('elements')
+        constraints = discover_db_table(self.dbh.dbtype, self.db, elements,
+                                        sample=0.3, seed=1)
+        self.assertEqual(constraints.n_records, 118)
+        self.assertTrue(0 < constraints.n_selected < 118)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'sampled.tdda')
+            with open(path, 'w') as f:
+                f.write(constraints.to_json())
+            result = verify_db_table(self.dbh.dbtype, self.db, elements, path)
+            self.assertEqual(result.failures, 0)
+        finally:
+            shutil.rmtree(tmpdir)
+        # widened values still agree with the sign constraints
+        for field in constraints.fields.values():
+            kinds = field.constraints
+            sign = kinds['sign'].value if 'sign' in kinds else None
+            if sign == 'positive' and 'min' in kinds:
+                self.assertTrue(kinds['min'].value > 0)
+            elif sign == 'negative' and 'max' in kinds:
+                self.assertTrue(kinds['max'].value < 0)
+
+    def test_discover_elements_whole_sample(self):
+        # a sample of the whole table gives the same limits as no sample
+        elements = self.dbh.resolve_table('elements')
+        constraints = discover_db_table(self.dbh.dbtype, self.db, elements,
+                                        sample=1.0, seed=1)
+        z = constraints.fields['Z'].constraints
+        self.assertEqual((z['min'].value, z['max'].value), (1, 118))
+        self.assertEqual(z['sign'].value, 'positive')
+
+    def test_discover_rex_from_sample(self):
+        # rexes found from a sample of the distinct values are only kept
+        # if every value in the table matches them
+        elements = self.dbh.resolve_table('elements')
+        disco = DatabaseConstraintDiscoverer(self.dbh.dbtype, self.db,
+                                             elements, inc_rex=True, seed=1)
+        symbol_rexes = ['^[A-Z]$', '^[A-Z][a-z]$', '^[A-Z][a-z][a-z]$']
+        self.assertTrue(disco.all_values_match('Symbol', symbol_rexes))
+        self.assertFalse(disco.all_values_match('Symbol', symbol_rexes[1:]))
+        max_examples = dbc.MAX_REX_EXAMPLES
+        try:
+            dbc.MAX_REX_EXAMPLES = 5
+            rexes = disco.find_rexes('Symbol')
+            self.assertTrue(rexes is None
+                            or disco.all_values_match('Symbol', rexes))
+            disco.all_values_match = lambda colname, rexes: False
+            self.assertIsNone(disco.find_rexes('Symbol'))
+            del disco.all_values_match
+        finally:
+            dbc.MAX_REX_EXAMPLES = max_examples
+        rexes = disco.find_rexes('Symbol')   # from every value
+        self.assertTrue(disco.all_values_match('Symbol', rexes))
+
 
 @unittest.skipIf(sqlite3 is None, 'sqlite3 not available')
 class TestSQLiteDBConstraintDiscoverers(ReferenceTestCase,
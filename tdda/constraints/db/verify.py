@@ -20,6 +20,35 @@ Parameters:
 
   * constraints.tdda is a JSON .tdda file constaining constraints.
 
+Several tables can be verified at once, concurrently, either:
+
+  * by giving a table name containing shell-style wildcards (such as
+    'sales_*' or 'myschema.*'), in which case the constraints parameter
+    is a directory (by default the current directory) containing a
+    <tablename>.tdda constraints file for each table to be verified;
+
+  * or by using --manifest FILE, where FILE is a JSON file mapping
+    table names to their constraints files, in which case no table
+    or constraints parameters are needed.
+
+A single, combined report is produced. Use --workers N to set the
+number of tables verified at the same time (and so the number of
+database connections used); the default is 4.
+
+For a single table to which rows are only ever appended, use
+--watermark COL, where COL is a column whose values increase as rows
+are added (such as an ingestion timestamp or serial ID), to verify it
+incrementally: the statistics needed are saved in a state file (set
+with --state FILE; by default, the constraints file with a .tddastate
+extension), and later verifications only aggregate rows added since.
+
+Use --cache DIR to cache the column statistics and constraint results in
+DIR, and reuse them when the table is verified again without having
+changed. Whether it has changed is judged from the database itself,
+where possible, or from a token supplied with --change-token TOKEN.
+On PostgreSQL, any write to the server counts as a change, so on a busy
+server, supplying a token is usually better.
+
 '''
 
 import argparse
@@ -28,7 +57,11 @@ import sys
 
 from tdda import __version__
 from tdda.constraints.flags import verify_parser, verify_flags
-from tdda.constraints.db.constraints import verify_db_table
+from tdda.constraints.db.constraints import (verify_db_table,
+                                             verify_db_tables,
+                                             table_manifest,
+                                             matching_tables,
+                                             DEFAULT_DB_WORKERS)
 from tdda.constraints.db.drivers import (database_connection, parse_table_name,
                                          database_arg_parser,
                                          database_arg_flags)
@@ -51,15 +84,91 @@ def verify_database_table_from_file(table, constraints_path,
     print(verify_db_table(dbtype, db, table, constraints_path, **kwargs))
 
 
+def verify_database_tables(table=None, constraints_path=None, manifest=None,
+                           workers=DEFAULT_DB_WORKERS, conn=None, dbtype=None,
+                           db=None, host=None, port=None, user=None,
+                           password=None, **kwargs):
+    """
+    Verify several database tables, either those listed in a manifest
+    file, or those matching a wildcard pattern (with constraints files
+    in the constraints_path directory).
+
+    Prints a combined report to stdout.
+    """
+    if table:
+        (table, dbtype) = parse_table_name(table, dbtype)
+
+    def connect():
+        return database_connection(conn=conn, dbtype=dbtype, db=db,
+                                   host=host, port=port,
+                                   user=user, password=password,
+                                   shared=True)
+
+    if manifest:
+        tables = table_manifest(manifest)
+    else:
+        dbconn = connect()
+        tables = matching_tables(dbtype, dbconn, table,
+                                 constraints_path or '.')
+        dbconn.close()
+    if not tables:
+        print('No tables to verify', file=sys.stderr)
+        sys.exit(1)
+    v = verify_db_tables(dbtype, connect, tables, workers=workers, **kwargs)
+    print(v)
+    return v
+
+
+def is_table_pattern(table):
+    return table is not None and any(c in table for c in '*?[')
+
+
 def get_verify_params(args):
     parser = database_arg_parser(verify_parser, USAGE)
-    parser.add_argument('table', nargs=1, help='database table name')
+    parser.add_argument('--manifest', metavar='FILE',
+                        help='JSON file mapping tables to constraints files')
+    parser.add_argument('--workers', type=int, default=DEFAULT_DB_WORKERS,
+                        help='number of tables to verify concurrently')
+    parser.add_argument('--watermark', metavar='COL',
+                        help='verify incrementally, using this column '
+                             'to find new rows')
+    parser.add_argument('--state', metavar='FILE',
+                        help='state file for incremental verification')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='directory for caching verification results')
+    parser.add_argument('--change-token', metavar='TOKEN',
+                        help='value that changes whenever the table does, '
+                             'for --cache')
+    parser.add_argument('--rex-distinct', action='store_true',
+                        help='check rex constraints against distinct '
+                             'values, rather than every row')
+    parser.add_argument('table', nargs='?',
+                        help='database table name (or wildcard pattern)')
     parser.add_argument('constraints', nargs='?',
-                        help='constraints file to verify against')
+                        help='constraints file (or directory) to verify '
+                             'against')
     params = {}
     flags = database_arg_flags(verify_flags, parser, args, params)
-    params['table'] = flags.table[0] if flags.table else None
+    params['table'] = flags.table
     params['constraints_path'] = flags.constraints
+    if flags.rex_distinct:
+        params['rex_distinct'] = True
+    if flags.manifest or is_table_pattern(flags.table):
+        params['manifest'] = flags.manifest
+        params['workers'] = flags.workers
+        if flags.watermark:
+            parser.error('--watermark can only be used with a single table')
+    elif flags.table is None:
+        parser.error('a table name is required')
+    elif flags.watermark:
+        params['watermark_column'] = flags.watermark
+        params['state_path'] = flags.state
+    if flags.cache:
+        if 'workers' in params or flags.watermark:
+            parser.error('--cache can only be used with a single table, '
+                         'without --watermark')
+        params['cache_dir'] = flags.cache
+        params['change_token'] = flags.change_token
     return params
 
 
@@ -70,7 +179,10 @@ class DatabaseVerifier:
 
     def verify(self):
         params = get_verify_params(self.argv[1:])
-        verify_database_table_from_file(**params)
+        if 'workers' in params:
+            verify_database_tables(**params)
+        else:
+            verify_database_table_from_file(**params)
 
 
 def main(argv):
@@ -9,6 +9,7 @@ from __future__ import print_function
 from __future__ import absolute_import
 
 import argparse
+import os
 import sys
 
 
@@ -67,6 +68,24 @@ Optional flags are:
       The row number is automatically included if no output fields are
       specified. Rows are usually numbered from 1, unless the (feather)
       input file already has an index.
+  * --chunksize N
+      Write the output file in chunks of N records, so that memory use
+      does not grow with the number of records written.
+  * --background-write
+      Write the output file in a separate thread, in parallel with the
+      construction of the records to be written.
+  * --max-failures-per-constraint N
+      Only write out the first N failing records for each constraint.
+      (Every record is still checked, and counted.)
+  * --sample-failures N
+      Only write out a random sample of N of the failing records for
+      each constraint. (Every record is still checked, and counted.)
+  * --seed S
+      Seed for the random sampling of failing records.
+  * --failure-index
+      Also save the positions of the records that failed each
+      constraint, as a compressed .npz file alongside the output file
+      (with _failures.npz in place of its extension).
 
 '''
 
@@ -158,6 +177,22 @@ def detect_parser(usage=''):
     parser.add_argument('--int', dest='boolean_ints', action='store_true',
                         help='Write out boolean fields as integers, with '
                              '1 for true and 0 for false.')
+    parser.add_argument('--chunksize', type=int,
+                        help='Write the output file in chunks of this many '
+                             'records.')
+    parser.add_argument('--background-write', action='store_true',
+                        help='Write the output file in a separate thread.')
+    parser.add_argument('--max-failures-per-constraint', type=int,
+                        help='Only write out the first N failing records '
+                             'for each constraint.')
+    parser.add_argument('--sample-failures', type=int,
+                        help='Only write out a random sample of N failing '
+                             'records for each constraint.')
+    parser.add_argument('--seed', type=int,
+                        help='Seed for random sampling of failing records.')
+    parser.add_argument('--failure-index', action='store_true',
+                        help='Save the positions of failing records to '
+                             'a .npz file alongside the output file.')
     return parser
 
 
@@ -215,6 +250,27 @@ def detect_flags(parser, args, params):
         params['index'] = True
     if flags.boolean_ints:
         params['boolean_ints'] = True
+    if flags.chunksize is not None:
+        params['chunksize'] = flags.chunksize
+    if flags.background_write:
+        params['background_write'] = True
+    if flags.max_failures_per_constraint and flags.sample_failures:
+        print('You must not specify both --max-failures-per-constraint and '
+              '--sample-failures.', file=sys.stderr)
+        sys.exit(1)
+    nmax = flags.max_failures_per_constraint
+    if nmax is not None:
+        params['max_failures_per_constraint'] = nmax
+    if flags.sample_failures is not None:
+        params['sample_failures'] = flags.sample_failures
+    if flags.seed is not None:
+        params['seed'] = flags.seed
+    if flags.failure_index:
+        outpath = getattr(flags, 'outpath', None)
+        if outpath is None or outpath == '-':
+            print('--failure-index requires an output file.', file=sys.stderr)
+            sys.exit(1)
+        params['failure_index_path'] = failure_index_path(outpath)
 
     if flags.output_fields is not None:
         params['output_fields'] = flags.output_fields
@@ -227,3 +283,9 @@ def detect_flags(parser, args, params):
     params['report'] = 'records'
     return flags
 
+
+def failure_index_path(outpath):
+    """
+    Path for the failure index file to accompany a detection output file.
+    """
+    return os.path.splitext(outpath)[0] + '_failures.npz'
@@ -31,6 +31,7 @@ import datetime
 import os
 import re
 import sys
+import threading
 
 from collections import OrderedDict
 
@@ -39,6 +40,11 @@ try:
 except ImportError:
     from io import StringIO
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 import numpy as np
 import pandas as pd
 
@@ -52,12 +58,19 @@ try:
 except ImportError:
     feather = None
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
 from tdda.constraints.base import (
     STANDARD_FIELD_CONSTRAINTS,
     STANDARD_CONSTRAINT_SUFFIXES,
     CONSTRAINT_SUFFIX_MAP,
     native_definite,
     DatasetConstraints,
+    constrained_field_order,
     Verification,
     Detection,
     fuzz_up, fuzz_down,
@@ -87,14 +100,52 @@ DEBUG = False
 
 RE_FLAGS = re.UNICODE | re.DOTALL
 
+# Per-record detection states, as held in a DetectionMatrix
+DETECTION_FAIL = 0
+DETECTION_PASS = 1
+DETECTION_NULL = 2      # value was null, so the constraint doesn't apply
+
+# Maximum number of chunks of detection output waiting to be written,
+# when writing in the background
+MAX_QUEUED_CHUNKS = 4
+
+# Number of records examined at a time when selecting failing records
+DETECTION_BLOCK_SIZE = 65536
+
+# Maximum number of chunks of Feather or Parquet detection output held
+# while waiting to find the type of any columns that are entirely null
+MAX_UNTYPED_CHUNKS = 4
+
 
 class PandasConstraintCalculator(BaseConstraintCalculator):
     """
     Implementation of the Constraint Calculator methods for
     Pandas dataframes.
     """
-    def __init__(self, df):
+    # If set, the types of object columns are inferred from at most this
+    # many of their non-null values, rather than from all of them.
+    type_inference_sample = None
+
+    def __init__(self, df, compiled=None):
         self.df = df
+        self.repairs = {}
+        self.repaired = {}
+        self.compiled = compiled
+
+    def column(self, colname):
+        """
+        Returns the values of a column, with any type repair that has been
+        recorded for it (by repair_field_types) applied.
+
+        The repaired column is constructed the first time it is needed,
+        and is then kept; the DataFrame itself is never modified.
+        """
+        if colname in self.repairs:
+            if colname not in self.repaired:
+                repair = self.repairs[colname]
+                self.repaired[colname] = repair(self.df[colname])
+            return self.repaired[colname]
+        return self.df[colname]
 
     def is_null(self, value):
         return pd.isnull(value)
@@ -112,77 +163,110 @@ class PandasConstraintCalculator(BaseConstraintCalculator):
         return pandas_types_compatible(x, y, colname=colname)
 
     def calc_min(self, colname):
-        if self.df[colname].dtype == np.dtype('O'):
-            m = self.df[colname].dropna().min()  # Otherwise -inf!
+        if is_categorical_column(self.column(colname)):
+            m = pd.Series(self.distinct_values(colname)).min()
+        elif self.column(colname).dtype == np.dtype('O'):
+            m = self.column(colname).dropna().min()  # Otherwise -inf!
         else:
-            m = self.df[colname].min()
-        if pandas_tdda_type(m) == 'date' and hasattr(m, 'to_pydatetime'):
-            m = m.to_pydatetime(warn=False)
-        elif hasattr(m, 'item'):
-            m = m.item()
-        return m
+            m = self.column(colname).min()
+        return native_scalar(m)
 
     def calc_max(self, colname):
-        if self.df[colname].dtype == np.dtype('O'):
-            M = self.df[colname].dropna().max()
+        if is_categorical_column(self.column(colname)):
+            M = pd.Series(self.distinct_values(colname)).max()
+        elif self.column(colname).dtype == np.dtype('O'):
+            M = self.column(colname).dropna().max()
         else:
-            M = self.df[colname].max()
-        if pandas_tdda_type(M) == 'date' and hasattr(M, 'to_pydatetime'):
-            M = M.to_pydatetime(warn=False)
-        elif hasattr(M, 'item'):
-            M = M.item()
-        return M
+            M = self.column(colname).max()
+        return native_scalar(M)
 
     def calc_min_length(self, colname):
-        if isPy3:
-            return self.df[colname].str.len().min()
-        else:
-            return self.df[colname].str.decode('UTF-8').str.len().min()
+        return self.string_lengths(colname).min()
 
     def calc_max_length(self, colname):
+        return self.string_lengths(colname).max()
+
+    def string_lengths(self, colname):
+        """
+        Returns a Series of the lengths of the strings in a column.
+
+        For a categorical column, this has the lengths of the distinct
+        values, so each length is only calculated once.
+        """
+        c = self.column(colname)
+        if is_categorical_column(c):
+            c = pd.Series(self.distinct_values(colname), dtype=object)
         if isPy3:
-            return self.df[colname].str.len().max()
+            return c.str.len()
         else:
-            return self.df[colname].str.decode('UTF-8').str.len().max()
+            return c.str.decode('UTF-8').str.len()
+
+    def distinct_values(self, colname):
+        """
+        Returns an array of the distinct non-null values in a column.
+
+        For a categorical column, these are the categories that are actually
+        used, found from the codes without examining the values themselves.
+        """
+        c = self.column(colname)
+        if is_categorical_column(c):
+            codes = c.cat.codes.values
+            counts = np.bincount(codes[codes >= 0],
+                                 minlength=len(c.cat.categories))
+            return np.asarray(c.cat.categories)[np.flatnonzero(counts)]
+        return c.dropna().unique()
 
     def calc_tdda_type(self, colname):
-        return pandas_tdda_type(self.df[colname])
+        return pandas_tdda_type(self.column(colname),
+                                sample=self.type_inference_sample)
 
     def calc_null_count(self, colname):
-        return int(len(self.df) - self.df[colname].count())
+        c = self.column(colname)
+        if is_categorical_column(c):
+            return int(np.count_nonzero(c.cat.codes.values < 0))
+        return int(self.get_nrecords() - c.count())
 
     def calc_non_null_count(self, colname):
-        return int(len(self.df) - self.calc_null_count(colname))
+        return int(self.get_nrecords() - self.calc_null_count(colname))
 
     def calc_nunique(self, colname):
-        return int(self.df[colname].nunique())
+        if is_categorical_column(self.column(colname)):
+            return len(self.distinct_values(colname))
+        return int(self.column(colname).nunique())
 
     def calc_unique_values(self, colname, include_nulls=True):
-        values = self.df[colname].unique()
-        nullvalues = ([v for v in self.df[colname].unique()
-                         if pd.isnull(v)] if include_nulls
+        if is_categorical_column(self.column(colname)):
+            nulls = (include_nulls and self.calc_null_count(colname) > 0)
+            return (([np.nan] if nulls else [])
+                    + sorted(self.distinct_values(colname)))
+        values = self.column(colname).unique()
+        # float NaNs are all mapped to np.nan itself, since NaNs are only
+        # found in sets (such as allowed_values_exclusions) by identity.
+        nullvalues = ([np.nan if isinstance(v, float) else v
+                       for v in values if pd.isnull(v)] if include_nulls
                       else [])
         nonnullvalues = [v for v in values if not pd.isnull(v)]
         return nullvalues + sorted(nonnullvalues)
 
     def calc_non_integer_values_count(self, colname):
-        values = self.df[colname].dropna()
-        non_nulls = self.df[colname].count()
+        values = self.column(colname).dropna()
+        non_nulls = self.column(colname).count()
         return int(non_nulls
                    - (values.astype(int) == values).astype(int).sum())
 
     def calc_all_non_nulls_boolean(self, colname):
-        nn = self.df[colname].dropna()
-        return all([type(v) is bool for i, v in nn.iteritems()])
+        kind = pd.api.types.infer_dtype(self.column(colname), skipna=True)
+        return kind in ('boolean', 'empty')
 
     def allowed_values_exclusions(self):
         # remarkably, Pandas returns various kinds of nulls as
         # unique values, despite not counting them with .nunique()
-        return [None, np.nan, pd.NaT]
+        return [None, np.nan, pd.NaT] + ([pd.NA] if hasattr(pd, 'NA')
+                                         else [])
 
     def find_rexes(self, colname, values=None, seed=None):
         if values is None:
-            return rexpy.pdextract(self.df[colname])
+            return rexpy.pdextract(self.column(colname))
         else:
             return rexpy.extract(values, seed=None)
 
@@ -192,9 +276,12 @@ class PandasConstraintCalculator(BaseConstraintCalculator):
         if rexes is None:      # a null value is not considered
             return None        # to be an active constraint,
                                # so is always satisfied
-        rexes = [re.compile(r, RE_FLAGS) for r in rexes]
+        if self.compiled and colname in self.compiled.rexes:
+            rexes = self.compiled.rexes[colname]
+        else:
+            rexes = [re.compile(r, RE_FLAGS) for r in rexes]
         strings = [native_definite(s)
-                   for s in self.df[colname].dropna().unique()]
+                   for s in self.distinct_values(colname)]
 
         failures = set()
         for s in strings:
@@ -214,6 +301,364 @@ class PandasConstraintCalculator(BaseConstraintCalculator):
             return None
 
 
+class DetectionMatrix(object):
+    """
+    Per-record detection results for a set of constraints, held as a
+    single (column-major) NumPy ``int8`` matrix, with one column for each
+    constraint and one row for each record.
+
+    Each cell is one of DETECTION_PASS, DETECTION_FAIL or DETECTION_NULL
+    (for records where the constraint doesn't apply, because the value
+    is null). Constraints whose results were set as plain booleans
+    (with :py:meth:`set_all` or :py:meth:`set_flags`) are noted, so that
+    they can be output as boolean columns.
+
+    This is much more compact than holding a DataFrame with an
+    object column for each constraint, and lets the number of failures
+    for each record be calculated with a single vectorized reduction.
+    The results are only turned into a DataFrame when they are needed
+    for output, and then only for the rows that are required.
+
+    The matrix is allocated with room for *capacity* constraints (which
+    should be the number that will be detected), and only needs to be
+    reallocated if more are added.
+    """
+    def __init__(self, index, capacity=8):
+        self.index = index
+        self.names = []
+        self.positions = {}
+        self.boolean = set()
+        self.matrix = np.empty((len(index), capacity), dtype=np.int8,
+                               order='F')
+
+    def __len__(self):
+        return len(self.names)
+
+    def __setitem__(self, name, codes):
+        self.column(name)[:] = codes
+        self.boolean.discard(name)
+
+    def set_all(self, name, code):
+        """
+        Set the detection state of every record for a constraint.
+        """
+        self.column(name)[:] = code
+        self.boolean.add(name)
+
+    def set_flags(self, name, flags):
+        """
+        Set the detection state of every record for a constraint from
+        a boolean array (with no null states).
+        """
+        self.column(name)[:] = np.where(flags, DETECTION_PASS, DETECTION_FAIL)
+        self.boolean.add(name)
+
+    def column(self, name):
+        """
+        Returns the (writable) column of the matrix for the given
+        constraint name, allocating a new one if necessary.
+        """
+        if name not in self.positions:
+            ncols = self.matrix.shape[1]
+            if len(self.names) == ncols:
+                # more constraints than expected: grow geometrically, so
+                # that adding them one at a time doesn't keep copying the
+                # whole matrix.
+                matrix = np.empty((self.matrix.shape[0], max(2 * ncols, 1)),
+                                  dtype=np.int8, order='F')
+                matrix[:, :ncols] = self.matrix
+                self.matrix = matrix
+            self.positions[name] = len(self.names)
+            self.names.append(name)
+        return self.matrix[:, self.positions[name]]
+
+    def codes(self):
+        """
+        The part of the matrix that is actually in use.
+        """
+        return self.matrix[:, :len(self.names)]
+
+    def n_failures(self):
+        """
+        Returns an array of the number of constraints failed by each record.
+        """
+        return np.count_nonzero(self.codes() == DETECTION_FAIL, axis=1)
+
+    def failure_sample(self, n, seed=None, first=False):
+        """
+        Returns a boolean mask selecting a sample of up to *n* of the
+        records that failed each constraint (so up to n times the number
+        of constraints records in total).
+
+        If *first* is set, the first *n* failing records for each
+        constraint are selected; otherwise they are chosen at random,
+        using *seed* to seed the random number generator, if provided.
+
+        Every record will already have been checked against every
+        constraint (so that the numbers of failures are correct), so this
+        doesn't reduce that work; but the failing records are found a
+        block at a time, so that only the positions of those selected
+        are held, and when *first* is set, the search for each constraint
+        stops once *n* have been found.
+        """
+        rng = np.random.RandomState(seed)
+        selected = np.zeros(self.matrix.shape[0], dtype=bool)
+        for name in self.names:
+            codes = self.matrix[:, self.positions[name]]
+            if first:
+                nfound = 0
+                for positions in iter_failure_blocks(codes):
+                    positions = positions[:n - nfound]
+                    selected[positions] = True
+                    nfound += len(positions)
+                    if nfound >= n:
+                        break
+                continue
+            nfailed = sum(len(p) for p in iter_failure_blocks(codes))
+            if nfailed <= n:
+                ranks = np.arange(nfailed)
+            else:
+                ranks = np.sort(rng.choice(nfailed, n, replace=False))
+            offset = 0
+            for positions in iter_failure_blocks(codes):
+                end = offset + len(positions)
+                block = ranks[np.searchsorted(ranks, offset):
+                              np.searchsorted(ranks, end)]
+                selected[positions[block - offset]] = True
+                offset = end
+        return selected
+
+    def failure_index(self):
+        """
+        Returns a :py:class:`FailureIndex` for the records that failed
+        each constraint.
+        """
+        return FailureIndex(OrderedDict(
+            (name, RowSet.from_mask(self.matrix[:, self.positions[name]]
+                                    == DETECTION_FAIL))
+            for name in self.names
+        ), len(self.index))
+
+    def to_frame(self, include_constraints=True, rows=None):
+        """
+        Returns a DataFrame containing the detection results.
+
+        Columns for constraints set with :py:meth:`set_all` or
+        :py:meth:`set_flags` are boolean; the others are object columns
+        containing True, False or NaN values.
+
+        If *include_constraints* is False, the DataFrame has no columns
+        (just the index). If *rows* is provided, it is a boolean mask
+        specifying which records to include.
+        """
+        index = self.index if rows is None else self.index[rows]
+        df = pd.DataFrame(index=index)
+        if include_constraints:
+            for name in self.names:
+                codes = self.matrix[:, self.positions[name]]
+                if rows is not None:
+                    codes = codes[rows]
+                df[name] = detection_values(codes,
+                                            boolean=name in self.boolean)
+        return df
+
+
+class RowSet(object):
+    """
+    A set of row positions (numbered from 0) in a dataset of *nrecords*
+    records, stored in run-length encoded form, as the start positions
+    and lengths of its runs of consecutive rows.
+
+    This is compact for the sets of records that typically fail
+    constraints (often either very sparse, or in long runs), and can be
+    combined with other row sets for the same dataset using ``|``
+    (union), ``&`` (intersection) and ``-`` (difference).
+    """
+    def __init__(self, starts, lengths, nrecords):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.nrecords = nrecords
+
+    @classmethod
+    def from_mask(cls, mask):
+        """
+        Construct a row set from a boolean array with one value per record.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        zero = np.zeros(1, dtype=np.int8)
+        edges = np.diff(np.concatenate((zero, mask.view(np.int8), zero)))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        return cls(starts, ends - starts, len(mask))
+
+    @classmethod
+    def from_positions(cls, positions, nrecords):
+        """
+        Construct a row set from an array of row positions.
+        """
+        positions = np.unique(np.asarray(positions, dtype=np.int64))
+        if len(positions) == 0:
+            return cls([], [], nrecords)
+        breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+        starts = positions[np.concatenate(([0], breaks))]
+        ends = positions[np.concatenate((breaks - 1,
+                                         [len(positions) - 1]))] + 1
+        return cls(starts, ends - starts, nrecords)
+
+    @classmethod
+    def from_boundaries(cls, points, inside, nrecords):
+        """
+        Construct a row set from sorted boundary positions, and whether
+        the rows from each boundary up to the next are in the set.
+        """
+        edges = np.diff(np.concatenate(([0], inside.view(np.int8), [0])))
+        starts = points[np.flatnonzero(edges == 1)]
+        ends = points[np.flatnonzero(edges == -1)]
+        return cls(starts, ends - starts, nrecords)
+
+    def to_mask(self):
+        """
+        Returns a boolean array with one value per record, which is True
+        for the rows in the set.
+        """
+        edges = np.zeros(self.nrecords + 1, dtype=np.int8)
+        edges[self.starts] = 1
+        edges[self.starts + self.lengths] -= 1
+        return np.cumsum(edges[:-1], dtype=np.int8) > 0
+
+    def positions(self):
+        """
+        Returns an array of the positions of the rows in the set.
+        """
+        offsets = np.cumsum(self.lengths) - self.lengths
+        return (np.arange(self.lengths.sum(), dtype=np.int64)
+                + np.repeat(self.starts - offsets, self.lengths))
+
+    def __len__(self):
+        return int(self.lengths.sum())
+
+    def __eq__(self, other):
+        return (self.nrecords == other.nrecords
+                and np.array_equal(self.starts, other.starts)
+                and np.array_equal(self.lengths, other.lengths))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __or__(self, other):
+        return self.combine(other, np.logical_or)
+
+    def __and__(self, other):
+        return self.combine(other, np.logical_and)
+
+    def __sub__(self, other):
+        return self.combine(other, lambda a, b: a & ~ b)
+
+    def combine(self, other, op):
+        """
+        Combine with another row set, working on the runs themselves:
+        the result can only change where a run of either set starts or
+        ends, so membership is only found at those positions.
+        """
+        if other.nrecords != self.nrecords:
+            raise Exception('Cannot combine row sets for datasets with '
+                            'different numbers of records (%d and %d).'
+                            % (self.nrecords, other.nrecords))
+        points = np.unique(np.concatenate((self.starts,
+                                           self.starts + self.lengths,
+                                           other.starts,
+                                           other.starts + other.lengths)))
+        inside = op(self.contains(points), other.contains(points))
+        return RowSet.from_boundaries(points, inside, self.nrecords)
+
+    def contains(self, positions):
+        """
+        Returns a boolean array saying whether each of the (sorted) row
+        positions given is in the set.
+        """
+        ends = self.starts + self.lengths
+        return (np.searchsorted(self.starts, positions, side='right')
+                > np.searchsorted(ends, positions, side='right'))
+
+    def __repr__(self):
+        return 'RowSet(%d rows in %d runs, of %d)' % (len(self),
+                                                      len(self.starts),
+                                                      self.nrecords)
+
+
+class FailureIndex(object):
+    """
+    The positions of the records that failed each of a set of constraints,
+    as a :py:class:`RowSet` for each constraint, keyed by the name of the
+    constraint's detection field (e.g. ``Z_max_ok``).
+
+    A failure index can be saved to, and loaded from, a compressed NumPy
+    ``.npz`` file, which is usually very much smaller than a detection
+    output file, since it contains no field values.
+    """
+    def __init__(self, rowsets, nrecords):
+        self.rowsets = rowsets
+        self.nrecords = nrecords
+
+    def __getitem__(self, name):
+        return self.rowsets[name]
+
+    def __iter__(self):
+        return iter(self.rowsets)
+
+    def __len__(self):
+        return len(self.rowsets)
+
+    def union(self, names=None):
+        """
+        Returns a :py:class:`RowSet` of the records that failed any of
+        the constraints named (by default, any constraint at all).
+        """
+        result = RowSet([], [], self.nrecords)
+        for name in (self.rowsets if names is None else names):
+            result = result | self.rowsets[name]
+        return result
+
+    def intersection(self, names=None):
+        """
+        Returns a :py:class:`RowSet` of the records that failed all of
+        the constraints named (by default, every constraint).
+        """
+        n = self.nrecords
+        result = RowSet([0] if n else [], [n] if n else [], n)  # all rows
+        for name in (self.rowsets if names is None else names):
+            result = result & self.rowsets[name]
+        return result
+
+    def save(self, path):
+        """
+        Save the failure index to a compressed ``.npz`` file.
+        """
+        arrays = {
+            'nrecords': np.array(self.nrecords),
+            'names': np.array(list(self.rowsets), dtype=np.str_),
+        }
+        for i, rowset in enumerate(self.rowsets.values()):
+            arrays['starts_%d' % i] = rowset.starts
+            arrays['lengths_%d' % i] = rowset.lengths
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a failure index previously saved with :py:meth:`save`.
+        """
+        with np.load(path) as data:
+            nrecords = int(data['nrecords'])
+            rowsets = OrderedDict(
+                (name, RowSet(data['starts_%d' % i], data['lengths_%d' % i],
+                              nrecords))
+                for i, name in enumerate(data['names'].tolist())
+            )
+        return cls(rowsets, nrecords)
+
+
 class PandasConstraintDetector(BaseConstraintDetector):
     """
     Implementation of the Constraint Detector methods for
@@ -221,107 +666,146 @@ class PandasConstraintDetector(BaseConstraintDetector):
     """
     def __init__(self, df):
         self.df = df
+        self.detections = None
         if df is not None:
             self.date_cols = list(df.select_dtypes(include=[np.datetime64]))
-            index = df.index.copy()
-            if not index.name:
-                index.name = 'Index'
-            self.out_df = pd.DataFrame(index=index)
         else:
             self.date_cols = []
-            self.out_df = None
+
+    def start_detection(self, constraints):
+        """
+        Allocate the detection matrix, with a column for each of the
+        field constraints, so that it never needs to grow.
+        """
+        if self.df is None:
+            return
+        index = self.df.index.copy()
+        if not index.name:
+            index.name = 'Index'
+        ncolumns = sum(len(constraints.fields[name].constraints)
+                       for name in constraints.fields)
+        self.detections = DetectionMatrix(index, capacity=ncolumns)
+
+    def column(self, colname):
+        """
+        Returns the values of a column.
+        """
+        return self.df[colname]
+
+    @property
+    def out_df(self):
+        """
+        The per-constraint detection results, as a DataFrame with one
+        column for each constraint that was detected.
+
+        This is built from the detection matrix each time it is requested,
+        so should only be used when a DataFrame is really needed.
+        """
+        if self.detections is None:
+            return None
+        return self.detections.to_frame()
+
+    def column_coarse_type(self, colname):
+        """
+        Returns the coarse type of a column, using the cached TDDA type
+        for the column when this is mixed in with a verifier.
+        """
+        get_tdda_type = getattr(self, 'get_tdda_type', None)
+        if get_tdda_type is None:
+            return pandas_coarse_type(self.column(colname))
+        return coarse_type(get_tdda_type(colname))
 
     def detect_min_constraint(self, colname, value, precision, epsilon):
         name = verification_field(colname, 'min')
-        c = self.df[colname]
+        c = self.column(colname)
         if not pandas_types_compatible(c, value):
-            self.out_df[name] = False
+            self.detections.set_all(name, DETECTION_FAIL)
         elif precision == 'closed' or colname in self.date_cols:
-            self.out_df[name] = detection_field(c, c >= value)
+            self.detections[name] = detection_codes(c, c >= value)
         elif precision == 'open':
-            self.out_df[name] = detection_field(c, c > value)
+            self.detections[name] = detection_codes(c, c > value)
         else:
-            self.out_df[name] = detection_field(c, df_fuzzy_gt(c, value,
-                                                               epsilon))
+            self.detections[name] = detection_codes(c, df_fuzzy_gt(c, value,
+                                                                   epsilon))
 
     def detect_max_constraint(self, colname, value, precision, epsilon):
         name = verification_field(colname, 'max')
-        c = self.df[colname]
+        c = self.column(colname)
         if not pandas_types_compatible(c, value):
-            self.out_df[name] = False
+            self.detections.set_all(name, DETECTION_FAIL)
         elif precision == 'closed' or colname in self.date_cols:
-            self.out_df[name] = detection_field(c, c <= value)
+            self.detections[name] = detection_codes(c, c <= value)
         elif precision == 'open':
-            self.out_df[name] = detection_field(c, c < value)
+            self.detections[name] = detection_codes(c, c < value)
         else:
-            self.out_df[name] = detection_field(c, df_fuzzy_lt(c, value,
-                                                               epsilon))
+            self.detections[name] = detection_codes(c, df_fuzzy_lt(c, value,
+                                                                   epsilon))
 
     def detect_min_length_constraint(self, colname, value):
         name = verification_field(colname, 'min_length')
-        c = self.df[colname]
-        if pandas_coarse_type(c) != 'string':
-            self.out_df[name] = False
+        c = self.column(colname)
+        if self.column_coarse_type(colname) != 'string':
+            self.detections.set_all(name, DETECTION_FAIL)
         else:
-            self.out_df[name] = detection_field(c, c.str.len() >= value)
+            self.detections[name] = detection_codes(c, c.str.len() >= value)
 
     def detect_max_length_constraint(self, colname, value):
         name = verification_field(colname, 'max_length')
-        c = self.df[colname]
-        if pandas_coarse_type(c) != 'string':
-            self.out_df[name] = False
+        c = self.column(colname)
+        if self.column_coarse_type(colname) != 'string':
+            self.detections.set_all(name, DETECTION_FAIL)
         else:
-            self.out_df[name] = detection_field(c, c.str.len() <= value)
+            self.detections[name] = detection_codes(c, c.str.len() <= value)
 
     def detect_tdda_type_constraint(self, colname, value):
         name = verification_field(colname, 'type')
-        self.out_df[name] = False
+        self.detections.set_all(name, DETECTION_FAIL)
 
     def detect_sign_constraint(self, colname, value):
         name = verification_field(colname, 'sign')
-        c = self.df[colname]
+        c = self.column(colname)
 
-        if pandas_coarse_type(c) != 'number':
+        if self.column_coarse_type(colname) != 'number':
             result = False
         elif value == 'null':
-            self.out_df[name] = False
+            self.detections.set_all(name, DETECTION_FAIL)
         elif value == 'positive':
-            self.out_df[name] = detection_field(c, c > 0)
+            self.detections[name] = detection_codes(c, c > 0)
         elif value == 'non-negative':
-            self.out_df[name] = detection_field(c, c >= 0)
+            self.detections[name] = detection_codes(c, c >= 0)
         elif value == 'zero':
-            self.out_df[name] = detection_field(c, c == 0)
+            self.detections[name] = detection_codes(c, c == 0)
         elif value == 'non-positive':
-            self.out_df[name] = detection_field(c, c <= 0)
+            self.detections[name] = detection_codes(c, c <= 0)
         elif value == 'negative':
-            self.out_df[name] = detection_field(c, c < 0)
+            self.detections[name] = detection_codes(c, c < 0)
 
     def detect_max_nulls_constraint(self, colname, value):
         # found more nulls than are allowed, so mark all null values as bad
         name = verification_field(colname, 'max_nulls')
-        c = self.df[colname]
-        self.out_df[name] = pd.notnull(c)
+        c = self.column(colname)
+        self.detections.set_flags(name, pd.notnull(c))
 
     def detect_no_duplicates_constraint(self, colname, value):
         # found duplicates, so mark anything duplicated as bad
         name = verification_field(colname, 'no_duplicates')
-        c = self.df[colname]
-        unique = ~ self.df.duplicated(colname, keep=False)
-        self.out_df[name] = detection_field(c, unique, default=True)
+        c = self.column(colname)
+        unique = ~ c.duplicated(keep=False)
+        self.detections[name] = detection_codes(c, unique, default=True)
 
     def detect_allowed_values_constraint(self, colname, allowed_values,
                                          violations):
         name = verification_field(colname, 'allowed_values')
-        c = self.df[colname]
-        self.out_df[name] = detection_field(c, ~ c.isin(violations))
+        c = self.column(colname)
+        self.detections[name] = detection_codes(c, ~ c.isin(violations))
 
     def detect_rex_constraint(self, colname, violations):
         name = verification_field(colname, 'rex')
-        c = self.df[colname]
-        if pandas_coarse_type(c) != 'string':
-            self.out_df[name] = False
+        c = self.column(colname)
+        if self.column_coarse_type(colname) != 'string':
+            self.detections.set_all(name, DETECTION_FAIL)
         else:
-            self.out_df[name] = detection_field(c, ~ c.isin(violations))
+            self.detections[name] = detection_codes(c, ~ c.isin(violations))
 
     def write_detected_records(self,
                                detect_outpath=None,
@@ -333,14 +817,22 @@ class PandasConstraintDetector(BaseConstraintDetector):
                                rownumber_is_index=True,
                                boolean_ints=False,
                                interleave=False,
+                               chunksize=None,
+                               background_write=False,
+                               max_failures_per_constraint=None,
+                               sample_failures=None,
+                               seed=None,
+                               failure_index=False,
+                               failure_index_path=None,
                                **kwargs):
-        if self.out_df is None:
+        if self.detections is None:
             return None
+        if max_failures_per_constraint and sample_failures:
+            raise Exception('You must not specify both '
+                            'max_failures_per_constraint and '
+                            'sample_failures.')
         orig_fields = list(self.df)
-        output_is_feather = (detect_outpath
-                             and file_format(detect_outpath) == 'feather')
 
-        out_df = self.out_df
         add_index = detect_index or detect_output_fields is None
         if detect_output_fields is None:
             detect_output_fields = []
@@ -348,78 +840,156 @@ class PandasConstraintDetector(BaseConstraintDetector):
             detect_output_fields = list(self.df)
 
         nfailname = 'n_failures'
-        nf = len(list(out_df))
-        fails = (nf - out_df.sum(axis=1).astype(float)
-                    - out_df.isnull().sum(axis=1).astype(float))
-        out_df[nfailname] = fails.astype(int)
-        n_failing_records = (fails > 0).astype(int).sum()
-        n_passing_records = len(out_df) - n_failing_records
-
-        if not detect_per_constraint:
-            fnames = [name for name in list(out_df) if name != nfailname]
-            out_df = out_df.drop(fnames, axis=1)
+        fails = self.detections.n_failures()
+        failing = fails > 0
+        n_failing_records = int(np.count_nonzero(failing))
+        n_passing_records = len(fails) - n_failing_records
 
         if detect_in_place:
-            for fname in list(out_df):
-                newfield = out_df[fname]
+            in_place_df = self.detections.to_frame(
+                                include_constraints=detect_per_constraint)
+            in_place_df[nfailname] = fails
+            for fname in list(in_place_df):
+                newfield = in_place_df[fname]
                 self.df[unique_column_name(self.df, fname)] = newfield
 
-        if detect_output_fields:
-            for fname in reversed(detect_output_fields):
-                if fname in list(self.df):
-                    out_df.insert(0, fname, self.df[fname])
-                else:
-                    raise Exception('DataFrame has no column %s' % fname)
+        # Only the rows that are going to be output are ever turned into
+        # a DataFrame; the (much larger) detection matrix stays as it is.
+        if max_failures_per_constraint or sample_failures:
+            # Only output a limited number of the failing records for
+            # each constraint (though all of them are counted).
+            selected = self.detections.failure_sample(
+                                max_failures_per_constraint or sample_failures,
+                                seed=seed,
+                                first=bool(max_failures_per_constraint))
+            if detect_write_all:
+                selected |= ~ failing
+            positions = np.flatnonzero(selected)
+        elif detect_write_all:
+            positions = np.arange(len(fails))
+        else:
+            positions = np.flatnonzero(failing)
+        options = {
+            'fails': fails,
+            'per_constraint': detect_per_constraint,
+            'output_fields': detect_output_fields,
+            'interleave': interleave,
+            'orig_fields': orig_fields,
+            'nfailname': nfailname,
+        }
+        output_options = {
+            'outpath': detect_outpath,
+            'add_index': add_index,
+            'rownumber_is_index': rownumber_is_index,
+            'boolean_ints': boolean_ints,
+        }
+
+        if detect_outpath and chunksize:
+            # Stream the output, so that memory use depends on the chunk
+            # size, rather than on the number of records being written.
+            writer = DetectionWriter(detect_outpath,
+                                     background=background_write)
+            try:
+                for start in range(0, max(len(positions), 1), chunksize):
+                    chunk = positions[start:start + chunksize]
+                    out_df = self.detection_frame(chunk, **options)
+                    writer.write(self.output_frame(out_df, chunk,
+                                                   streaming=True,
+                                                   **output_options))
+            finally:
+                writer.close()
+            out_df = None
+        else:
+            out_df = self.detection_frame(positions, **options)
+            if detect_outpath:
+                df_to_save = self.output_frame(out_df, positions,
+                                               **output_options)
+                save_df(df_to_save, detect_outpath, index=False)
+
+        if failure_index or failure_index_path:
+            failure_index = self.detections.failure_index()
+            if failure_index_path:
+                failure_index.save(failure_index_path)
+        else:
+            failure_index = None
+        return Detection(out_df, n_passing_records, n_failing_records,
+                         failure_index=failure_index)
+
+    def detection_frame(self, positions, fails, per_constraint, output_fields,
+                        interleave, orig_fields, nfailname):
+        """
+        Build the DataFrame of detection results for the records at the
+        given (integer) positions.
+        """
+        out_df = self.detections.to_frame(include_constraints=per_constraint,
+                                          rows=positions)
+        out_df[nfailname] = fails[positions]
+
+        for fname in reversed(output_fields):
+            if fname in list(self.df):
+                column = self.column(fname).iloc[positions]
+                column.index = out_df.index
+                out_df.insert(0, fname, column)
+            else:
+                raise Exception('DataFrame has no column %s' % fname)
 
         if interleave:
             out_df = self.interleave(out_df, orig_fields, nfailname)
-#             if detect_in_place:  # does not work in place
-#                 self.interleave(self.df, orig_fields, nfailname)
+        return out_df
 
-        if detect_outpath:
-            index_is_trivial = is_pd_index_trivial(out_df)
-            if output_is_feather:
-                df_to_save = out_df
-            else:
-                df_to_save = convert_output_types(out_df, boolean_ints)
-            if add_index:
-                # Add Index or RowNumber columns to output CSV file (or
-                # add appropriate columns to output feather file and reset
-                # its index, because feather doesn't support MultiIndexes
-                # and doesn't retain single indexes).
-                #
-                # TODO: If the feather file is going to be saved using
-                #       pmmif's featherpmm, and if featherpmm were able to
-                #       transparently retain indexes, then we wouldn't need
-                #       to do that in this case (when featherpmm is set, and
-                #       output_is_feather).
-                indexes = []
-                if output_is_feather or rownumber_is_index:
-                    stem = 'Index' if rownumber_is_index else 'RowNumber'
-                    if isinstance(df_to_save.index, pd.MultiIndex):
-                        for i, level in enumerate(df_to_save.index.levels):
-                            name = (df.index.names[i] if df.index.names
-                                    else '%s_%d' % (stem, (i+1)))
-                            pair = (unique_column_name(df_to_save, name),
-                                    df_to_save.index.get_level_values(i))
-                            indexes.append(pair)
-                    else:
-                        indexes.append((unique_column_name(df_to_save, stem),
-                                        df_to_save.index))
-                    df_to_save.reset_index(inplace=True, drop=True)
+    def output_frame(self, out_df, positions, outpath, add_index,
+                     rownumber_is_index, boolean_ints, streaming=False):
+        """
+        Build the DataFrame to be written to a detection output file,
+        from the DataFrame of detection results for the records at the
+        given (integer) positions.
+        """
+        fmt = file_format(outpath)
+        if fmt == 'csv':
+            df_to_save = convert_output_types(out_df, boolean_ints)
+        else:
+            df_to_save = out_df.copy(deep=False)
+            if streaming:
+                # Every chunk must have the same column types, so use
+                # nullable booleans for the detection results, even
+                # for chunks in which there happen to be no nulls.
+                for col in list(df_to_save):
+                    if pd.api.types.infer_dtype(df_to_save[col],
+                                                skipna=True) == 'boolean':
+                        df_to_save[col] = df_to_save[col].astype('boolean')
+        if add_index:
+            # Add Index or RowNumber columns to output CSV file (or
+            # add appropriate columns to output feather file and reset
+            # its index, because feather doesn't support MultiIndexes
+            # and doesn't retain single indexes).
+            #
+            # TODO: If the feather file is going to be saved using
+            #       pmmif's featherpmm, and if featherpmm were able to
+            #       transparently retain indexes, then we wouldn't need
+            #       to do that in this case (when featherpmm is set, and
+            #       output_is_feather).
+            indexes = []
+            if fmt != 'csv' or rownumber_is_index:
+                stem = 'Index' if rownumber_is_index else 'RowNumber'
+                if isinstance(df_to_save.index, pd.MultiIndex):
+                    for i, level in enumerate(df_to_save.index.levels):
+                        name = (self.df.index.names[i]
+                                if self.df.index.names
+                                else '%s_%d' % (stem, (i+1)))
+                        pair = (unique_column_name(df_to_save, name),
+                                df_to_save.index.get_level_values(i))
+                        indexes.append(pair)
                 else:
-                    pair = (unique_column_name(df_to_save, 'RowNumber'),
-                            pd.RangeIndex(1, len(df_to_save)+1))
-                    indexes.append(pair)
-                for name, index in reversed(indexes):
-                    df_to_save.insert(0, name, index)
-            if not detect_write_all:
-                df_to_save = df_to_save[df_to_save[nfailname] > 0]
-            save_df(df_to_save, detect_outpath, index=False)
-
-        if not detect_write_all:
-            out_df = out_df[out_df[nfailname] > 0]
-        return Detection(out_df, n_passing_records, n_failing_records)
+                    indexes.append((unique_column_name(df_to_save, stem),
+                                    df_to_save.index))
+                df_to_save.reset_index(inplace=True, drop=True)
+            else:
+                pair = (unique_column_name(df_to_save, 'RowNumber'),
+                        positions + 1)
+                indexes.append(pair)
+            for name, index in reversed(indexes):
+                df_to_save.insert(0, name, index)
+        return df_to_save
 
     def interleave(self, df, orig_fields, nfailname):
         if set(orig_fields) - set(list(df)):
@@ -448,18 +1018,35 @@ class PandasConstraintVerifier(PandasConstraintCalculator,
     A :py:class:`PandasConstraintVerifier` object provides methods
     for verifying every type of constraint against a Pandas DataFrame.
     """
-    def __init__(self, df, epsilon=None, type_checking=None):
-        PandasConstraintCalculator.__init__(self, df)
+    def __init__(self, df, epsilon=None, type_checking=None, compiled=None):
+        PandasConstraintCalculator.__init__(self, df, compiled=compiled)
         PandasConstraintDetector.__init__(self, df)
         BaseConstraintVerifier.__init__(self, epsilon=epsilon,
                                         type_checking=type_checking)
 
+    def detect(self, constraints, **kwargs):
+        """
+        Apply verifiers to a set of constraints, for detection, as for
+        :py:meth:`BaseConstraintVerifier.detect`.
+        """
+        self.start_detection(constraints)
+        return BaseConstraintVerifier.detect(self, constraints, **kwargs)
+
+    def allowed_values_set(self, colname, allowed_values):
+        if self.compiled and colname in self.compiled.allowed_values:
+            return self.compiled.allowed_values[colname]
+        return set(allowed_values)
+
     def repair_field_types(self, constraints):
         # We sometimes haven't inferred the field types correctly for
         # the dataframe (e.g. if we read it from a csv file, "string"
         # fields might look like numeric ones, if they only contain digits).
         # We can try to use the constraint information to try to repair this,
         # but it's not always going to be successful.
+        #
+        # The repairs are not made to the DataFrame itself; they are
+        # recorded, and only carried out for a column if and when its
+        # values are needed (see column()).
         for c in self.df.columns.tolist():
             if c not in constraints:
                 continue
@@ -467,33 +1054,157 @@ class PandasConstraintVerifier(PandasConstraintCalculator,
             try:
                 ctype = constraints[c]['type'].value
                 dtype = ser.dtype
-                if ctype == 'string' and dtype != np.dtype('O'):
+                if (ctype == 'string' and dtype != np.dtype('O')
+                        and pandas_tdda_type(ser) != 'string'):
                     is_numeric = True
-                    is_real = False
                     for limit in ('min', 'max'):
                         if limit in constraints[c]:
                             limitval = constraints[c][limit].value
-                            if type(limitval) in (int, long_type, float):
-                                if type(limitval) == float:
-                                    is_real = True
-                            else:
+                            if type(limitval) not in (int, long_type, float):
                                 is_numeric = False
                                 break
                     if is_numeric:
-                        if is_real:
-                            is_real = self.calc_non_integer_values_count(c) > 0
-                        self.df.loc[ser.notnull(), c] = ser.astype(str)
-                        if not is_real:
-                            self.df[c] = self.df[c].str.replace('.0', '')
+                        self.repairs[c] = numbers_as_strings
                 elif ctype == 'bool' and dtype == np.dtype('int64'):
-                    self.df[c] = ser.astype(bool)
+                    self.repairs[c] = ints_as_booleans
                 elif ctype == 'bool' and dtype == np.dtype('int32'):
-                    self.df[c] = ser.astype(bool)
+                    self.repairs[c] = ints_as_booleans
             except Exception as e:
                 print('%s: %s' % (e.__class__.__name__, str(e)))
                 pass
 
 
+class PandasCompiledVerifier(object):
+    """
+    A :py:class:`PandasCompiledVerifier` holds a set of constraints,
+    prepared for verifying (or detecting against) any number of
+    DataFrames.
+
+    The constraints are loaded and parsed only once, when the object is
+    constructed, and the regular expressions for ``rex`` constraints
+    are compiled and the values for ``allowed_values`` constraints are
+    converted to sets at the same time. The order in which the fields
+    are verified is also kept, for each set of column names seen.
+
+    This avoids the per-call overhead of :py:func:`verify_df` and
+    :py:func:`detect_df` when verifying many (typically small) DataFrames
+    against the same constraints.
+
+    Example usage::
+
+        from tdda.constraints.pd.constraints import PandasCompiledVerifier
+
+        verifier = PandasCompiledVerifier('example_constraints.tdda')
+        for df in batches:
+            v = verifier.verify(df)
+            if v.failures:
+                print(v)
+    """
+    def __init__(self, constraints_path, epsilon=None, type_checking=None,
+                 repair=True):
+        self.constraints = load_constraints(constraints_path)
+        self.epsilon = epsilon
+        self.type_checking = type_checking
+        self.repair = repair
+        self.rexes = {}
+        self.allowed_values = {}
+        for name in self.constraints.fields:
+            for c in self.constraints.fields[name]:
+                if c.value is None:
+                    continue
+                if c.kind == 'rex':
+                    self.rexes[name] = [re.compile(r, RE_FLAGS)
+                                        for r in c.value]
+                elif c.kind == 'allowed_values':
+                    self.allowed_values[name] = frozenset(c.value)
+        self.field_orders = {}
+
+    def verifier(self, df):
+        """
+        Returns a :py:class:`PandasConstraintVerifier` for the DataFrame,
+        with types repaired (if required) and using the prepared
+        constraints.
+        """
+        pdv = PandasConstraintVerifier(df, epsilon=self.epsilon,
+                                       type_checking=self.type_checking,
+                                       compiled=self)
+        if self.repair:
+            pdv.repair_field_types(self.constraints)
+        return pdv
+
+    def field_order(self, df):
+        """
+        Returns the order in which the constrained fields are verified,
+        for a DataFrame with the columns of the one provided.
+        """
+        key = tuple(df.columns)
+        if key not in self.field_orders:
+            self.field_orders[key] = constrained_field_order(self.constraints,
+                                                             list(key))
+        return self.field_orders[key]
+
+    def verify(self, df, report='all', **kwargs):
+        """
+        Verify the DataFrame provided against the constraints.
+
+        This takes the same optional parameters as :py:func:`verify_df`,
+        apart from those used when constructing the object, and returns
+        a :py:class:`PandasVerification` object.
+        """
+        return self.verifier(df).verify(self.constraints,
+                                        VerificationClass=PandasVerification,
+                                        report=report,
+                                        field_order=self.field_order(df),
+                                        **kwargs)
+
+    def detect(self, df, report='records', **kwargs):
+        """
+        Detect records from the DataFrame provided that fail any of the
+        constraints.
+
+        This takes the same optional parameters as :py:func:`detect_df`,
+        apart from those used when constructing the object, and returns
+        a :py:class:`PandasDetection` object.
+        """
+        return self.verifier(df).detect(self.constraints,
+                                        VerificationClass=PandasDetection,
+                                        report=report,
+                                        field_order=self.field_order(df),
+                                        **kwargs)
+
+
+class PandasGroupVerifier(PandasConstraintVerifier):
+    """
+    A :py:class:`PandasGroupVerifier` verifies constraints against one
+    group of records from a DataFrame, for grouped verification.
+
+    Its cache is pre-loaded with column statistics calculated for all the
+    groups at once (see :py:func:`group_statistics`). Anything else that
+    is needed is calculated from the group's values for a column, which
+    are only extracted from the DataFrame if they are needed.
+    """
+    def __init__(self, verifier, positions, stats, epsilon=None,
+                 type_checking=None):
+        PandasConstraintVerifier.__init__(self, None, epsilon=epsilon,
+                                          type_checking=type_checking)
+        self.verifier = verifier
+        self.positions = positions
+        self.cache = stats
+        self.columns = {}
+
+    def get_column_names(self):
+        return self.verifier.get_column_names()
+
+    def get_nrecords(self):
+        return len(self.positions)
+
+    def column(self, colname):
+        if colname not in self.columns:
+            values = self.verifier.column(colname).iloc[self.positions]
+            self.columns[colname] = values
+        return self.columns[colname]
+
+
 class PandasVerification(Verification):
     """
     A :py:class:`PandasVerification` object adds a :py:meth:`to_frame()`
@@ -543,6 +1254,70 @@ class PandasVerification(Verification):
     to_dataframe = to_frame
 
 
+class PandasGroupedVerification(object):
+    """
+    A :py:class:`PandasGroupedVerification` object holds the results of
+    verifying constraints separately for each group of records in a
+    DataFrame (see the *groupby* parameter to :py:func:`verify_df`).
+
+    Its *verifications* attribute is an ordered dictionary mapping each
+    group key to a :py:class:`PandasVerification` for that group.
+    It also has attributes *passes* and *failures*, for the totals over
+    all the groups, and a :py:meth:`to_frame()` method, which returns a
+    tidy DataFrame with a row for each field in each group.
+    """
+    def __init__(self, groupby, verifications, report='all', ascii=False):
+        self.groupby = groupby
+        self.verifications = verifications
+        self.report = report
+        self.ascii = ascii
+        self.passes = sum(v.passes for v in verifications.values())
+        self.failures = sum(v.failures for v in verifications.values())
+
+    def failing_groups(self):
+        """
+        Returns a list of the keys of the groups with any failures.
+        """
+        return [key for key, v in self.verifications.items()
+                if v.failures > 0]
+
+    def to_frame(self):
+        """
+        Converts the results to a Pandas DataFrame, with the group key
+        columns followed by the columns produced by
+        :py:meth:`PandasVerification.to_frame()`.
+        """
+        frames = []
+        for key, v in self.verifications.items():
+            df = v.to_frame()
+            keys = key if len(self.groupby) > 1 else (key,)
+            for i, name in reversed(list(enumerate(self.groupby))):
+                df.insert(0, unique_column_name(df, name),
+                          [keys[i]] * len(df))
+            frames.append(df)
+        if not frames:
+            return pd.DataFrame(columns=list(self.groupby) + ['field',
+                                                               'failures',
+                                                               'passes'])
+        return pd.concat(frames, ignore_index=True, sort=False)
+
+    to_dataframe = to_frame
+
+    def __str__(self):
+        df = self.to_frame()
+        if self.report in ('fields', 'records'):
+            df = df[df['failures'] > 0]
+        results = (df.to_string(index=False) + '\n\n') if len(df) else ''
+        nfailing = len(self.failing_groups())
+        return ('%sSUMMARY:\n\n'
+                'Groups passing: %d\n'
+                'Groups failing: %d\n'
+                'Constraints passing: %d\n'
+                'Constraints failing: %d'
+                % (results, len(self.verifications) - nfailing, nfailing,
+                   self.passes, self.failures))
+
+
 class PandasDetection(PandasVerification):
     """
     A :py:class:`PandasDetection` object adds a :py:meth:`detected()`
@@ -564,9 +1339,24 @@ class PandasDetection(PandasVerification):
 
         If there are no failing records, and the detection was not run
         with the `write_all` flag set, then ``None`` is returned.
+        ``None`` is also returned if the detection results were streamed
+        to a file in chunks (with the `chunksize` parameter), rather than
+        being constructed in memory.
         """
         return self.detection.obj if self.detection else None
 
+    def failure_index(self):
+        """
+        Returns a :py:class:`FailureIndex`, giving the positions of the
+        records that failed each constraint, as compact run-length encoded
+        row sets. This is available even if the detection results were
+        streamed to file, or only a sample of them was kept.
+
+        ``None`` is returned unless the detection was run with
+        ``failure_index`` set (or with a ``failure_index_path``).
+        """
+        return self.detection.failure_index if self.detection else None
+
 
 class PandasConstraintDiscoverer(PandasConstraintCalculator,
                                  BaseConstraintDiscoverer):
@@ -603,11 +1393,17 @@ def pandas_coarse_type(x):
     Obviously, some people will dislike treating booleans as numbers.
     But it is necessary here.
     """
-    t = pandas_tdda_type(x)
+    return coarse_type(pandas_tdda_type(x))
+
+
+def coarse_type(t):
+    """
+    Returns the TDDA coarse type corresponding to TDDA type *t*.
+    """
     return 'number' if t in ('bool', 'int', 'real') else t
 
 
-def pandas_tdda_type(x):
+def pandas_tdda_type(x, sample=None):
     """
     Returns the TDDA type of a column.
 
@@ -616,24 +1412,23 @@ def pandas_tdda_type(x):
     If *x* is ``None`` or something Pandas classes as null, 'null' is returned.
 
     If *x* is not recognized as one of these, 'other' is returned.
+
+    For object columns, if *sample* is provided, the type is inferred
+    from (at most) that many of the column's non-null values, rather
+    than from all of them.
     """
     if type(x) == str:
         return 'string'
     dt = getattr(x, 'dtype', None)
     if dt == np.dtype('O'):
         # objects could be either strings or booleans-with-nulls or dates
-        for v in x:
-            if type(v) in (bool, np.bool, np.bool_):
-                return 'bool'
-            elif type(v) in (unicode_string, byte_string):
-                return 'string'
-            elif isinstance(v, datetime.datetime):
-                return 'date'
-            elif isinstance(v, datetime.date):
-                return 'date'
-        # if it was all null, there's no way to tell its type, so say string
-        return 'string'
+        return pandas_object_tdda_type(x, sample=sample)
+    if is_categorical_column(x):
+        # the type of a categorical is the type of its categories
+        return pandas_tdda_type(dt.categories, sample=sample)
     dts = str(dt)
+    if dts.startswith('string') or dts.startswith('large_string'):
+        return 'string'     # pandas StringDtype, or Arrow-backed strings
     if type(x) == bool or 'bool' in dts:
         return 'bool'
     if type(x) in (int, long_type) or 'int' in dts:
@@ -656,8 +1451,101 @@ def pandas_tdda_type(x):
     return 'other'
 
 
+# Mapping from the kinds of values returned by pandas' infer_dtype
+# for an object column to TDDA types.
+INFERRED_TDDA_TYPES = {
+    'boolean': 'bool',
+    'string': 'string',
+    'unicode': 'string',
+    'bytes': 'string',
+    'datetime': 'date',
+    'date': 'date',
+    'empty': 'string',  # all null: there's no way to tell, so say string
+}
+
+
+def pandas_object_tdda_type(x, sample=None):
+    """
+    Returns the TDDA type of an object column.
+
+    Object columns could contain strings, booleans-with-nulls or dates.
+    The type is inferred (without examining values one at a time in Python)
+    using pandas' infer_dtype, unless the column contains a mixture of
+    kinds of values, in which case the first value that is a boolean,
+    string or date determines the type.
+    """
+    if sample is not None and len(x) > sample:
+        x = pd.Series(x).dropna()[:sample]
+    kind = pd.api.types.infer_dtype(x, skipna=True)
+    if kind in INFERRED_TDDA_TYPES:
+        return INFERRED_TDDA_TYPES[kind]
+    for v in x:
+        if type(v) in (bool, np.bool_):
+            return 'bool'
+        elif type(v) in (unicode_string, byte_string):
+            return 'string'
+        elif isinstance(v, datetime.datetime):
+            return 'date'
+        elif isinstance(v, datetime.date):
+            return 'date'
+    # if it was all null, there's no way to tell its type, so say string
+    return 'string'
+
+
+def numbers_as_strings(ser):
+    """
+    Returns a copy of a numeric column with its values converted to strings,
+    and nulls left as nulls.
+
+    If all the values in a floating-point column are integers, they are
+    converted without a trailing ``.0``, since the column was probably
+    only floating-point because it contained nulls. (Integers too large
+    for a 64-bit integer are formatted directly from the floating-point
+    values.)
+    """
+    notnull = ser.notnull().values
+    values = ser.values[notnull]
+    strings = np.full(len(ser), np.nan, dtype=object)
+    if (values.dtype.kind == 'f' and np.isfinite(values).all()
+            and (values == np.round(values)).all()):
+        if len(values) == 0 or np.abs(values).max() < 2.0 ** 63:
+            strings[notnull] = values.astype(np.int64).astype(str)
+        else:
+            strings[notnull] = ['%.0f' % v for v in values]
+    else:
+        strings[notnull] = values.astype(str)
+    return pd.Series(strings, index=ser.index, name=ser.name)
+
+
+def ints_as_booleans(ser):
+    """
+    Returns a copy of an integer column with its values converted to booleans.
+    """
+    return ser.astype(bool)
+
+
+def native_scalar(value):
+    """
+    Convert a scalar value from Pandas or NumPy to the corresponding
+    native Python value (with dates as datetime.datetime values).
+    """
+    if pandas_tdda_type(value) == 'date' and hasattr(value, 'to_pydatetime'):
+        return value.to_pydatetime(warn=False)
+    elif hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def is_categorical_column(x):
+    """
+    Is *x* a Pandas categorical column (or other array)?
+    """
+    return isinstance(getattr(x, 'dtype', None),
+                      pd.api.types.CategoricalDtype)
+
+
 def verify_df(df, constraints_path, epsilon=None, type_checking=None,
-              repair=True, report='all', **kwargs):
+              repair=True, report='all', groupby=None, **kwargs):
     """
     Verify that (i.e. check whether) the Pandas DataFrame provided
     satisfies the constraints in the JSON ``.tdda`` file provided.
@@ -785,24 +1673,119 @@ def verify_df(df, constraints_path, epsilon=None, type_checking=None,
     """
     pdv = PandasConstraintVerifier(df, epsilon=epsilon,
                                    type_checking=type_checking)
-    if isinstance(constraints_path, dict):
-        constraints = DatasetConstraints()
-        constraints.initialize_from_dict(native_definite(constraints_path))
-    else:
-        constraints = DatasetConstraints(loadpath=constraints_path)
+    constraints = load_constraints(constraints_path)
     if repair:
         pdv.repair_field_types(constraints)
+    if groupby:
+        return verify_groups(pdv, constraints, groupby, epsilon=epsilon,
+                             type_checking=type_checking, report=report,
+                             **kwargs)
     return pdv.verify(constraints,
                       VerificationClass=PandasVerification,
                       report=report, **kwargs)
 
 
+def load_constraints(constraints_path):
+    """
+    Returns a :py:class:`~tdda.constraints.base.DatasetConstraints` object
+    for the constraints provided, which can be the path to a ``.tdda`` file,
+    an in-memory dictionary with the structured contents of one, or an
+    existing :py:class:`~tdda.constraints.base.DatasetConstraints` object.
+    """
+    if isinstance(constraints_path, DatasetConstraints):
+        return constraints_path
+    elif isinstance(constraints_path, dict):
+        constraints = DatasetConstraints()
+        constraints.initialize_from_dict(native_definite(constraints_path))
+        return constraints
+    else:
+        return DatasetConstraints(loadpath=constraints_path)
+
+
+def verify_groups(pdv, constraints, groupby, epsilon=None,
+                  type_checking=None, report='all', **kwargs):
+    """
+    Verify constraints separately for each group of records in the
+    DataFrame of the :py:class:`PandasConstraintVerifier` provided,
+    grouped by the values of the *groupby* columns.
+
+    The column statistics needed are calculated for all the groups at
+    once, with groupby aggregations, rather than by scanning each group
+    separately. Records with null group keys are not verified.
+
+    Returns a :py:class:`PandasGroupedVerification` object.
+    """
+    if isinstance(groupby, (str, unicode_string)):
+        groupby = [groupby]
+    for name in groupby:
+        if not pdv.column_exists(name):
+            raise Exception('DataFrame has no column %s' % name)
+    grouper = (pdv.column(groupby[0]) if len(groupby) == 1
+               else [pdv.column(name) for name in groupby])
+    stats = group_statistics(pdv, constraints, grouper)
+    indices = pdv.df.groupby(grouper).indices
+    verifications = OrderedDict()
+    for key, positions in indices.items():
+        verifier = PandasGroupVerifier(pdv, positions, stats.get(key, {}),
+                                       epsilon=epsilon,
+                                       type_checking=type_checking)
+        verifications[key] = verifier.verify(
+                                constraints,
+                                VerificationClass=PandasVerification,
+                                report=report, **kwargs)
+    return PandasGroupedVerification(groupby, verifications, report=report,
+                                     ascii=kwargs.get('ascii', False))
+
+
+def group_statistics(pdv, constraints, grouper):
+    """
+    Calculate the column statistics needed to verify the constraints
+    for each group of records, using a groupby aggregation over the whole
+    DataFrame for each statistic.
+
+    Returns a dictionary mapping each group key to a dictionary in the
+    form used by a verifier's cache (mapping each column name to a
+    dictionary of its statistics).
+    """
+    stats = {}
+
+    def add(colname, stat, values):
+        for key, value in values.items():
+            group = stats.setdefault(key, {})
+            group.setdefault(colname, {})[stat] = native_scalar(value)
+
+    for colname in constraints.fields:
+        if not pdv.column_exists(colname):
+            continue
+        kinds = set(c.kind for c in constraints.fields[colname])
+        col = pdv.column(colname)
+        tdda_type = pdv.get_tdda_type(colname)
+        groups = col.groupby(grouper)
+        counts = groups.count()
+        add(colname, 'tdda_type', pd.Series(tdda_type, index=counts.index))
+        add(colname, 'non_null_count', counts)
+        add(colname, 'null_count', groups.size() - counts)
+        if tdda_type == 'string':
+            if kinds & set(['min_length', 'max_length']):
+                lengths = col.str.len().groupby(grouper)
+                add(colname, 'min_length', lengths.min())
+                add(colname, 'max_length', lengths.max())
+        elif kinds & set(['min', 'max', 'sign']):
+            add(colname, 'min', groups.min())
+            add(colname, 'max', groups.max())
+        if kinds & set(['no_duplicates', 'allowed_values']):
+            add(colname, 'nunique', groups.nunique())
+    return stats
+
+
 def detect_df(df, constraints_path, epsilon=None, type_checking=None,
               outpath=None, write_all=False, per_constraint=False,
               output_fields=None, index=False, in_place=False,
               rownumber_is_index=True, boolean_ints=False,
-              repair=True, report='records',
-              **kwargs):
+              repair=True, report='records', chunksize=None,
+              background_write=False, max_failures_per_constraint=None,
+              sample_failures=None, seed=None, failure_index=False,
+              failure_index_path=None, **kwargs):
     """
     Check the records from the Pandas DataFrame provided, to detect
     records that fail any of the constraints in the JSON ``.tdda`` file
@@ -875,7 +1858,7 @@ def detect_df(df, constraints_path, epsilon=None, type_checking=None,
         *outpath*:
                             This specifies that the verification process
                             should detect records that violate any constraints,
-                            and write them out to this CSV (or feather) file.
+                            and write them out to this CSV (or feather or parquet) file.
 
                             By default, only failing records are written out
                             to file, but this can be overridden with the
@@ -941,6 +1924,63 @@ def detect_df(df, constraints_path, epsilon=None, type_checking=None,
                             dataframes that have come from a more reliable
                             source).
 
+        *chunksize*:
+                            If specified (along with ``outpath``), the
+                            detection output file is written in chunks of
+                            this many records, so that the memory needed
+                            does not grow with the number of records
+                            written. In this case, the detection results
+                            are not also returned as a DataFrame, so the
+                            :py:meth:`~PandasDetection.detected()` method
+                            of the result returns ``None``.
+
+                            Writing Feather and Parquet output files
+                            in chunks requires ``pyarrow``.
+
+        *background_write*:
+                            If ``True`` (and ``chunksize`` is specified),
+                            the output file is written in a separate thread,
+                            in parallel with the construction of the
+                            records to be written.
+
+        *max_failures_per_constraint*:
+                            If specified, only the first this-many failing
+                            records for each constraint are included in the
+                            detection results, rather than all of them.
+                            This limits the size of the output, but every
+                            record is still checked against every
+                            constraint, and the numbers of passing and
+                            failing records reported take account of all
+                            of them.
+
+        *sample_failures*:
+                            If specified, a random sample of this many of the
+                            failing records for each constraint is included
+                            in the detection results, rather than all of them.
+                            As with ``max_failures_per_constraint``, every
+                            record is still checked. This cannot be combined
+                            with ``max_failures_per_constraint``.
+
+        *seed*:
+                            Seed for the random number generator used with
+                            ``sample_failures``, to make the sample
+                            reproducible.
+
+        *failure_index*:
+                            If set, the positions of the records that
+                            failed each constraint are kept, as a
+                            :py:class:`FailureIndex`, available from the
+                            result's :py:meth:`~PandasDetection.failure_index`
+                            method.
+
+        *failure_index_path*:
+                            If specified, the positions of the records
+                            that failed each constraint are saved to this
+                            compressed ``.npz`` file, as a
+                            :py:class:`FailureIndex` (which is also kept,
+                            as for ``failure_index``). This can be loaded
+                            with :py:meth:`FailureIndex.load`.
+
     The *report* parameter from :py:func:`verify_df` can also be
     used, in which case a verification report will also be produced in
     addition to the detection results.
@@ -967,11 +2007,7 @@ def detect_df(df, constraints_path, epsilon=None, type_checking=None,
     """
     pdv = PandasConstraintVerifier(df, epsilon=epsilon,
                                    type_checking=type_checking)
-    if isinstance(constraints_path, dict):
-        constraints = DatasetConstraints()
-        constraints.initialize_from_dict(native_definite(constraints_path))
-    else:
-        constraints = DatasetConstraints(loadpath=constraints_path)
+    constraints = load_constraints(constraints_path)
     if repair:
         pdv.repair_field_types(constraints)
     return pdv.detect(constraints, VerificationClass=PandasDetection,
@@ -981,7 +2017,12 @@ def detect_df(df, constraints_path, epsilon=None, type_checking=None,
                       in_place=in_place,
                       rownumber_is_index=rownumber_is_index,
                       boolean_ints=boolean_ints,
-                      report=report, **kwargs)
+                      report=report, chunksize=chunksize,
+                      background_write=background_write,
+                      max_failures_per_constraint=max_failures_per_constraint,
+                      sample_failures=sample_failures, seed=seed,
+                      failure_index=failure_index,
+                      failure_index_path=failure_index_path, **kwargs)
 
 
 def discover_df(df, inc_rex=False, df_path=None):
@@ -1123,13 +2164,46 @@ def file_format(path):
         return 'csv'
     else:
         parts = os.path.splitext(path)
-        return ('feather' if len(parts) > 1 and parts[1] == '.feather'
-                          else 'csv')
+        ext = parts[1] if len(parts) > 1 else ''
+        return ('feather' if ext == '.feather'
+                else 'parquet' if ext == '.parquet'
+                else 'csv')
+
+
+def load_df(path, max_categories=None):
+    """
+    Load a DataFrame from a CSV, feather or parquet file.
+
+    If *max_categories* is specified, string columns with no more than
+    that many distinct values are converted to categoricals, which
+    use much less memory, and allow constraints on them to be verified
+    using just their distinct values.
+    """
+    df = load_df_from_file(path)
+    if max_categories is not None:
+        categorize_strings(df, max_categories)
+    return df
+
+
+def categorize_strings(df, max_categories):
+    """
+    Convert (in place) the string columns of a DataFrame that have no more
+    than *max_categories* distinct values to categoricals.
+    """
+    for col in list(df):
+        c = df[col]
+        if (c.dtype == np.dtype('O')
+                and pandas_tdda_type(c) == 'string'
+                and c.nunique() <= max_categories):
+            df[col] = c.astype('category')
 
 
-def load_df(path):
-    if file_format(path) != 'feather':
+def load_df_from_file(path):
+    fmt = file_format(path)
+    if fmt == 'csv':
         return default_csv_loader(path)
+    elif fmt == 'parquet':
+        return pd.read_parquet(path)
     elif featherpmm and feather:
         ds = featherpmm.read_dataframe(path)
         return ds.df
@@ -1144,8 +2218,10 @@ def load_df(path):
 def save_df(df, path, index=False):
     if path == '-' or path is None:
         print(default_csv_writer(df, None, index=index))
-    elif file_format(path) != 'feather':
+    elif file_format(path) == 'csv':
         default_csv_writer(df, path, index=index)
+    elif file_format(path) == 'parquet':
+        df.to_parquet(path, index=index)
     elif featherpmm and feather:
         featherpmm.write_dataframe(featherpmm.Dataset(df, name='verification'),
                                    path)
@@ -1157,6 +2233,217 @@ def save_df(df, path, index=False):
                         'to add capability.\n')
 
 
+class DetectionWriter(object):
+    """
+    Writes detection output to a file one chunk (DataFrame) at a time,
+    so that the whole output never needs to be held in memory.
+
+    CSV files are appended to chunk by chunk. Feather (Arrow IPC) and
+    Parquet files are written a record batch at a time, which requires
+    ``pyarrow``. Their column types are unified across chunks: a column
+    that is entirely null in one chunk takes its type from the others
+    (the first few chunks are held back, if necessary, until every
+    column's type is known, and any column that is still entirely null
+    is then written as strings), and integer columns become floating
+    point if any of those chunks has floating-point values for them.
+    Numeric values in later chunks are converted to the column's type,
+    provided that doesn't change them (as for a column of integers with
+    some nulls, which Pandas holds as floating point values). Any other
+    inconsistency in a column's type between chunks is an error.
+
+    If *background* is set, chunks are written by a separate thread,
+    so that writing can proceed in parallel with the construction of
+    the next chunk. At most MAX_QUEUED_CHUNKS chunks are held waiting
+    to be written.
+    """
+    def __init__(self, path, background=False):
+        self.path = path
+        self.to_stdout = path == '-' or path is None
+        self.format = 'csv' if self.to_stdout else file_format(path)
+        if not can_write_in_chunks(path):
+            raise Exception('Writing %s files in chunks requires pyarrow.\n'
+                            'Use:\n    pip install pyarrow\nto add '
+                            'capability, or do not specify a chunksize.\n'
+                            % self.format)
+        self.nchunks = 0
+        self.pending = []
+        self.schema = None
+        self.sink = None
+        self.error = None
+        self.queue = None
+        self.thread = None
+        if background:
+            self.queue = queue.Queue(maxsize=MAX_QUEUED_CHUNKS)
+            self.thread = threading.Thread(target=self.consume)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def write(self, df):
+        """
+        Write (or queue for writing) the next chunk of the output.
+        """
+        if self.queue is None:
+            self.write_chunk(df)
+        elif self.error is not None:
+            raise self.error
+        else:
+            self.queue.put(df)
+
+    def consume(self):
+        # Keep taking chunks off the queue even after an error, so
+        # that the producer never blocks; the error is re-raised
+        # in the producer's thread.
+        while True:
+            df = self.queue.get()
+            if df is None:
+                break
+            if self.error is None:
+                try:
+                    self.write_chunk(df)
+                except Exception as e:
+                    self.error = e
+
+    def close(self):
+        """
+        Finish writing the output, waiting for any queued chunks to be
+        written first.
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.error is None:
+            try:
+                self.finish()
+            except Exception as e:
+                self.error = e
+        if self.error is not None:
+            if self.sink is not None:
+                self.sink.close()
+            raise self.error
+
+    def write_chunk(self, df):
+        if self.format == 'csv':
+            self.write_csv(df)
+        else:
+            self.write_arrow(df)
+        self.nchunks += 1
+
+    def write_csv(self, df):
+        first = self.nchunks == 0
+        if self.to_stdout:
+            sys.stdout.write(default_csv_writer(df, None, header=first))
+        else:
+            default_csv_writer(df, self.path, header=first,
+                               mode='w' if first else 'a')
+
+    def write_arrow(self, df):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.sink is not None:
+            self.sink.write_table(self.conform(table))
+            return
+        self.pending.append(table)
+        schema = unified_arrow_schema([t.schema for t in self.pending])
+        if (len(self.pending) < MAX_UNTYPED_CHUNKS
+                and any(pa.types.is_null(f.type) for f in schema)):
+            return      # wait for more chunks, to find the missing types
+        self.write_pending()
+
+    def write_pending(self):
+        schema = unified_arrow_schema([t.schema for t in self.pending],
+                                      null_type=pa.string())
+        self.schema = schema
+        if self.format == 'parquet':
+            self.sink = pq.ParquetWriter(self.path, schema)
+        else:
+            self.sink = pa.ipc.new_file(self.path, schema)
+        (pending, self.pending) = (self.pending, [])
+        for table in pending:
+            self.sink.write_table(self.conform(table))
+
+    def conform(self, table):
+        """
+        Convert an Arrow table to the schema of the output file, raising
+        an exception if its column types are not compatible with it.
+        """
+        for (field, target) in zip(table.schema, self.schema):
+            if not (field.type == target.type
+                    or pa.types.is_null(field.type)
+                    or (is_arrow_numeric(field.type)
+                        and is_arrow_numeric(target.type))):
+                raise Exception('Column %s has type %s, but has been '
+                                'written with type %s'
+                                % (field.name, field.type, target.type))
+        if not table.schema.equals(self.schema):
+            table = table.cast(self.schema)     # fails if values would change
+        return table
+
+    def finish(self):
+        if self.pending:
+            self.write_pending()
+        if self.sink is not None:
+            self.sink.close()
+        elif self.to_stdout and self.nchunks > 0:
+            print()   # for consistency with save_df
+
+
+def can_write_in_chunks(path):
+    """
+    Can detection output be written to the given path in chunks,
+    with a :py:class:`DetectionWriter`?
+    """
+    return (path == '-' or path is None or file_format(path) == 'csv'
+            or pa is not None)
+
+
+def is_arrow_numeric(t):
+    return pa.types.is_integer(t) or pa.types.is_floating(t)
+
+
+def unified_arrow_schema(schemas, null_type=None):
+    """
+    Combine the Arrow schemas of a set of chunks of a DataFrame into a
+    single schema covering all of them.
+
+    A column's type is its type in the chunks where it isn't entirely null
+    (or *null_type*, if specified, if it is null in all of them), with
+    integer types promoted to floating point if they are mixed. Any
+    other difference between chunks raises an exception.
+    """
+    fields = []
+    for column in zip(*schemas):
+        name = column[0].name
+        types = []
+        for field in column:
+            if not pa.types.is_null(field.type) and field.type not in types:
+                types.append(field.type)
+        if not types:
+            fields.append(pa.field(name, null_type or pa.null()))
+        elif len(types) == 1:
+            fields.append(column[0] if column[0].type == types[0]
+                          else pa.field(name, types[0]))
+        elif all(is_arrow_numeric(t) for t in types):
+            fields.append(pa.field(name, pa.float64()))
+        else:
+            raise Exception('Column %s has inconsistent types: %s'
+                            % (name, ', '.join(str(t) for t in types)))
+    metadata = schemas[0].metadata
+    schema = pa.schema(fields)
+    if all(s.equals(schema) for s in schemas):
+        schema = pa.schema(fields, metadata=metadata)
+    return schema
+
+
+def iter_failure_blocks(codes, blocksize=DETECTION_BLOCK_SIZE):
+    """
+    Generator yielding, for successive blocks of a column of detection
+    codes, an array of the positions of the failing records in it.
+    """
+    for start in range(0, len(codes), blocksize):
+        block = codes[start:start + blocksize]
+        yield np.flatnonzero(block == DETECTION_FAIL) + start
+
+
 def unique_column_name(df, name):
     """
     Generate a column name that is not already present in the dataframe.
@@ -1169,13 +2456,35 @@ def unique_column_name(df, name):
     return newname
 
 
-def detection_field(column, expr, default=None):
+def detection_codes(column, expr, default=None):
+    """
+    Construct the detection codes for a column from a boolean expression
+    (a Series or array), with nulls in the column mapped to DETECTION_NULL,
+    or to the detection code for *default* if it is provided.
     """
-    Construct a field for a detection result
+    if hasattr(expr, 'to_numpy'):
+        # nullable (e.g. string-dtype) results may have missing values;
+        # those are for nulls in the column, which are set below
+        expr = expr.to_numpy(dtype=bool, na_value=False)
+    codes = np.where(np.asarray(expr, dtype=bool), DETECTION_PASS,
+                     DETECTION_FAIL).astype(np.int8)
+    null_code = (DETECTION_NULL if default is None
+                 else DETECTION_PASS if default else DETECTION_FAIL)
+    codes[np.asarray(pd.isnull(column))] = null_code
+    return codes
+
+
+def detection_values(codes, boolean=False):
     """
-    default_value = (np.nan if default is None
-                            else (np.ones(len(column)) * default))
-    return np.where(pd.isnull(column), default_value, expr.astype('O'))
+    Construct a field for a detection result from an array of detection
+    codes, as a boolean array, or as an object array with NaN for nulls.
+    """
+    passes = codes == DETECTION_PASS
+    if boolean:
+        return passes
+    values = passes.astype('O')
+    values[codes == DETECTION_NULL] = np.nan
+    return values
 
 
 def convert_output_types(df, boolean_ints):
@@ -1183,23 +2492,47 @@ def convert_output_types(df, boolean_ints):
     Construct a new DataFrame with boolean values mapped to appropriate
     string equivalents (usually "true" and "false", but optionally "1" and
     "0")
+
+    Boolean columns, and object columns containing only booleans and nulls,
+    are converted to categoricals with those two string values as their
+    categories. Other columns are shared with the original DataFrame,
+    rather than being copied.
     """
-    newdf = pd.DataFrame(index=df.index)
     trueval = '1' if boolean_ints else 'true'
     falseval = '0' if boolean_ints else 'false'
-    pandas_true_values = (True, np.bool(True), np.bool_(True))
-    pandas_false_values = (True, np.bool(False), np.bool_(False))
+    newdf = df.copy(deep=False)
     for col in list(df):
-        c = df[col]
-        if c.dtype in (np.dtype('O'), np.dtype(bool)):
-            newdf[col] = [(trueval if v in pandas_true_values
-                           else falseval if v in pandas_false_values
-                           else v) for v in c]
-        else:
-            newdf[col] = c
+        values = boolean_output_values(df[col], trueval, falseval)
+        if values is not None:
+            newdf[col] = values
     return newdf
 
 
+def boolean_output_values(c, trueval, falseval):
+    """
+    Returns the values of a column with booleans mapped to *trueval* and
+    *falseval*, or None if it doesn't contain any booleans.
+    """
+    if c.dtype == np.dtype(bool):
+        return pd.Categorical.from_codes(c.values.astype(np.int8),
+                                         categories=[falseval, trueval])
+    elif c.dtype != np.dtype('O'):
+        return None
+
+    kind = pd.api.types.infer_dtype(c, skipna=True)
+    if kind == 'boolean':
+        values = c.values
+        codes = np.where(values == True, 1, np.where(values == False, 0, -1))
+        return pd.Categorical.from_codes(codes.astype(np.int8),
+                                         categories=[falseval, trueval])
+    elif kind.startswith('mixed'):
+        values = c.values
+        return np.where(values == True, trueval,
+                        np.where(values == False, falseval, values))
+    else:
+        return None
+
+
 def is_pd_index_trivial(df):
     """
     Is this a trivial Pandas index (starting at 0, monotonic with no dups)?
@@ -23,7 +23,7 @@ Parameters:
   * constraints.tdda, if provided, is a JSON .tdda file constaining
     constraints.
 
-  * name of output file (.csv or .feather) where detection results
+  * name of output file (.csv, .feather or .parquet) where detection results
     are to be written. Can be - (or missing) to write to standard output.
 
 '''
@@ -50,7 +50,8 @@ except ImportError:
 
 from tdda import __version__
 from tdda.constraints.flags import detect_parser, detect_flags
-from tdda.constraints.pd.constraints import detect_df, load_df, file_format
+from tdda.constraints.pd.constraints import (detect_df, load_df, file_format,
+                                             can_write_in_chunks)
 
 
 def detect_df_from_file(df_path, constraints_path, outpath,
@@ -92,6 +93,10 @@ def pd_detect_params(args):
     params['df_path'] = flags.input
     params['constraints_path'] = flags.constraints
     params['outpath'] = flags.outpath
+    if 'chunksize' in params and not can_write_in_chunks(flags.outpath):
+        print('--chunksize needs pyarrow to write a %s file.'
+              % file_format(flags.outpath), file=sys.stderr)
+        sys.exit(1)
     return params
 
 
@@ -35,6 +35,11 @@ try:
 except ImportError:
     feather = None
 
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
 from tdda.constraints.base import (
     MinConstraint,
     MaxConstraint,
@@ -54,6 +59,8 @@ from tdda.constraints.base import (
     fuzzy_less_than,
     fuzzy_greater_than,
 )
+from tdda.constraints.cache import (VerificationCache, cache_value,
+                                    from_cache_value)
 from tdda.constraints.console import main_with_argv
 
 from tdda.constraints.pd import constraints as pdc
@@ -61,6 +68,7 @@ from tdda.constraints.pd.constraints import (load_df, verify_df,
                                              discover_df, detect_df)
 from tdda.constraints.pd.discover import discover_df_from_file
 from tdda.constraints.pd.verify import verify_df_from_file#, detect_df_from_file
+from tdda.constraints.pd.verify import verify_file_cached
 from tdda.constraints.pd.detect import detect_df_from_file
 
 from tdda.examples import copy_accounts_data_unzipped
@@ -174,6 +182,33 @@ class TestPandasIndividualConstraintVerifier(ReferenceTestCase):
         for v in OTHERS:
             self.assertEqual(pdc.pandas_tdda_type(v), 'other')
 
+    def test_tdda_types_of_object_columns(self):
+        nulls = [None] * 1000
+        cases = [
+            (nulls + ['a', 'b'], 'string'),
+            (nulls + [True, False], 'bool'),
+            (nulls + [datetime.datetime(2018, 1, 1)], 'date'),
+            (nulls + [datetime.date(2018, 1, 1)], 'date'),
+            (nulls, 'string'),
+            ([1, 'a', True], 'string'),
+            ([1, True, 'a'], 'bool'),
+        ]
+        for values, expected in cases:
+            col = pd.Series(values, dtype=object)
+            self.assertEqual(pdc.pandas_tdda_type(col), expected)
+            self.assertEqual(pdc.pandas_tdda_type(col, sample=10), expected)
+        mixed = pd.Series(['a'] * 10 + [True], dtype=object)
+        self.assertEqual(pdc.pandas_tdda_type(mixed, sample=5), 'string')
+
+    def test_all_non_nulls_boolean(self):
+        df = pd.DataFrame({'b': [True, None, False],
+                           's': [True, None, 'a'],
+                           'n': [None, None, None]})
+        calc = pdc.PandasConstraintCalculator(df)
+        self.assertTrue(calc.calc_all_non_nulls_boolean('b'))
+        self.assertFalse(calc.calc_all_non_nulls_boolean('s'))
+        self.assertTrue(calc.calc_all_non_nulls_boolean('n'))
+
     def test_coarse_types_of_base_types(self):
         self.assertEqual(pdc.pandas_tdda_type(None), 'null')
         for v in BOOLS:
@@ -962,6 +997,31 @@ class TestPandasMultipleConstraintVerifier(ReferenceTestCase):
         vdf.sort_values('field', inplace=True)
         self.assertStringCorrect(vdf.to_string(), 'elements118rex.df')
 
+    def testElements118rexCategorical(self):
+        csv_path = os.path.join(TESTDATA_DIR, 'elements118.csv')
+        df = load_df(csv_path, max_categories=200)
+        self.assertEqual(str(df['Symbol'].dtype), 'category')
+        constraints_path = os.path.join(TESTDATA_DIR, 'elements92rex.tdda')
+        v = verify_df(df, constraints_path, report='fields')
+        self.assertEqual(v.passes, 61)
+        self.assertEqual(v.failures, 17)
+        vdf = v.to_dataframe()
+        vdf.sort_values('field', inplace=True)
+        self.assertStringCorrect(vdf.to_string(), 'elements118rex.df')
+
+    def testCategoricalStringCalculations(self):
+        df = pd.DataFrame({'s': pd.Categorical(['bb', None, 'a', 'bb'],
+                                               categories=['a', 'bb',
+                                                           'unused'])})
+        calc = pdc.PandasConstraintCalculator(df)
+        self.assertEqual(pdc.pandas_tdda_type(df['s']), 'string')
+        self.assertEqual(calc.calc_nunique('s'), 2)
+        self.assertEqual(calc.calc_null_count('s'), 1)
+        self.assertEqual(calc.calc_min_length('s'), 1)
+        self.assertEqual(calc.calc_max_length('s'), 2)
+        self.assertEqual(calc.calc_unique_values('s', include_nulls=False),
+                         ['a', 'bb'])
+
 
 class TestPandasDataFrameConstraints(ReferenceTestCase):
     def testDDD_df(self):
@@ -1123,6 +1183,199 @@ class TestPandasDataFrameConstraints(ReferenceTestCase):
         self.assertFalse(v.fields['a']['type'])
         self.assertFalse(v.fields['a']['sign'])
 
+    def testVerifyWithRepairLeavesDataFrameUnchanged(self):
+        df = pd.DataFrame({'a': [100, 20, np.nan],
+                           'b': [1, 0, 1],
+                           'c': [1.5, 2.0, 3.0]})
+        original = df.copy()
+        cdict = {
+            'fields': {
+                'a': {'type': 'string', 'min_length': 2, 'max_length': 3,
+                      'allowed_values': ['100', '20']},
+                'b': {'type': 'bool'},
+                'c': {'type': 'string', 'max_length': 3},
+            }
+        }
+        v = verify_df(df, cdict)
+        self.assertEqual(v.failures, 0)
+        self.assertTrue(df.equals(original))
+
+        constraints = DatasetConstraints()
+        constraints.initialize_from_dict(native_definite(cdict))
+        verifier = pdc.PandasConstraintVerifier(df)
+        verifier.repair_field_types(constraints)
+        self.assertEqual(verifier.repaired, {})
+        self.assertEqual(list(verifier.column('a'))[:2], ['100', '20'])
+        self.assertTrue(pd.isnull(verifier.column('a')[2]))
+        self.assertEqual(list(verifier.column('b')), [True, False, True])
+        self.assertEqual(list(verifier.column('c')), ['1.5', '2.0', '3.0'])
+        self.assertTrue(df.equals(original))
+
+    def testVerifyGrouped(self):
+        df = pd.DataFrame({'g': ['a', 'a', 'b', 'b', 'c'],
+                           'x': [1.0, 2.0, 3.0, np.nan, -5.0],
+                           's': ['aa', 'b', 'ccc', 'dd', None]})
+        cdict = {
+            'fields': {
+                'g': {'type': 'string', 'allowed_values': ['a', 'b']},
+                'x': {'type': 'real', 'min': 0.0, 'max_nulls': 1},
+                's': {'type': 'string', 'max_length': 3, 'max_nulls': 0,
+                      'no_duplicates': True},
+            }
+        }
+        v = verify_df(df, cdict, groupby='g')
+        self.assertEqual(list(v.verifications.keys()), ['a', 'b', 'c'])
+        self.assertEqual(v.failing_groups(), ['c'])
+        self.assertEqual(v.failures, 3)
+        for key, group in df.groupby('g'):
+            expected = verify_df(group.reset_index(drop=True), cdict)
+            self.assertEqual(v.verifications[key].passes, expected.passes)
+            self.assertEqual(v.verifications[key].failures,
+                             expected.failures)
+
+        results = v.to_frame()
+        self.assertEqual(list(results.columns[:4]),
+                         ['g', 'field', 'failures', 'passes'])
+        self.assertEqual(list(results['g']), ['a'] * 3 + ['b'] * 3 + ['c'] * 3)
+        self.assertEqual(list(results['failures']), [0, 0, 0,
+                                                     0, 0, 0,
+                                                     1, 1, 1])
+        self.assertTrue('Groups failing: 1' in str(v))
+
+        v2 = verify_df(df, cdict, groupby=['g', 's'])
+        self.assertEqual(len(v2.verifications), 4)
+        self.assertEqual(list(v2.to_frame().columns[:3]),
+                         ['g', 's', 'field'])
+
+    def testCompiledVerifier(self):
+        cdict = {
+            'fields': {
+                'a': {'type': 'int', 'min': 0, 'max': 10},
+                's': {'type': 'string', 'allowed_values': ['x', 'y'],
+                      'rex': ['^[a-z]$']},
+            }
+        }
+        verifier = pdc.PandasCompiledVerifier(cdict)
+        self.assertEqual(verifier.allowed_values['s'], frozenset(['x', 'y']))
+        self.assertEqual(len(verifier.rexes['s']), 1)
+        dfs = [
+            pd.DataFrame({'a': [1, 2], 's': ['x', 'y']}),
+            pd.DataFrame({'s': ['x', 'Z', 'z'], 'a': [1, 20, 3]}),
+            pd.DataFrame({'a': [1, 2, 3]}),
+        ]
+        for df in dfs:
+            v = verifier.verify(df)
+            expected = verify_df(df, cdict)
+            self.assertEqual(v.passes, expected.passes)
+            self.assertEqual(v.failures, expected.failures)
+            self.assertEqual(list(v.fields.keys()),
+                             list(expected.fields.keys()))
+            self.assertTrue(v.to_frame().equals(expected.to_frame()))
+        self.assertEqual(len(verifier.field_orders), 3)
+
+        d = verifier.detect(dfs[1], per_constraint=True)
+        self.assertEqual(list(d.detected().index), [1, 2])
+        self.assertEqual(list(d.detected()['n_failures']), [3, 1])
+
+    def testVerificationCache(self):
+        df = pd.DataFrame({'a': [1, 2, 30], 's': ['x', 'y', 'x']})
+        cdict = {
+            'fields': {
+                'a': {'type': 'int', 'min': 0, 'max': 10},
+                's': {'type': 'string', 'allowed_values': ['x', 'y'],
+                      'rex': ['^[a-z]$']},
+            }
+        }
+        verifiers = []
+        max_calcs = []
+
+        class CountingVerifier(pdc.PandasConstraintVerifier):
+            def calc_max(self, colname):
+                max_calcs.append(colname)
+                return pdc.PandasConstraintVerifier.calc_max(self, colname)
+
+        def make_verifier():
+            verifiers.append(CountingVerifier(df))
+            return verifiers[-1]
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for version, nverifiers in (('1', 1), ('1', 1), ('2', 2)):
+                cache = VerificationCache(tmpdir, 'df', version)
+                constraints = pdc.load_constraints(cdict)
+                v = cache.verify(constraints, make_verifier,
+                                 VerificationClass=pdc.PandasVerification)
+                self.assertEqual(len(verifiers), nverifiers)
+                self.assertEqual(max_calcs, ['a'] * nverifiers)
+                self.assertEqual((v.passes, v.failures), (5, 1))
+                self.assertTrue(v.to_frame().equals(
+                                    verify_df(df, cdict).to_frame()))
+
+            # a changed constraint is checked using the cached statistics
+            cdict['fields']['a']['max'] = 100
+            cache = VerificationCache(tmpdir, 'df', '2')
+            v = cache.verify(pdc.load_constraints(cdict), make_verifier)
+            self.assertEqual(len(verifiers), 3)
+            self.assertEqual(max_calcs, ['a', 'a'])   # not recalculated
+            self.assertEqual(verifiers[-1].cache['a']['max'], 30)
+            self.assertEqual((v.passes, v.failures), (6, 0))
+            # saved atomically, leaving no temporary files behind
+            self.assertEqual(os.listdir(tmpdir),
+                             [os.path.basename(cache.path)])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testVerificationCacheTypeChange(self):
+        # statistics calculated for one type are not reused when a changed
+        # type constraint means that the column's type is repaired
+        tmpdir = tempfile.mkdtemp()
+        try:
+            csv_path = os.path.join(tmpdir, 'data.csv')
+            with open(csv_path, 'w') as f:
+                f.write('a\n1\n2\n10\n\n')
+            cache_dir = os.path.join(tmpdir, 'cache')
+            for field in ({'type': 'real', 'max_nulls': 0},
+                          {'type': 'string', 'max_length': 2},
+                          {'type': 'real', 'max_nulls': 0}):
+                constraints_path = os.path.join(tmpdir, 'data.tdda')
+                with open(constraints_path, 'w') as f:
+                    json.dump({'fields': {'a': field}}, f)
+                uncached = verify_df_from_file(csv_path, constraints_path,
+                                               verbose=False)
+                v = verify_file_cached(csv_path, constraints_path, cache_dir)
+                self.assertEqual(v.fields, uncached.fields)
+                self.assertEqual((v.passes, v.failures),
+                                 (uncached.passes, uncached.failures))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testVerificationCacheValues(self):
+        utc = datetime.timezone.utc
+        for value in (datetime.datetime(2020, 2, 29, 12, 30, 15, 250),
+                      datetime.datetime(2020, 2, 29, 12, 30, 15, tzinfo=utc),
+                      pd.Timestamp('2020-02-29 12:30:15+0530'),
+                      np.int64(3), 2.5, 'x', ['x', 'y'], None):
+            cached = json.loads(json.dumps(cache_value(value)))
+            self.assertEqual(from_cache_value(cached), value)
+            if isinstance(value, datetime.datetime):
+                self.assertEqual(from_cache_value(cached).utcoffset(),
+                                 value.utcoffset())
+        self.assertRaises(ValueError, cache_value, [1.0, float('nan')])
+
+    def testNumbersAsStrings(self):
+        ser = pd.Series([1e20, -3.0, np.nan, 2.0 ** 63])
+        self.assertEqual(list(pdc.numbers_as_strings(ser).fillna('')),
+                         ['100000000000000000000', '-3', '',
+                          '9223372036854775808'])
+        ser = pd.Series([1.0, 2.0 ** 62, np.nan])
+        self.assertEqual(list(pdc.numbers_as_strings(ser).fillna('')),
+                         ['1', '4611686018427387904', ''])
+        ser = pd.Series([1.0, np.inf, 2.5])
+        self.assertEqual(list(pdc.numbers_as_strings(ser)),
+                         ['1.0', 'inf', '2.5'])
+        self.assertEqual(len(pdc.numbers_as_strings(pd.Series([np.nan]))),
+                         1)
+
     def testVerifyStringLengthWithWrongType(self):
         df = pd.DataFrame({'a': [1, 2, -1]})
         cdict = {
@@ -1168,6 +1421,28 @@ class TestPandasDataFrameConstraints(ReferenceTestCase):
         self.assertTrue(not d['b_min_ok'].any())
         self.assertTrue(not d['b_max_ok'].any())
 
+    def testDetectStringDtypeWithNulls(self):
+        values = ['ab', 'c', None, 'dd']
+        cdict = {
+            'fields': {
+                's': {
+                    'type': 'string',
+                    'max_length': 1,
+                    'allowed_values': ['ab', 'c'],
+                    'rex': ['^[a-c]+$'],
+                    'max_nulls': 0,
+                }
+            }
+        }
+        expected = detect_df(pd.DataFrame({'s': pd.Series(values,
+                                                          dtype=object)}),
+                             cdict, per_constraint=True).detected()
+        v = detect_df(pd.DataFrame({'s': pd.array(values, dtype='string')}),
+                      cdict, per_constraint=True)
+        self.assertEqual((v.passes, v.failures), (1, 4))
+        self.assertEqual(list(v.detected()['n_failures']), [1, 1, 3])
+        self.assertTrue(v.detected().equals(expected))
+
     def testVerifyWithMalformedInMemoryConstraintDict(self):
         df = pd.DataFrame({'a': [1, 2, 3], 'b': ['one', 'two', 'three']})
         cdicts = [
@@ -1354,6 +1629,146 @@ class TestPandasMultipleConstraintDetector(ReferenceTestCase):
         else:
             self.assertTextFileCorrect(detectfile, detect_name)
 
+    def testDetectElements118_csv_to_csv_chunked(self):
+        csv_path = os.path.join(TESTDATA_DIR, 'elements118.csv')
+        df = load_df(csv_path)
+        constraints_path = os.path.join(TESTDATA_DIR, 'elements92.tdda')
+        detect_name = 'elements118_detect_from_csv.csv'
+        for background_write in (False, True):
+            detectfile = os.path.join(self.tmp_dir, detect_name)
+            v = detect_df(df.copy(), constraints_path, report='fields',
+                          outpath=detectfile, output_fields=['Z'],
+                          per_constraint=True, index=True,
+                          rownumber_is_index=False, chunksize=10,
+                          background_write=background_write)
+            self.assertEqual(v.detection.n_passing_records, 91)
+            self.assertEqual(v.detection.n_failing_records, 27)
+            self.assertIsNone(v.detected())
+            self.assertTextFileCorrect(detectfile, detect_name)
+
+    def testDetectSampledFailures(self):
+        df = pd.DataFrame({'a': list(range(-50, 50)),
+                           'b': list(range(100))})
+        cdict = {'fields': {'a': {'type': 'int', 'min': 0},
+                            'b': {'type': 'int', 'max': 89}}}
+        v = detect_df(df, cdict, per_constraint=True, output_fields=[],
+                      max_failures_per_constraint=3)
+        self.assertEqual(v.detection.n_failing_records, 60)
+        self.assertEqual(list(v.detected().index), [0, 1, 2, 90, 91, 92])
+        samples = [detect_df(df, cdict, sample_failures=5, seed=7)
+                   .detected() for i in range(2)]
+        self.assertEqual(len(samples[0]), 10)
+        self.assertEqual(list(samples[0].index), list(samples[1].index))
+        self.assertTrue((samples[0]['n_failures'] > 0).all())
+        with self.assertRaises(Exception):
+            detect_df(df, cdict, sample_failures=5,
+                      max_failures_per_constraint=3)
+
+    def testFailureSampleInBlocks(self):
+        index = pd.RangeIndex(1000, name='Index')
+        m = pdc.DetectionMatrix(index, capacity=1)
+        failed = np.arange(1000) % 7 == 3
+        m.set_flags('a_ok', ~ failed)
+        positions = np.flatnonzero(failed)
+        for blocksize in (10, 64, 1000):
+            blocks = list(pdc.iter_failure_blocks(m.codes()[:, 0], blocksize))
+            self.assertEqual(list(np.concatenate(blocks)), list(positions))
+        first = m.failure_sample(5, first=True)
+        self.assertEqual(list(np.flatnonzero(first)), list(positions[:5]))
+        sample = np.flatnonzero(m.failure_sample(20, seed=3))
+        self.assertEqual(len(sample), 20)
+        self.assertTrue(set(sample) <= set(positions))
+        self.assertEqual(list(np.flatnonzero(m.failure_sample(20, seed=3))),
+                         list(sample))
+        self.assertEqual(m.failure_sample(1000).sum(), len(positions))
+
+    def testRowSet(self):
+        mask = np.array([False, True, True, False, True, False, False, True])
+        rows = pdc.RowSet.from_mask(mask)
+        self.assertEqual(list(rows.starts), [1, 4, 7])
+        self.assertEqual(list(rows.lengths), [2, 1, 1])
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(list(rows.positions()), [1, 2, 4, 7])
+        self.assertEqual(list(rows.to_mask()), list(mask))
+        other = pdc.RowSet.from_positions([0, 1, 7], 8)
+        self.assertEqual(list((rows | other).positions()), [0, 1, 2, 4, 7])
+        self.assertEqual(list((rows & other).positions()), [1, 7])
+        self.assertEqual(list((rows - other).positions()), [2, 4])
+        with self.assertRaises(Exception):
+            rows | pdc.RowSet.from_positions([0], 9)
+        # runs that touch or overlap are merged
+        runs = pdc.RowSet([0, 6], [3, 2], 8)
+        self.assertEqual((rows | runs), pdc.RowSet([0, 4, 6], [3, 1, 2], 8))
+        self.assertEqual((runs - rows), pdc.RowSet([0, 6], [1, 1], 8))
+        self.assertEqual(list((rows & runs).to_mask()),
+                         list(mask & runs.to_mask()))
+
+    def testDetectFailureIndex(self):
+        df = pd.DataFrame({'a': list(range(-5, 5)),
+                           'b': list(range(10))})
+        cdict = {'fields': {'a': {'type': 'int', 'min': 0},
+                            'b': {'type': 'int', 'max': 3}}}
+        path = os.path.join(self.tmp_dir, 'detect_failures.npz')
+        v = detect_df(df, cdict, failure_index_path=path)
+        index = v.failure_index()
+        self.assertEqual(list(index), ['a_min_ok', 'b_max_ok'])
+        self.assertEqual(list(index['a_min_ok'].positions()), [0, 1, 2, 3, 4])
+        self.assertEqual(len(index.union()), 10)
+        self.assertEqual(list(index.intersection().positions()), [4])
+        loaded = pdc.FailureIndex.load(path)
+        self.assertEqual(list(loaded), list(index))
+        self.assertEqual(loaded.nrecords, 10)
+        for name in index:
+            self.assertEqual(loaded[name], index[name])
+        # only built when asked for
+        self.assertIsNone(detect_df(df, cdict).failure_index())
+        index = detect_df(df, cdict, failure_index=True).failure_index()
+        self.assertEqual(index['b_max_ok'], loaded['b_max_ok'])
+
+    def testDetectionWriterErrorInBackground(self):
+        path = os.path.join(self.tmp_dir, 'nonexistent', 'detect.csv')
+        writer = pdc.DetectionWriter(path, background=True)
+        writer.write(pd.DataFrame({'a': [1, 2]}))
+        with self.assertRaises(Exception):
+            writer.close()
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow not available')
+    def testDetectionWriterUnifiesTypes(self):
+        chunks = [
+            pd.DataFrame({'a': [None, None], 'b': [1, 2], 'c': ['x', 'y']}),
+            pd.DataFrame({'a': [3, 4], 'b': [1.5, np.nan], 'c': [None, 'z']}),
+            pd.DataFrame({'a': [None, 5], 'b': [3, 4], 'c': ['w', None]}),
+        ]
+        for ext in ('.feather', '.parquet'):
+            path = os.path.join(self.tmp_dir, 'detect_chunks' + ext)
+            writer = pdc.DetectionWriter(path)
+            for chunk in chunks:
+                writer.write(chunk)
+            writer.close()
+            df = (pd.read_feather(path) if ext == '.feather'
+                  else pd.read_parquet(path))
+            self.assertEqual(list(df['a'].fillna(-1)), [-1, -1, 3, 4, -1, 5])
+            self.assertEqual(list(df['b'].fillna(-1)),
+                             [1.0, 2.0, 1.5, -1, 3.0, 4.0])
+            self.assertEqual(list(df['c'].fillna('')),
+                             ['x', 'y', '', 'z', 'w', ''])
+
+        path = os.path.join(self.tmp_dir, 'detect_chunks.feather')
+        for values in (['x', 'y'], [1.5, 2]):
+            writer = pdc.DetectionWriter(path)
+            writer.write(pd.DataFrame({'a': [1, 2]}))
+            with self.assertRaises(Exception):
+                writer.write(pd.DataFrame({'a': values}))
+            writer.close()
+
+    @unittest.skipIf(pyarrow is not None, 'pyarrow is available')
+    def testDetectionWriterNeedsArrow(self):
+        path = os.path.join(self.tmp_dir, 'detect_chunks.feather')
+        self.assertFalse(pdc.can_write_in_chunks(path))
+        self.assertTrue(pdc.can_write_in_chunks('detect.csv'))
+        with self.assertRaises(Exception):
+            pdc.DetectionWriter(path)
+
     def testDetectDuplicates(self):
         iconstraints = FieldConstraints('i', [NoDuplicatesConstraint()])
         sconstraints = FieldConstraints('s', [NoDuplicatesConstraint()])
@@ -1380,6 +1795,55 @@ class TestPandasMultipleConstraintDetector(ReferenceTestCase):
         ddf2 = v2.detected()
         self.assertStringCorrect(ddf2.to_string(), 'detect_dups.df')
 
+    def testDetectionMatrix(self):
+        index = pd.RangeIndex(4, name='Index')
+        m = pdc.DetectionMatrix(index, capacity=1)
+        c = pd.Series([1, -2, np.nan, 4])
+        m['c_sign_ok'] = pdc.detection_codes(c, c > 0)
+        m.set_flags('c_nonnull_ok', pd.notnull(c))
+        m.set_all('d_type_ok', pdc.DETECTION_FAIL)
+        self.assertEqual(len(m), 3)
+        self.assertEqual(m.matrix.dtype, np.int8)
+        self.assertEqual(list(m.n_failures()), [1, 2, 2, 1])
+        df = m.to_frame(rows=np.array([False, True, True, False]))
+        self.assertEqual(list(df.index), [1, 2])
+        self.assertEqual(list(df), ['c_sign_ok', 'c_nonnull_ok', 'd_type_ok'])
+        self.assertEqual(df['c_sign_ok'].dtype, np.dtype('O'))
+        self.assertEqual(df['c_nonnull_ok'].dtype, np.dtype(bool))
+        self.assertFalse(df['c_sign_ok'][1])
+        self.assertTrue(pd.isnull(df['c_sign_ok'][2]))
+        self.assertEqual(list(m.to_frame(include_constraints=False)), [])
+
+    def testDetectionMatrixPreallocated(self):
+        df = pd.DataFrame({'a': list(range(-5, 5)),
+                           'b': list(range(10))})
+        cdict = {'fields': {'a': {'type': 'int', 'min': 0, 'max': 3},
+                            'b': {'type': 'int', 'max': 3}}}
+        verifier = pdc.PandasConstraintVerifier(df)
+        v = verifier.detect(pdc.load_constraints(cdict),
+                            VerificationClass=pdc.PandasDetection)
+        self.assertEqual(v.failures, 3)
+        # room for every constraint is allocated up front
+        self.assertEqual(verifier.detections.matrix.shape, (10, 5))
+        self.assertEqual(len(verifier.detections), 3)
+
+    def testConvertOutputTypes(self):
+        df = pd.DataFrame({'b': [True, False, True],
+                           'o': [True, np.nan, False],
+                           'm': [True, 'x', np.nan],
+                           's': ['one', 'two', 'three'],
+                           'n': [1, 2, 3]})
+        out = pdc.convert_output_types(df, boolean_ints=False)
+        self.assertEqual(list(out['b']), ['true', 'false', 'true'])
+        self.assertEqual(list(out['o'])[::2], ['true', 'false'])
+        self.assertTrue(pd.isnull(out['o'][1]))
+        self.assertEqual(list(out['m'])[:2], ['true', 'x'])
+        self.assertTrue(out['s'] is df['s'] or out['s'].equals(df['s']))
+        self.assertEqual(list(out['n']), [1, 2, 3])
+        ints = pdc.convert_output_types(df, boolean_ints=True)
+        self.assertEqual(list(ints['b']), ['1', '0', '1'])
+        self.assertEqual(list(df['b']), [True, False, True])
+
 
 class TestPandasMultipleConstraintGeneration(ReferenceTestCase):
     def testConstraintGenerationNoRex(self):
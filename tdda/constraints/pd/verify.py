@@ -26,6 +26,17 @@ Parameters:
 If no constraints file is provided, a file with the same path as the
 input file, with a .tdda extension will be tried.
 
+If --by is used, the constraints are verified separately for each group
+of records with the same values of the given column (or columns, if
+--by is repeated).
+
+If --cache DIR is used, the column statistics and constraint results are
+saved in DIR, and reused if the same input file is verified again without
+having changed (judged by its size and modification time, and also by
+a hash of its contents if --content-hash is used). Only constraints that
+have changed since then need to be checked, and if none have, the input
+file isn't even read.
+
 '''
 
 import os
@@ -49,11 +60,16 @@ except ImportError:
         feather = None
 
 from tdda import __version__
+from tdda.constraints.cache import VerificationCache, file_fingerprint
 from tdda.constraints.flags import verify_parser, verify_flags
-from tdda.constraints.pd.constraints import verify_df, load_df
+from tdda.constraints.pd.constraints import (verify_df, load_df,
+                                             load_constraints,
+                                             PandasConstraintVerifier,
+                                             PandasVerification)
 
 
-def verify_df_from_file(df_path, constraints_path, verbose=True, **kwargs):
+def verify_df_from_file(df_path, constraints_path, verbose=True,
+                        cache_dir=None, content_hash=False, **kwargs):
     if df_path == '-' or df_path is None:
         df_path = StringIO(sys.stdin.read())
     if constraints_path is None:
@@ -65,16 +81,61 @@ def verify_df_from_file(df_path, constraints_path, verbose=True, **kwargs):
             print('No constraints file specified.', file=sys.stderr)
             sys.exit(1)
 
-    df = load_df(df_path)
-    v = verify_df(df, constraints_path, **kwargs)
+    if (cache_dir and not isinstance(df_path, StringIO)
+            and not kwargs.get('groupby')):
+        v = verify_file_cached(df_path, constraints_path, cache_dir,
+                               content_hash=content_hash, **kwargs)
+    else:
+        df = load_df(df_path)
+        v = verify_df(df, constraints_path, **kwargs)
     if verbose:
         print(v)
     return v
 
 
+def verify_file_cached(df_path, constraints_path, cache_dir,
+                       content_hash=False, epsilon=None, type_checking=None,
+                       repair=True, report='all', **kwargs):
+    """
+    Verify a file against constraints, using (and updating) the cache of
+    results in *cache_dir*, so that the file is only read if some result
+    isn't already in the cache for the current version of the file.
+    """
+    constraints = load_constraints(constraints_path)
+    original_values = dict(((name, c.kind), c.value)
+                           for name in constraints.fields
+                           for c in constraints.fields[name])
+
+    def make_verifier():
+        pdv = PandasConstraintVerifier(load_df(df_path), epsilon=epsilon,
+                                       type_checking=type_checking)
+        if repair:
+            pdv.repair_field_types(constraints)
+        return pdv
+
+    identity, version = file_fingerprint(df_path, content_hash=content_hash)
+    cache = VerificationCache(cache_dir, identity, version)
+    settings = 'epsilon=%r type_checking=%r repair=%r' % (epsilon,
+                                                          type_checking,
+                                                          repair)
+    return cache.verify(constraints, make_verifier, settings=settings,
+                        original_values=original_values,
+                        VerificationClass=PandasVerification,
+                        report=report, **kwargs)
+
+
 def pd_verify_parser():
     parser = verify_parser(USAGE)
     parser.add_argument('input', nargs=1, help='CSV or feather file')
+    parser.add_argument('--by', action='append', metavar='COL',
+                        help='verify separately for each group of records '
+                             'with the same value of this column '
+                             '(can be repeated)')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='directory for caching verification results')
+    parser.add_argument('--content-hash', action='store_true',
+                        help='check file contents, as well as size and '
+                             'modification time, before using cached results')
     parser.add_argument('constraints', nargs='?',
                         help='constraints file to verify against')
     return parser
@@ -86,6 +147,11 @@ def pd_verify_params(args):
     flags = verify_flags(parser, args, params)
     params['df_path'] = flags.input[0] if flags.input else None
     params['constraints_path'] = flags.constraints
+    if flags.by:
+        params['groupby'] = flags.by
+    if flags.cache:
+        params['cache_dir'] = flags.cache
+        params['content_hash'] = flags.content_hash
     return params
 
 
@@ -19,7 +19,7 @@ import os
 import re
 import sys
 import tempfile
-from collections import namedtuple
+from collections import deque, namedtuple
 
 from tdda.referencetest.basecomparison import BaseComparison, Diffs, copycmd
 
@@ -29,6 +29,29 @@ BinaryInfo = namedtuple('BinaryInfo',
 
 
 class FilesComparison(BaseComparison):
+    def __init__(self, print_fn=None, verbose=True, tmp_dir=None,
+                 diff_context=3, max_diff_lines=None):
+        """
+        Constructor for an instance of the FilesComparison class.
+
+        The optional diff_context parameter is the number of unchanged
+        lines to show around each difference, when describing differences
+        as hunks.
+
+        The optional max_diff_lines parameter limits the size of the
+        'post-processed' temporary files that are created when files
+        differ; if None, they are written in full. Otherwise, only the
+        hunks where they differ (with diff_context lines around each) are
+        written, and also reported, up to about that many lines, so that
+        the cost of a failure depends on the size of the differences,
+        rather than of the files.
+
+        The other parameters are the same as for BaseComparison.
+        """
+        BaseComparison.__init__(self, print_fn=print_fn, verbose=verbose,
+                                tmp_dir=tmp_dir)
+        self.diff_context = diff_context
+        self.max_diff_lines = max_diff_lines
 
     def check_strings(self, actual, expected,
                       actual_path=None, expected_path=None,
@@ -188,15 +211,14 @@ class FilesComparison(BaseComparison):
         if (preprocess or actual_ignored or expected_ignored
                        or actual_removals or expected_removals
                        or (actual_path is None and ndiffs > 0)):
-            norm_actual = [normalize(s) for s in original_actual]
-            norm_expected = [normalize(s) for s in original_expected]
-            reconstruction = self.reconstruct(norm_actual,
-                                              norm_expected,
+            reconstruction = self.reconstruct(original_actual,
+                                              original_expected,
                                               actual_removals,
                                               expected_removals,
                                               actual_ignored,
                                               expected_ignored,
-                                              format=format)
+                                              format=format,
+                                              normalize=normalize)
             msgs.add_reconstruction(reconstruction)
 
         if permutable and ndiffs > 0 and ndiffs <= max_permutation_cases:
@@ -388,67 +410,97 @@ class FilesComparison(BaseComparison):
 
     def reconstruct(self, original_actual, original_expected,
                     actual_removals, expected_removals,
-                    actual_ignored, expected_ignored, format):
+                    actual_ignored, expected_ignored, format,
+                    normalize=None):
         """
         Reconstruct variants of the actual and expected to generate
         two outputs that are different where we found differences, but
         are the same where we did not find differences (taking into
         account all of the various 'ignore' and 'remove' parameters)
+
+        The reconstruction is lazy: nothing is built until it is used,
+        and it can then be used to describe just the hunks that differ,
+        without ever building complete copies of the two outputs.
+        """
+        normalize = normalize or (lambda s: s)
+
+        def steps():
+            return self.reconstruction_steps(original_actual,
+                                             original_expected,
+                                             actual_removals,
+                                             expected_removals,
+                                             actual_ignored,
+                                             expected_ignored,
+                                             format, normalize)
+
+        return Reconstruction(steps, context=self.diff_context)
+
+    def reconstruction_steps(self, original_actual, original_expected,
+                             actual_removals, expected_removals,
+                             actual_ignored, expected_ignored,
+                             format, normalize):
         """
-        rebuilt_actual = []
-        rebuilt_expected = []
+        Generator for the lines of a reconstruction, as tuples of
+        (iactual, iexpected, actual_line, expected_line, same), where
+        iactual and iexpected are the (zero-based) line numbers in the
+        originals, the lines are what appear in the reconstructed
+        outputs (or None, if nothing appears on one side), and same
+        is False for lines that are real differences.
+        """
+        nactual = len(original_actual)
+        nexpected = len(original_expected)
         iactual = iexpected = 0
-        while (iactual < len(original_actual)
-                   or iexpected < len(original_expected)):
+        while iactual < nactual or iexpected < nexpected:
+            actual = (normalize(original_actual[iactual])
+                      if iactual < nactual else None)
+            expected = (normalize(original_expected[iexpected])
+                        if iexpected < nexpected else None)
             if iactual in actual_removals and iexpected in expected_removals:
                 # lines which were removed from both sides
-                marker = self.diff_marker(original_actual[iactual],
-                                          original_expected[iexpected])
-                rebuilt_actual.append(self.format_marker(marker, format))
-                rebuilt_expected.append(self.format_marker(marker, format))
+                marker = self.format_marker(self.diff_marker(actual,
+                                                             expected),
+                                            format)
+                yield (iactual, iexpected, marker, marker, True)
                 iactual += 1
                 iexpected += 1
             elif iactual in actual_removals:
                 # line removed from just the left
-                marker = self.diff_marker(original_actual[iactual], '')
-                rebuilt_actual.append(self.format_marker(marker, format))
-                rebuilt_expected.append(self.format_marker(marker, format))
+                marker = self.format_marker(self.diff_marker(actual, ''),
+                                            format)
+                yield (iactual, None, marker, marker, True)
                 iactual += 1
             elif iexpected in expected_removals:
                 # line removed from just the right
-                marker = self.diff_marker('', original_expected[iexpected])
-                rebuilt_actual.append(self.format_marker(marker, format))
-                rebuilt_expected.append(self.format_marker(marker, format))
+                marker = self.format_marker(self.diff_marker('', expected),
+                                            format)
+                yield (None, iexpected, marker, marker, True)
                 iexpected += 1
-            elif iactual >= len(original_actual):
+            elif iactual >= nactual:
                 # fallen off the end of the left
-                rebuilt_expected.append(original_expected[iexpected])
+                yield (None, iexpected, None, expected, False)
                 iexpected += 1
-            elif iexpected >= len(original_expected):
+            elif iexpected >= nexpected:
                 # fallen off the end of the right
-                rebuilt_actual.append(original_actual[iactual])
+                yield (iactual, None, actual, None, False)
                 iactual += 1
-            elif (original_actual[iactual] == original_expected[iexpected]):
+            elif actual == expected:
                 # lines are the same, no differences
-                rebuilt_actual.append(original_actual[iactual])
-                rebuilt_expected.append(original_expected[iexpected])
+                yield (iactual, iexpected, actual, expected, True)
                 iactual += 1
                 iexpected += 1
             elif iactual in actual_ignored or iexpected in expected_ignored:
                 # lines are different, but differance has been ignored
-                marker = self.diff_marker(original_actual[iactual],
-                                          original_expected[iexpected])
-                rebuilt_actual.append(self.format_marker(marker, format))
-                rebuilt_expected.append(self.format_marker(marker, format))
+                marker = self.format_marker(self.diff_marker(actual,
+                                                             expected),
+                                            format)
+                yield (iactual, iexpected, marker, marker, True)
                 iactual += 1
                 iexpected += 1
             else:
                 # difference in line, not ignored, so it's a real difference!
-                rebuilt_actual.append(original_actual[iactual])
-                rebuilt_expected.append(original_expected[iexpected])
+                yield (iactual, iexpected, actual, expected, False)
                 iactual += 1
                 iexpected += 1
-        return Reconstruction(rebuilt_actual, rebuilt_expected)
 
     def diff_marker(self, left, right):
         """
@@ -776,6 +828,17 @@ class FilesComparison(BaseComparison):
         if differ:
             self.info(msgs, differ)
 
+        if reconstruction and self.max_diff_lines is not None:
+            # only keep the differences, with some context around them
+            (hunks, truncated) = reconstruction._hunks(self.diff_context,
+                                                       self.max_diff_lines)
+            self.info(msgs, reconstruction.format_hunks(hunks, truncated))
+            (actual_lines, expected_lines) = reconstruction.hunk_sides(
+                                                 hunks, truncated)
+        elif reconstruction:
+            actual_lines = reconstruction.iter_actual()
+            expected_lines = reconstruction.iter_expected()
+
         if reconstruction and create_temporaries:
             # show diffs after ignores and removals have been collapsed
             if differ:
@@ -783,12 +846,10 @@ class FilesComparison(BaseComparison):
             diffActual = os.path.join(self.tmp_dir, 'actual-' + commonname)
             diffExpected = os.path.join(self.tmp_dir, 'expected-' + commonname)
             guide = expected_path or actual_path
-            self.write_file(diffActual,
-                            (differ or '') + reconstruction.actual_lines(),
-                            guide=guide)
-            self.write_file(diffExpected,
-                             (differ or '') + reconstruction.expected_lines(),
-                            guide=guide)
+            self.write_file(diffActual, actual_lines,
+                            guide=guide, header=differ)
+            self.write_file(diffExpected, expected_lines,
+                            guide=guide, header=differ)
             self.info(msgs, self.compare_with(diffActual, diffExpected,
                                               qualifier='post-processed'))
 
@@ -815,22 +876,39 @@ class FilesComparison(BaseComparison):
             self.info(msgs, 'First difference at byte offset %d, %s.'
                       % (binaryinfo.byteoffset, lengthinfo))
 
-    def write_file(self, filename, contents, guide=None):
+    def write_file(self, filename, contents, guide=None, header=None):
         """
         Write contents out to a file, optionally taking guidance from an
         existing file as to whether to a newline at the end or not.
+
+        The contents can be a string, or a list (or other iterable) of
+        lines, which are written one at a time. The optional header is
+        written before the contents.
         """
-        if type(contents) in (list, tuple):
-            contents = '\n'.join(contents)
         with open(filename, 'w') as f:
-            f.write(contents)
-            if guide:
-                with open(guide) as fg:
-                    lastline = None
-                    for line in fg.read():
-                        lastline = line
-                    if lastline and lastline.endswith('\n'):
+            if header:
+                f.write(header)
+            if isinstance(contents, (str, type(u''))):
+                f.write(contents)
+            else:
+                for i, line in enumerate(contents):
+                    if i > 0:
                         f.write('\n')
+                    f.write(line)
+            if guide and ends_with_newline(guide):
+                f.write('\n')
+
+
+def ends_with_newline(path):
+    """
+    Does the file at the given path end with a newline?
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return False
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
 
 
 class Reconstruction(object):
@@ -840,15 +918,150 @@ class Reconstruction(object):
     ignored and removed items have been 'collapsed' so that the remaining
     differences are just the ones that the comparison considers to be
     actually 'different'.
+
+    Reconstructions are lazy; they are built from a function returning an
+    iterator over the steps of the reconstruction (as produced by
+    :py:meth:`FilesComparison.reconstruction_steps`), and the lines are
+    only generated when they are needed. Describing the differences with
+    :py:meth:`hunks` or :py:meth:`message` only keeps the lines that differ
+    (and a few lines of context around them), so it takes memory in
+    proportion to the size of the differences, not of the files.
     """
-    def __init__(self, diff_actual, diff_expected):
-        self.diff_actual = diff_actual
-        self.diff_expected = diff_expected
+    def __init__(self, steps, context=3):
+        self.steps = steps
+        self.context = context
+
+    @property
+    def diff_actual(self):
+        return list(self.iter_actual())
+
+    @property
+    def diff_expected(self):
+        return list(self.iter_expected())
+
+    def iter_actual(self):
+        return self._iter_side(2)
+
+    def iter_expected(self):
+        return self._iter_side(3)
+
+    def _iter_side(self, side):
+        for step in self.steps():
+            line = step[side]
+            if line is not None:
+                yield line
 
     def actual_lines(self):
-        return '\n'.join(self.diff_actual)
+        return '\n'.join(self.iter_actual())
 
     def expected_lines(self):
-        return '\n'.join(self.diff_expected)
+        return '\n'.join(self.iter_expected())
+
+    def hunks(self, context=None, max_lines=None):
+        """
+        Returns a list of the hunks where the reconstructed actual and
+        expected outputs differ. Each hunk is a list of steps (tuples of
+        (iactual, iexpected, actual_line, expected_line, same)), with up to
+        *context* steps where the outputs are the same on either side of
+        the differences.
+
+        If *max_lines* is specified, collecting stops once that many steps
+        have been collected (or up to *context* more, for the context
+        starting a hunk), even if that is part way through a hunk.
+        """
+        return self._hunks(context, max_lines)[0]
+
+    def _hunks(self, context, max_lines):
+        context = self.context if context is None else context
+        hunks = []
+        before = deque(maxlen=context)
+        hunk = None
+        after = 0
+        nlines = 0
+        for step in self.steps():
+            same = step[4]
+            full = max_lines is not None and nlines >= max_lines
+            if not same:
+                if full:
+                    return (hunks, True)
+                if hunk is None:
+                    hunk = list(before)
+                    hunks.append(hunk)
+                    nlines += len(hunk)
+                    before.clear()
+                hunk.append(step)
+                nlines += 1
+                after = context
+            elif hunk is not None and after > 0 and not full:
+                hunk.append(step)
+                nlines += 1
+                after -= 1
+            else:
+                hunk = None
+                before.append(step)
+        return (hunks, False)
+
+    def message(self, context=None, max_lines=None):
+        """
+        Returns a description of the differences between the reconstructed
+        actual and expected outputs, in a form similar to the output of
+        ``diff``, with lines from the actual marked with ``<`` and lines
+        from the expected marked with ``>``.
 
+        It is built from :py:meth:`hunks`, with the same parameters.
+        """
+        return self.format_hunks(*self._hunks(context, max_lines))
+
+    def format_hunks(self, hunks, truncated=False):
+        lines = []
+        for hunk in hunks:
+            lines.append(hunk_header(hunk))
+            pending_actual = []
+            pending_expected = []
+            for (iactual, iexpected, actual, expected, same) in hunk:
+                if same:
+                    lines.extend(pending_actual + pending_expected)
+                    pending_actual = []
+                    pending_expected = []
+                    lines.append('  ' + actual)
+                else:
+                    if actual is not None:
+                        pending_actual.append('< ' + actual)
+                    if expected is not None:
+                        pending_expected.append('> ' + expected)
+            lines.extend(pending_actual + pending_expected)
+        if truncated:
+            lines.append('...')
+        return '\n'.join(lines)
+
+    def hunk_sides(self, hunks, truncated=False):
+        """
+        Returns a pair of lists of the lines of the reconstructed actual
+        and expected outputs in the given hunks, each hunk starting with
+        a (common) line saying where it is.
+        """
+        actual_lines = []
+        expected_lines = []
+        for hunk in hunks:
+            header = '*** ' + hunk_header(hunk)
+            actual_lines.append(header)
+            expected_lines.append(header)
+            actual_lines.extend(step[2] for step in hunk
+                                if step[2] is not None)
+            expected_lines.extend(step[3] for step in hunk
+                                  if step[3] is not None)
+        if truncated:
+            actual_lines.append('*** ...')
+            expected_lines.append('*** ...')
+        return (actual_lines, expected_lines)
+
+
+def hunk_header(hunk):
+    first = [step for step in hunk if not step[4]][0]
+    return ('@@ actual line %s, expected line %s @@'
+            % (line_number(first[0]), line_number(first[1])))
+
+
+def line_number(i):
+    return 'end' if i is None else str(i + 1)
 
@@ -19,6 +19,12 @@ import os
 import sys
 
 from collections import OrderedDict
+from contextlib import closing
+
+try:
+    from itertools import zip_longest
+except ImportError:
+    from itertools import izip_longest as zip_longest
 
 from tdda.referencetest.basecomparison import BaseComparison, Diffs
 
@@ -50,6 +56,21 @@ class PandasComparison(BaseComparison):
             return PandasNotImplemented()
         return super(PandasComparison, cls).__new__(cls)
 
+    def __init__(self, print_fn=None, verbose=True, tmp_dir=None,
+                 reference_cache=None):
+        """
+        Constructor for an instance of the PandasComparison class.
+
+        The optional reference_cache parameter is a
+        :py:class:`~tdda.referencetest.referencecache.ReferenceCache`
+        to use for loading reference (expected) CSV files.
+
+        The other parameters are the same as for BaseComparison.
+        """
+        BaseComparison.__init__(self, print_fn=print_fn, verbose=verbose,
+                                tmp_dir=tmp_dir)
+        self.reference_cache = reference_cache
+
     def check_dataframe(self, df, ref_df, actual_path=None, expected_path=None,
                         check_data=None, check_types=None, check_order=None,
                         check_extra_cols=None, sortby=None,
@@ -255,7 +276,7 @@ class PandasComparison(BaseComparison):
     def check_csv_file(self, actual_path, expected_path, loader=None,
                        check_data=None, check_types=None, check_order=None,
                        condition=None, sortby=None, precision=6, msgs=None,
-                       **kwargs):
+                       chunksize=None, **kwargs):
         """
         Checks two CSV files are the same, by comparing them as dataframes.
 
@@ -268,6 +289,11 @@ class PandasComparison(BaseComparison):
                             a pandas dataframe. If None, then a default CSV
                             loader is used, which takes the same parameters
                             as the standard pandas pd.read_csv() function.
+            *chunksize*
+                            Optional number of rows; if specified, the
+                            files are compared in aligned chunks of this
+                            many rows, rather than being loaded in full
+                            (see :py:meth:`check_csv_file_chunked`).
             *\*\*kwargs*
                             Any additional named parameters are passed straight
                             through to the loader function.
@@ -277,7 +303,20 @@ class PandasComparison(BaseComparison):
         Returns a tuple (failures, msgs), containing the number of failures,
         and a Diffs object containing error messages.
         """
-        ref_df = self.load_csv(expected_path, loader=loader, **kwargs)
+        if chunksize:
+            if sortby:
+                raise Exception('Cannot sort when comparing CSV files '
+                                'in chunks')
+            return self.check_csv_file_chunked(actual_path, expected_path,
+                                               chunksize, loader=loader,
+                                               check_data=check_data,
+                                               check_types=check_types,
+                                               check_order=check_order,
+                                               condition=condition,
+                                               precision=precision,
+                                               msgs=msgs, **kwargs)
+        ref_df = self.load_reference_csv(expected_path, loader=loader,
+                                         **kwargs)
         df = self.load_csv(actual_path, loader=loader, **kwargs)
         return self.check_dataframe(df, ref_df,
                                     actual_path=actual_path,
@@ -289,6 +328,94 @@ class PandasComparison(BaseComparison):
                                     precision=precision,
                                     msgs=msgs)
 
+    def check_csv_file_chunked(self, actual_path, expected_path, chunksize,
+                               loader=None, check_data=None, check_types=None,
+                               check_order=None, condition=None, precision=6,
+                               msgs=None, **kwargs):
+        """
+        Checks two CSV files are the same, by reading them both in aligned
+        chunks of *chunksize* rows, and comparing each pair of chunks as
+        dataframes. This means that neither file ever needs to be held in
+        memory in its entirety.
+
+        The loader is called with the *chunksize* parameter, and must
+        return an iterable of dataframes (as pd.read_csv() does).
+
+        The comparison stops at the first pair of chunks that differ, so
+        the messages only describe the differences found in that chunk.
+        Sorting is not supported, since that would require the whole of
+        both files; the *condition* (if any) is applied to each chunk.
+
+        If the CSV reader fails part way through either file (which the
+        default loader can't recover from without losing track of where
+        its chunks start), the whole files are compared instead.
+
+        The other parameters are the same as those used by
+        :py:meth:`check_csv_file`.
+        Returns a tuple (failures, msgs), containing the number of failures,
+        and a Diffs object containing error messages.
+        """
+        if msgs is None:
+            msgs = Diffs()
+        try:
+            ref_chunks = self.load_csv(expected_path, loader=loader,
+                                       chunksize=chunksize, **kwargs)
+            try:
+                chunks = self.load_csv(actual_path, loader=loader,
+                                       chunksize=chunksize, **kwargs)
+                try:
+                    return self.check_chunks(chunks, ref_chunks,
+                                             actual_path=actual_path,
+                                             expected_path=expected_path,
+                                             check_data=check_data,
+                                             check_types=check_types,
+                                             check_order=check_order,
+                                             condition=condition,
+                                             precision=precision, msgs=msgs)
+                finally:
+                    close_chunks(chunks)
+            finally:
+                close_chunks(ref_chunks)
+        except pd.errors.ParserError:
+            pass
+        return self.check_csv_file(actual_path, expected_path, loader=loader,
+                                   check_data=check_data,
+                                   check_types=check_types,
+                                   check_order=check_order,
+                                   condition=condition, precision=precision,
+                                   msgs=msgs, **kwargs)
+
+    def check_chunks(self, chunks, ref_chunks, actual_path=None,
+                     expected_path=None, check_data=None, check_types=None,
+                     check_order=None, condition=None, precision=6,
+                     msgs=None):
+        """
+        Compares two iterables of aligned dataframe chunks, stopping at
+        the first pair that differ.
+        """
+        df = ref_df = None
+        nrows = 0
+        for (chunk, ref_chunk) in zip_longest(chunks, ref_chunks):
+            # if one file runs out before the other, compare what's left
+            # of the longer one against an empty chunk.
+            df = empty_chunk(df) if chunk is None else chunk
+            ref_df = empty_chunk(ref_df) if ref_chunk is None else ref_chunk
+            (failures, msgs) = self.check_dataframe(df, ref_df,
+                                                    actual_path=actual_path,
+                                                    expected_path=expected_path,
+                                                    check_data=check_data,
+                                                    check_types=check_types,
+                                                    check_order=check_order,
+                                                    condition=condition,
+                                                    precision=precision,
+                                                    msgs=msgs)
+            if failures:
+                self.info(msgs, 'Differences found in chunk starting at '
+                                'record %d' % (nrows + 1))
+                return (failures, msgs)
+            nrows += len(ref_df)
+        return (0, msgs)
+
     def check_csv_files(self, actual_paths, expected_paths,
                         check_data=None, check_types=None, check_order=None,
                         condition=None, sortby=None, msgs=None, **kwargs):
@@ -382,6 +509,18 @@ class PandasComparison(BaseComparison):
             loader = default_csv_loader
         return loader(csvfile, **kwargs)
 
+    def load_reference_csv(self, csvfile, loader=None, **kwargs):
+        """
+        Function for constructing a pandas dataframe from a reference CSV
+        file, using the reference cache (if there is one), so that the
+        same reference file isn't parsed over and over again.
+        """
+        if loader is None:
+            loader = default_csv_loader
+        if self.reference_cache is None:
+            return loader(csvfile, **kwargs)
+        return self.reference_cache.load(csvfile, loader, **kwargs)
+
     def write_csv(self, df, csvfile, writer=None, **kwargs):
         """
         Function for saving a Pandas DataFrame to a CSV file.
@@ -406,6 +545,10 @@ def default_csv_loader(csvfile, **kwargs):
         - escapechar            is ``\\`` (backslash)
         - na_values             are the empty string, ``"NaN"``, and ``"NULL"``
         - keep_default_na       is ``False``
+
+    If a *chunksize* is specified, then (as with pd.read_csv()), the
+    result is an iterator over dataframes of (at most) that many rows,
+    rather than a single dataframe.
     """
     options = {
         'index_col': None,
@@ -418,6 +561,9 @@ def default_csv_loader(csvfile, **kwargs):
     }
     options.update(kwargs)
 
+    if options.get('chunksize'):
+        return csv_chunk_loader(csvfile, options)
+
     try:
         df = pd.read_csv(csvfile, **options)
     except pd.errors.ParserError:
@@ -426,24 +572,69 @@ def default_csv_loader(csvfile, **kwargs):
         del options['escapechar']
         df = pd.read_csv(csvfile, **options)
 
-    # the reader won't have inferred any datetime columns (even though we
-    # told it to), because we didn't explicitly tell it the column names
-    # in advance. so.... we'll do it by hand (looking at string columns, and
-    # seeing if we can convert them safely to datetimes).
-    if options.get('infer_datetime_format'):
-        colnames = df.columns.tolist()
-        for c in colnames:
-            if df[c].dtype == np.dtype('O'):
-                try:
-                    datecol = pd.to_datetime(df[c])
-                    if datecol.dtype == np.dtype('datetime64[ns]'):
-                        df[c] = datecol
-                except Exception as e:
-                    pass
-        ndf = pd.DataFrame()
-        for c in colnames:
-            ndf[c] = df[c]
+    return infer_datetime_columns(df, options)
+
+
+def csv_chunk_loader(csvfile, options):
+    """
+    Generator for reading a csv file in chunks, with the same options
+    and datetime inference as :py:func:`default_csv_loader`.
+
+    The pandas reader only detects parser errors as it reaches them.
+    If it gets confused by stutter-quoted text in the first chunk, the
+    file is read again with no escapechar; if that happens after some
+    chunks have already been produced, the error is raised (since the
+    chunks from a second reading might not line up with them), and
+    :py:meth:`PandasComparison.check_csv_file_chunked` then compares
+    the whole files instead.
+    """
+    nchunks = 0
+    try:
+        with closing(pd.read_csv(csvfile, **options)) as reader:
+            for df in reader:
+                nchunks += 1
+                yield infer_datetime_columns(df, options)
+    except pd.errors.ParserError:
+        if nchunks > 0:
+            raise
+        options = dict(options)
+        del options['escapechar']
+        with closing(pd.read_csv(csvfile, **options)) as reader:
+            for df in reader:
+                yield infer_datetime_columns(df, options)
 
+
+def close_chunks(chunks):
+    """
+    Close an iterable of chunks (such as a generator, or a pandas
+    reader), if it can be closed, releasing any file it has open.
+    """
+    close = getattr(chunks, 'close', None)
+    if close is not None:
+        close()
+
+
+def infer_datetime_columns(df, options):
+    """
+    The reader won't have inferred any datetime columns (even though we
+    told it to), because we didn't explicitly tell it the column names
+    in advance. So.... we'll do it by hand (looking at string columns, and
+    seeing if we can convert them safely to datetimes).
+    """
+    if not options.get('infer_datetime_format'):
+        return df
+    colnames = df.columns.tolist()
+    for c in colnames:
+        if df[c].dtype == np.dtype('O'):
+            try:
+                datecol = pd.to_datetime(df[c])
+                if datecol.dtype == np.dtype('datetime64[ns]'):
+                    df[c] = datecol
+            except Exception as e:
+                pass
+    ndf = pd.DataFrame()
+    for c in colnames:
+        ndf[c] = df[c]
     return ndf
 
 
@@ -469,6 +660,15 @@ def default_csv_writer(df, csvfile, **kwargs):
     return df.to_csv(csvfile, **options)
 
 
+def empty_chunk(df):
+    """
+    Returns an empty dataframe with the same columns as the one given,
+    for use when one of a pair of files being compared in chunks has
+    no more records.
+    """
+    return pd.DataFrame() if df is None else df.iloc[0:0]
+
+
 def find_bytes_cols(df):
     bytes_cols = []
     for c in list(df):
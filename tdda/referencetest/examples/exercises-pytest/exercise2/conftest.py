@@ -11,6 +11,9 @@ Copyright (c) Stochastic Solutions Limited 2016-2019
 
 from tdda.referencetest.pytestconfig import (pytest_addoption,
                                              pytest_collection_modifyitems,
+                                             pytest_sessionfinish,
+                                             pytest_testnodedown,
+                                             pytest_terminal_summary,
                                              set_default_data_location,
                                              ref)
 
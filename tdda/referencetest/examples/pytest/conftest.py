@@ -15,6 +15,9 @@ from __future__ import unicode_literals
 
 from tdda.referencetest.pytestconfig import (pytest_addoption,
                                              pytest_collection_modifyitems,
+                                             pytest_sessionfinish,
+                                             pytest_testnodedown,
+                                             pytest_terminal_summary,
                                              set_default_data_location,
                                              ref)
 
@@ -18,7 +18,8 @@ from tdda.referencetest import referencepytest
 def pytest_addoption(parser):
     """
     Extend pytest to include the --write, --write-all regeneration
-    command-line options, and the --tagged and --istagged tagging options.
+    command-line options, the --refcache caching option, and the --tagged
+    and --istagged tagging options.
     """
     referencepytest.addoption(parser)
 
@@ -31,6 +32,31 @@ def pytest_collection_modifyitems(session, config, items):
     referencepytest.tagged(config, items)
 
 
+def pytest_sessionfinish(session, exitstatus):
+    """
+    Extend pytest to pass details of regenerated reference files from
+    pytest-xdist workers back to the controlling process.
+    """
+    referencepytest.sessionfinish(session)
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    """
+    Extend pytest-xdist to collect details of regenerated reference files
+    from each worker, when it finishes.
+    """
+    referencepytest.testnodedown(node, error)
+
+
+def pytest_terminal_summary(terminalreporter):
+    """
+    Extend pytest to report a summary of regenerated reference files,
+    if run with --write or --write-all.
+    """
+    referencepytest.terminal_summary(terminalreporter)
+
+
 @pytest.fixture(scope='module')
 def ref(request):
     """
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""
+referencecache.py: cache of parsed reference datasets
+
+Source repository: http://github.com/tdda/tdda
+
+License: MIT
+
+Copyright (c) Stochastic Solutions Limited 2016-2018
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import hashlib
+import os
+import tempfile
+
+from collections import OrderedDict
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+
+# Default bound on the (approximate) total in-memory size of the
+# dataframes held in a ReferenceCache.
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class ReferenceCache(object):
+    """
+    Cache of reference dataframes, parsed from reference CSV files.
+
+    Loading a reference CSV file with the default loader is expensive
+    (not least because of its datetime inference), and the same reference
+    file is often used by many tests. The cache holds each parsed
+    dataframe in memory, keyed by the file's path, modification time and
+    size, and the loader (and loader parameters) that were used to parse
+    it, so a file is only parsed again if it has changed.
+
+    Entries are discarded, least-recently-used first, when the total size
+    of the cached dataframes would exceed *max_bytes*.
+
+    If a *cache_dir* is specified, parsed dataframes are also written there
+    as pickle files, so that they can be reused by later sessions (or by
+    other processes). Since the modification time and size of the
+    reference file are part of the key, stale files in that directory are
+    never used; they can be removed with :py:meth:`clear`.
+    """
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def load(self, path, loader, **kwargs):
+        """
+        Return a dataframe for the reference CSV file at *path*, parsed with
+        *loader* (called with the path and *kwargs*), using a cached copy
+        if there is one for the current version of the file.
+
+        The dataframe returned is a copy, so callers can safely modify it.
+        """
+        key = self.key(path, loader, kwargs)
+        if key in self.frames:
+            self.hits += 1
+            df, nbytes = self.frames.pop(key)
+            self.frames[key] = (df, nbytes)
+            return df.copy()
+        self.misses += 1
+        df = self.load_from_disk(key, loader)
+        if df is None:
+            df = loader(path, **kwargs)
+            self.save_to_disk(key, loader, df)
+        self.add(key, df)
+        return df.copy()
+
+    def add(self, key, df):
+        """
+        Add a dataframe to the in-memory cache, evicting least-recently-used
+        entries as necessary to keep within the size bound.
+        """
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        while self.frames and self.nbytes + nbytes > self.max_bytes:
+            (_, (_, evicted)) = self.frames.popitem(last=False)
+            self.nbytes -= evicted
+        self.frames[key] = (df, nbytes)
+        self.nbytes += nbytes
+
+    def key(self, path, loader, kwargs):
+        """
+        Key identifying a particular version of a reference file,
+        parsed in a particular way.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        return (path, st.st_mtime_ns if hasattr(st, 'st_mtime_ns')
+                      else st.st_mtime,
+                st.st_size, loader, repr(sorted(kwargs.items())))
+
+    def disk_path(self, key, loader):
+        """
+        Path for the pickle file for a cache entry, or None if it should
+        not be written to disk.
+
+        The loader is identified on disk by its name, so loaders that
+        do not have a stable, unique name (such as lambdas and local
+        functions) are only cached in memory.
+        """
+        if not self.cache_dir:
+            return None
+        loadername = loader_name(loader)
+        if loadername is None:
+            return None
+        (path, mtime, size, _, options) = key
+        ident = '\n'.join([path, str(mtime), str(size), loadername, options])
+        digest = hashlib.sha1(ident.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.pkl')
+
+    def load_from_disk(self, key, loader):
+        picklepath = self.disk_path(key, loader)
+        if picklepath and os.path.exists(picklepath):
+            try:
+                return pd.read_pickle(picklepath)
+            except Exception:
+                pass
+        return None
+
+    def save_to_disk(self, key, loader, df):
+        picklepath = self.disk_path(key, loader)
+        if picklepath:
+            # write to a temporary file and rename, so that other processes
+            # never see a partially-written pickle.
+            (fd, tmppath) = tempfile.mkstemp(dir=self.cache_dir,
+                                             suffix='.tmp')
+            os.close(fd)
+            try:
+                df.to_pickle(tmppath)
+                os.replace(tmppath, picklepath)
+            except Exception:
+                if os.path.exists(tmppath):
+                    os.remove(tmppath)
+
+    def clear(self):
+        """
+        Discard all cached dataframes, including any pickle files in the
+        cache directory.
+        """
+        self.frames = OrderedDict()
+        self.nbytes = 0
+        if self.cache_dir and os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.pkl'):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+
+def loader_name(loader):
+    """
+    Fully-qualified name for a loader function, or None if it doesn't have
+    a name that identifies it uniquely.
+    """
+    name = getattr(loader, '__qualname__', getattr(loader, '__name__', None))
+    if name is None or '<' in name:
+        return None
+    return '%s.%s' % (loader.__module__, name)
@@ -36,6 +36,9 @@ with a ``conftest.py`` containing::
 
     from tdda.referencetest.pytestconfig import (pytest_addoption,
                                                  pytest_collection_modifyitems,
+                                                 pytest_sessionfinish,
+                                                 pytest_testnodedown,
+                                                 pytest_terminal_summary,
                                                  set_default_data_location,
                                                  ref)
 
@@ -49,7 +52,7 @@ Of course, for brevity, if you prefer, you can use
 
         from tdda.referencetest.pytestconfig import *
 
-rather than importing the four individual items if you are not
+rather than importing the seven individual items if you are not
 customising anything yourself, but that is less flexible.
 
 This example also sets a default data location which will apply to
@@ -135,6 +138,10 @@ If the ``-s`` option is also provided (to disable ``pytest``
 output capturing), it will report the names of all the files it has
 regenerated.
 
+Reference files are only rewritten if their contents have actually
+changed, and a summary of how many were written, unchanged and new is
+reported at the end of the run.
+
 To regenerate all reference results (or generate them for the first time)
 
 .. code-block:: bash
@@ -154,6 +161,32 @@ and graph results)
 
     pytest -s --write table graph
 
+Parallel Test Runs
+~~~~~~~~~~~~~~~~~~
+
+Reference tests can be run in parallel using the ``pytest-xdist``
+plugin (``pytest -n 8``). Each worker process has its own
+:py:class:`~tdda.referencetest.referencetest.ReferenceTest`
+configuration, set up from the same command-line options, and:
+
+  - reference files are regenerated while holding an inter-process
+    lock on each file, so workers never write the same file at once;
+
+  - the regeneration summary at the end of the run includes the
+    reference files regenerated by all of the workers.
+
+The ``--refcache`` option enables the cache of parsed reference
+CSV files (see
+:py:meth:`~tdda.referencetest.referencetest.ReferenceTest.set_reference_cache`),
+storing parsed files on disk so that they are shared by all of the
+workers (and by later runs). A directory for the cache can be given
+after the option; by default, it is kept in ``pytest``'s own cache
+directory.
+
+.. code-block:: bash
+
+    pytest -n 8 --refcache
+
 ``pytest`` Integration Details
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -175,7 +208,9 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import division
 
+import os
 import sys
+import tempfile
 
 import pytest
 
@@ -207,9 +242,27 @@ def ref(request):
             for r in regen:
                 for kind in r.split(','):
                     ReferenceTest.set_regeneration(kind)
+    cache_dir = request.config.getoption('--refcache')
+    if cache_dir is not None:
+        cache_dir = cache_dir or default_cache_dir(request.config)
+        cache = ReferenceTest.reference_cache
+        if cache is None or cache.cache_dir != cache_dir:
+            ReferenceTest.set_reference_cache(cache_dir=cache_dir)
     return ReferenceTest(pytest_assert)
 
 
+def default_cache_dir(config):
+    """
+    Default directory for the on-disk cache of parsed reference files,
+    shared by all pytest-xdist workers. It is kept in pytest's own cache
+    directory, if that is available.
+    """
+    cache = getattr(config, 'cache', None)
+    if cache is not None:
+        return str(cache.mkdir('tdda_refcache'))
+    return os.path.join(tempfile.gettempdir(), 'tdda_refcache')
+
+
 def set_defaults(**kwargs):
     """
     This provides a mechanism for setting default attributes in
@@ -227,6 +280,20 @@ def set_defaults(**kwargs):
     ReferenceTest.set_defaults(**kwargs)
 
 
+def set_reference_cache(enabled=True, **kwargs):
+    """
+    This provides a mechanism for enabling caching of parsed reference
+    CSV files in the :py:class:`~tdda.referencetest.referencetest.ReferenceTest`
+    class, so that each is parsed only once per session, however many
+    tests use it.
+
+    It takes the same parameters as
+    :py:meth:`tdda.referencetest.referencetest.ReferenceTest.set_reference_cache`,
+    and should be called from your ``conftest.py`` file.
+    """
+    ReferenceTest.set_reference_cache(enabled=enabled, **kwargs)
+
+
 def set_default_data_location(location, kind=None):
     """
     This provides a mechanism for setting the default reference data
@@ -263,6 +330,10 @@ def addoption(parser):
         parser.addoption('--wquiet', action='store_true',
                          help='--wquiet: when rewriting results, '
                               'do so quietly')
+        parser.addoption('--refcache', action='store', nargs='?',
+                         const='', default=None,
+                         help='--refcache: cache parsed reference files, '
+                              'optionally in the directory given')
         parser.addoption('--tagged', action='store_true',
                          help='--tagged: only run tagged tests')
         parser.addoption('--istagged', action='store_true',
@@ -273,6 +344,59 @@ def addoption(parser):
         pass
 
 
+def terminal_summary(terminalreporter):
+    """
+    Support for reporting a summary of regenerated reference files.
+
+    A test's ``conftest.py`` file should define a
+    ``pytest_terminal_summary`` function which should just call this.
+
+    When reference results are being regenerated, it reports how many
+    reference files were rewritten, how many were unchanged (and so
+    were left alone), and how many were new.
+    """
+    summary = ReferenceTest.regeneration_summary()
+    if summary and ReferenceTest.verbose:
+        terminalreporter.write_line(summary)
+
+
+def sessionfinish(session):
+    """
+    Support for passing information about regenerated reference files
+    from pytest-xdist worker processes back to the controlling process.
+
+    A test's ``conftest.py`` file should define a ``pytest_sessionfinish``
+    function which should just call this.
+    """
+    workeroutput = getattr(session.config, 'workeroutput', None)
+    if workeroutput is not None:
+        workeroutput['tdda_regenerated'] = dict(ReferenceTest.regenerated)
+
+
+def testnodedown(node, error):
+    """
+    Support for collecting information about regenerated reference files
+    from a pytest-xdist worker process, when it finishes, so that they
+    can be included in the summary reported by :py:func:`terminal_summary`.
+
+    A test's ``conftest.py`` file should define a ``pytest_testnodedown``
+    function (marked as an optional hook, since it is only available when
+    pytest-xdist is installed) which should just call this.
+    """
+    workeroutput = getattr(node, 'workeroutput', None) or {}
+    regenerated = workeroutput.get('tdda_regenerated', {})
+    for path, status in regenerated.items():
+        # if different workers regenerated the same file, report the most
+        # significant thing that happened to it.
+        previous = ReferenceTest.regenerated.get(path)
+        if (previous is None or REGENERATION_PRECEDENCE.index(status)
+                                > REGENERATION_PRECEDENCE.index(previous)):
+            ReferenceTest.regenerated[path] = status
+
+
+REGENERATION_PRECEDENCE = ('unchanged', 'written', 'new')
+
+
 def tagged(config, items):
     """
     Support for @tag to mark tests to be run with --tagged or reported
@@ -7,12 +7,27 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import division
 
+import hashlib
 import os
+import shutil
 import sys
 import tempfile
 
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
 from tdda.referencetest.checkpandas import PandasComparison
 from tdda.referencetest.checkfiles import FilesComparison
+from tdda.referencetest.referencecache import (ReferenceCache,
+                                               DEFAULT_CACHE_MAX_BYTES)
 
 
 # DEFAULT_FAIL_DIR is the default location for writing failing output
@@ -64,6 +79,10 @@ class ReferenceTest(object):
     # Temporary directory
     tmp_dir = DEFAULT_FAIL_DIR
 
+    # Maximum number of lines of differences to report and write to
+    # post-processed temporary files (None to write them in full)
+    max_diff_lines = None
+
     # Dictionary describing which kinds of reference files should be
     # regenerated when the tests are run. This should be set using the
     # set_regeneration() class-method. Can be initialized via the -w option.
@@ -73,6 +92,14 @@ class ReferenceTest(object):
     # each kind. Can be initialized by set_default_data_location().
     default_data_locations = {}
 
+    # Dictionary recording what happened to each reference file that has
+    # been regenerated: 'written' (changed), 'unchanged' or 'new'.
+    regenerated = {}
+
+    # Cache of parsed reference datasets, shared by all instances.
+    # Can be initialized by set_reference_cache().
+    reference_cache = None
+
     @classmethod
     def set_defaults(cls, **kwargs):
         """Set default parameters, at the class level. These defaults will
@@ -112,6 +139,15 @@ class ReferenceTest(object):
                 it defaults to */tmp*, *c:\\temp* or whatever
                 :py:func:`tempfile.gettempdir()` returns, as
                 appropriate.
+
+            *max_diff_lines*:
+                If set, when a text check fails, only the parts of the
+                output that differ (with a few lines of context) are
+                reported and written to the 'post-processed' temporary
+                files, up to about this many lines, rather than the
+                whole output. This is useful when comparing very large
+                outputs. By default, the temporary files are written
+                in full.
         """
         for k in kwargs:
             if k == 'verbose':
@@ -120,6 +156,8 @@ class ReferenceTest(object):
                 cls.print_fn = kwargs[k]
             elif k == 'tmp_dir':
                 cls.tmp_dir = kwargs[k]
+            elif k == 'max_diff_lines':
+                cls.max_diff_lines = kwargs[k]
             else:
                 raise Exception('set_defaults: Unrecogized option %s' % k)
 
@@ -136,6 +174,55 @@ class ReferenceTest(object):
         """
         cls.regenerate[kind] = regenerate
 
+    @classmethod
+    def regeneration_summary(cls):
+        """
+        Return a one-line summary of the reference files that have been
+        regenerated so far, or ``None`` if there haven't been any.
+
+        Only files whose content actually changed are rewritten, so the
+        summary distinguishes between files that have been written,
+        files that were unchanged, and new files.
+        """
+        if not cls.regenerated:
+            return None
+        statuses = list(cls.regenerated.values())
+        return ('Reference files: %d written, %d unchanged, %d new'
+                % (statuses.count('written'), statuses.count('unchanged'),
+                   statuses.count('new')))
+
+    @classmethod
+    def set_reference_cache(cls, enabled=True, cache_dir=None,
+                            max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        """
+        Enable (or disable) caching of parsed reference CSV files, for all
+        instances of the class.
+
+        With caching enabled, each reference CSV file used by
+        :py:meth:`assertDataFrameCorrect()`, :py:meth:`assertCSVFileCorrect()`
+        and :py:meth:`assertCSVFilesCorrect()` is only parsed once per
+        session, for as long as it is unchanged (and has been loaded with
+        the same loader and parameters).
+
+            *cache_dir*:
+                Optional directory where parsed reference datasets are
+                also saved, as pickle files, so that they can be reused
+                across sessions.
+
+            *max_bytes*:
+                Bound on the total in-memory size of the cached
+                datasets. The least recently used datasets are discarded
+                first.
+
+        Caching is disabled by default. The cache is used by instances
+        of the class created after this has been called.
+        """
+        if enabled:
+            cls.reference_cache = ReferenceCache(cache_dir=cache_dir,
+                                                 max_bytes=max_bytes)
+        else:
+            cls.reference_cache = None
+
     @classmethod
     def set_default_data_location(cls, location, kind=None):
         """
@@ -201,10 +288,12 @@ class ReferenceTest(object):
         self.assert_fn = assert_fn
         self.reference_data_locations = self._cls_dataloc(self.__class__)
         self.pandas = PandasComparison(print_fn=self.call_print_fn,
-                                       verbose=self.verbose)
+                                       verbose=self.verbose,
+                                       reference_cache=self.reference_cache)
         self.files = FilesComparison(print_fn=self.call_print_fn,
                                      verbose=self.verbose,
-                                     tmp_dir=self.tmp_dir)
+                                     tmp_dir=self.tmp_dir,
+                                     max_diff_lines=self.max_diff_lines)
 
     def all_fields_except(self, exclusions):
         """
@@ -383,9 +472,12 @@ class ReferenceTest(object):
         """
         expected_path = self._resolve_reference_path(ref_csv, kind=kind)
         if self._should_regenerate(kind):
-            self._write_reference_dataset(df, expected_path)
+            self._write_reference_dataset(df, expected_path,
+                                          csv_read_fn=csv_read_fn,
+                                          precision=precision)
         else:
-            ref_df = self.pandas.load_csv(expected_path, loader=csv_read_fn)
+            ref_df = self.pandas.load_reference_csv(expected_path,
+                                                    loader=csv_read_fn)
             self.assertDataFramesEqual(df, ref_df,
                                        actual_path=actual_path,
                                        expected_path=expected_path,
@@ -431,6 +523,16 @@ class ReferenceTest(object):
                     - ``na_values`` are the empty string, ``"NaN"``, and ``"NULL"``
                     - ``keep_default_na`` is ``False``
 
+            *chunksize*:
+                (Optional) number of rows. If specified, the actual
+                and reference CSV files are read and compared in
+                aligned chunks of this many rows, rather than being
+                loaded in full, stopping at the first chunk that
+                differs. The *csv_read_fn* (if any) must then accept
+                a ``chunksize`` parameter and return an iterable of
+                DataFrames, as :py:func:`pd.read_csv()` does. Sorting
+                is not available in this mode.
+
             *\*\*kwargs*:
                 Any additional named parameters are passed
                 straight through to the *csv_read_fn* function.
@@ -492,6 +594,11 @@ class ReferenceTest(object):
                     - ``na_values`` are the empty string, ``"NaN"``, and ``"NULL"``
                     - ``keep_default_na`` is ``False``
 
+            *chunksize*:
+                (Optional) number of rows, to compare each pair of
+                files in chunks, as described in
+                :py:meth:`assertCSVFileCorrect()`.
+
             *\*\*kwargs*:
                 Any additional named parameters are passed straight
                 through to the *csv_read_fn* function.
@@ -692,7 +799,7 @@ class ReferenceTest(object):
         expected_paths = self._resolve_reference_paths(ref_paths, kind=kind)
         if self._should_regenerate(kind):
             self._write_reference_files(actual_paths, expected_paths,
-                                        lstrip=strip, rstrip=rstrip)
+                                        lstrip=lstrip, rstrip=rstrip)
         else:
             mpc = max_permutation_cases
             rl = remove_lines or ignore_lines
@@ -787,25 +894,81 @@ class ReferenceTest(object):
             self._write_reference_file(actual_path, expected_path,
                                        lstrip=lstrip, rstrip=rstrip)
 
-    def _write_reference_dataset(self, df, reference_path):
+    def _write_reference_dataset(self, df, reference_path, csv_read_fn=None,
+                                 precision=None):
         """
-        Internal method for regenerating reference data for a Pandas dataset
+        Internal method for regenerating reference data for a Pandas dataset.
+
+        If the existing reference file already contains the same data
+        (to the given precision), it is not rewritten, to avoid spurious
+        changes from re-serializing it.
+        """
+        with reference_lock(reference_path):
+            exists = os.path.exists(reference_path)
+            if exists and self._same_dataset(df, reference_path, csv_read_fn,
+                                             precision):
+                self._record_regeneration(reference_path, 'unchanged')
+                return
+            atomic_write(reference_path,
+                         lambda path: self.pandas.write_csv(df, path))
+            self._record_regeneration(reference_path,
+                                      'written' if exists else 'new')
+
+    def _same_dataset(self, df, reference_path, csv_read_fn=None,
+                      precision=None):
+        """
+        Internal method to determine whether an existing reference file
+        contains the same dataset as the one given.
         """
-        self.pandas.write_csv(df, reference_path)
+        try:
+            ref_df = self.pandas.load_reference_csv(reference_path,
+                                                    loader=csv_read_fn)
+        except Exception:
+            return False
+        quiet = PandasComparison(verbose=False)
+        (failures, msgs) = quiet.check_dataframe(df, ref_df,
+                                                 precision=precision)
+        return failures == 0
 
     def _write_reference_result(self, result, reference_path, binary=False,
                                 lstrip=False, rstrip=False):
         """
         Internal method for regenerating reference data from in-memory
         results.
+
+        The reference file is only rewritten if its content has changed.
+        It is written to a temporary file first, and then renamed, so that
+        it is never seen partially written, and the whole check-and-write
+        is done while holding a lock on the reference file, so that it is
+        safe when tests are running in several processes at once.
         """
-        mode = 'wb' if binary else 'w'
         if not binary:
             result = self._normalize_whitespace(result, lstrip, rstrip)
-        with open(reference_path, mode) as fout:
-            fout.write(result)
+        mode = 'wb' if binary else 'w'
+
+        def write(path):
+            with open(path, mode) as fout:
+                fout.write(result)
+
+        with reference_lock(reference_path):
+            exists = os.path.exists(reference_path)
+            if exists and (file_digest(reference_path, binary=binary)
+                           == content_digest(result)):
+                self._record_regeneration(reference_path, 'unchanged')
+                return
+            atomic_write(reference_path, write)
+            self._record_regeneration(reference_path,
+                                      'written' if exists else 'new')
+
+    def _record_regeneration(self, reference_path, status):
+        """
+        Internal method for recording (and reporting) what happened when
+        a reference file was regenerated.
+        """
+        self.regenerated[reference_path] = status
         if self.verbose and self.print_fn:
-            self.print_fn('Written %s' % reference_path)
+            self.print_fn('%s %s' % (REGENERATION_VERBS[status],
+                                     reference_path))
 
     def _normalize_whitespace(self, result, lstrip=False, rstrip=False):
         if lstrip and rstrip:
@@ -840,6 +1003,131 @@ class ReferenceTest(object):
     print_fn = _default_print_fn
 
 
+REGENERATION_VERBS = {
+    'written': 'Written',
+    'unchanged': 'Unchanged',
+    'new': 'Created',
+}
+
+
+def file_digest(path, binary=False, blocksize=1024 * 1024):
+    """
+    Compute a digest of the contents of a file, reading it in blocks.
+    Text files are digested as UTF-8, as in :py:func:`content_digest`.
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb' if binary else 'r') as f:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            h.update(block if binary else block.encode('utf-8'))
+    return h.hexdigest()
+
+
+def content_digest(content):
+    """
+    Compute a digest of an in-memory string (or bytes), matching
+    :py:func:`file_digest` for a file with the same contents.
+    """
+    if not isinstance(content, bytes):
+        content = content.encode('utf-8')
+    return hashlib.sha1(content).hexdigest()
+
+
+def atomic_write(path, write_fn):
+    """
+    Write a file by calling *write_fn* with the path of a temporary file
+    in the same directory, and then renaming it into place.
+    """
+    (dirname, basename) = os.path.split(os.path.abspath(path))
+    (fd, tmppath) = tempfile.mkstemp(dir=dirname, prefix='.' + basename,
+                                     suffix='.tmp')
+    os.close(fd)
+    try:
+        write_fn(tmppath)
+        # temporary files are only readable by their owner, so give it the
+        # permissions that the file would have had if written directly.
+        if os.path.exists(path):
+            shutil.copymode(path, tmppath)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmppath, 0o666 & ~umask)
+        os.replace(tmppath, path)
+    except:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+
+
+@contextmanager
+def reference_lock(path):
+    """
+    Context manager holding an exclusive lock on a reference file, shared
+    between processes (such as pytest-xdist workers).
+
+    The lock is taken on a separate lock file, in a tdda-locks directory
+    in the temporary directory, named from the reference file's absolute
+    path, so that nothing extra is written alongside the reference files
+    themselves. With fcntl locking, the lock file is removed again when
+    the lock is released (any process still waiting on it then starts
+    again with a new one). On platforms supporting neither fcntl nor
+    msvcrt locking, no lock is taken.
+    """
+    lockpath = reference_lock_path(path)
+    while True:
+        f = open(lockpath, 'a')
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                current = (os.stat(lockpath).st_ino
+                           == os.fstat(f.fileno()).st_ino)
+            except OSError:
+                current = False
+            if not current:
+                # removed by the process that held the lock before
+                f.close()
+                continue
+        elif msvcrt:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except IOError:
+                    # LK_LOCK gives up after 10 seconds; keep waiting
+                    pass
+        break
+    try:
+        yield
+    finally:
+        if fcntl:
+            os.remove(lockpath)     # while still holding the lock
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        elif msvcrt:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        f.close()
+
+
+def reference_lock_path(path):
+    """
+    The path of the lock file used by :py:func:`reference_lock` for a
+    reference file, creating its directory if necessary.
+    """
+    lockdir = os.path.join(tempfile.gettempdir(), 'tdda-locks')
+    if not os.path.isdir(lockdir):
+        try:
+            os.makedirs(lockdir)
+        except OSError:
+            if not os.path.isdir(lockdir):  # not just made by another process
+                raise
+    ident = os.path.abspath(path).encode('utf-8')
+    return os.path.join(lockdir,
+                        'tdda-%s.lock' % hashlib.sha1(ident).hexdigest())
+
+
 # Magic so that an instance of this class can masquerade as a module,
 # so that all of its methods can be made available as top-level functions,
 # to work will with frameworks like pytest.
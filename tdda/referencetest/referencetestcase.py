@@ -167,9 +167,14 @@ def _run_tests(module=None, argv=None, tagged=False, check=False):
     loader = (TaggedTestLoader(check) if tagged or check
               else unittest.defaultTestLoader)
     if module is None:
-        unittest.main(argv=argv, testLoader=loader)
+        prog = unittest.main(argv=argv, testLoader=loader, exit=False)
     else:
-        unittest.main(module=module, argv=argv, testLoader=loader)
+        prog = unittest.main(module=module, argv=argv, testLoader=loader,
+                             exit=False)
+    summary = ReferenceTestCase.regeneration_summary()
+    if summary and ReferenceTestCase.verbose:
+        print(summary)
+    sys.exit(not prog.result.wasSuccessful())
 
 
 def _set_flags_from_argv(argv=None):
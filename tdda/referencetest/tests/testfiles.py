@@ -9,6 +9,8 @@ from __future__ import unicode_literals
 from __future__ import division
 
 import os
+import shutil
+import tempfile
 import unittest
 
 from tdda.referencetest.checkfiles import FilesComparison
@@ -316,6 +318,107 @@ class TestFiles(unittest.TestCase):
         difflines[2] = 'And:'
         self.assertEqual(msgs.reconstructions[0].diff_expected, difflines)
 
+    def test_difference_hunks(self):
+        compare = FilesComparison()
+        actual = ['line %d' % i for i in range(1000)]
+        expected = list(actual)
+        expected[10] = 'changed 10'
+        expected[11] = 'changed 11'
+        expected[500] = 'changed 500'
+        (code, msgs) = compare.check_strings(actual, expected,
+                                             create_temporaries=False)
+        self.assertEqual(code, 1)
+        reconstruction = msgs.reconstructions[0]
+        hunks = reconstruction.hunks(context=1)
+        self.assertEqual([[(s[0], s[4]) for s in h] for h in hunks],
+                         [[(9, True), (10, False), (11, False), (12, True)],
+                          [(499, True), (500, False), (501, True)]])
+        self.assertEqual(reconstruction.message(context=1),
+                         '\n'.join(['@@ actual line 11, expected line 11 @@',
+                                    '  line 9',
+                                    '< line 10',
+                                    '< line 11',
+                                    '> changed 10',
+                                    '> changed 11',
+                                    '  line 12',
+                                    '@@ actual line 501, '
+                                    'expected line 501 @@',
+                                    '  line 499',
+                                    '< line 500',
+                                    '> changed 500',
+                                    '  line 501']))
+        self.assertEqual(reconstruction.message(context=0, max_lines=1),
+                         '\n'.join(['@@ actual line 11, expected line 11 @@',
+                                    '< line 10',
+                                    '> changed 10',
+                                    '...']))
+
+    def test_truncated_temporaries(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            compare = FilesComparison(tmp_dir=tmpdir, max_diff_lines=6,
+                                      diff_context=1)
+            actual = ['line %d' % i for i in range(1000)]
+            expected = list(actual)
+            expected[500] = 'changed 500'
+            expected[800] = 'changed 800'
+            expected[900] = 'changed 900'
+            (code, msgs) = compare.check_strings(actual, expected)
+            self.assertEqual(code, 1)
+            self.assertEqual(msgs.lines[2],
+                             '\n'.join(['@@ actual line 501, '
+                                        'expected line 501 @@',
+                                        '  line 499',
+                                        '< line 500',
+                                        '> changed 500',
+                                        '  line 501',
+                                        '@@ actual line 801, '
+                                        'expected line 801 @@',
+                                        '  line 799',
+                                        '< line 800',
+                                        '> changed 800',
+                                        '  line 801',
+                                        '...']))
+            with open(os.path.join(tmpdir, 'actual-file')) as f:
+                actual_lines = f.read().splitlines()
+            with open(os.path.join(tmpdir, 'expected-file')) as f:
+                expected_lines = f.read().splitlines()
+            # only the differences are written, however far into the file
+            self.assertEqual(actual_lines[-9:],
+                             ['*** @@ actual line 501, expected line 501 @@',
+                              'line 499', 'line 500', 'line 501',
+                              '*** @@ actual line 801, expected line 801 @@',
+                              'line 799', 'line 800', 'line 801',
+                              '*** ...'])
+            self.assertEqual(expected_lines[-9:],
+                             ['*** @@ actual line 501, expected line 501 @@',
+                              'line 499', 'changed 500', 'line 501',
+                              '*** @@ actual line 801, expected line 801 @@',
+                              'line 799', 'changed 800', 'line 801',
+                              '*** ...'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_truncated_hunk(self):
+        # a single, very long, hunk is truncated too
+        tmpdir = tempfile.mkdtemp()
+        try:
+            compare = FilesComparison(tmp_dir=tmpdir, max_diff_lines=50)
+            actual = ['line %d' % i for i in range(20000)]
+            expected = ['new line'] + actual[:-1]
+            (code, msgs) = compare.check_strings(actual, expected)
+            self.assertEqual(code, 1)
+            message = msgs.lines[2].split('\n')
+            self.assertEqual(message[-1], '...')
+            self.assertTrue(len(message) < 110)
+            for name in ('actual-file', 'expected-file'):
+                with open(os.path.join(tmpdir, name)) as f:
+                    lines = f.read().splitlines()
+                self.assertEqual(lines[-1], '*** ...')
+                self.assertTrue(len(lines) < 60)
+        finally:
+            shutil.rmtree(tmpdir)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -9,6 +9,8 @@ from __future__ import unicode_literals
 from __future__ import division
 
 import os
+import shutil
+import tempfile
 import unittest
 
 try:
@@ -16,15 +18,29 @@ try:
 except ImportError:
     pd = None
 
-from tdda.referencetest.checkpandas import PandasComparison
+from tdda.referencetest.checkpandas import (PandasComparison,
+                                            default_csv_loader)
 from tdda.referencetest.basecomparison import diffcmd
+from tdda.referencetest.referencecache import ReferenceCache
 
 def refloc(filename):
     return os.path.join(os.path.dirname(__file__), 'testdata', filename)
 
 
+LOADS = []
+
+def counting_loader(csvfile, **kwargs):
+    LOADS.append(csvfile)
+    return default_csv_loader(csvfile, **kwargs)
+
+
 @unittest.skipIf(pd is None, 'no pandas')
 class TestPandasDataFrames(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
 
     def test_frames_ok(self):
         compare = PandasComparison()
@@ -98,6 +114,123 @@ class TestPandasDataFrames(unittest.TestCase):
                           'Length check failed.',
                           'Found 0 records, expected 147'])
 
+    def test_pandas_csv_chunked_ok(self):
+        compare = PandasComparison()
+        r = compare.check_csv_file(refloc('colours.txt'),
+                                   refloc('colours.txt'), chunksize=10)
+        self.assertEqual(r, (0, []))
+
+    def test_pandas_csv_chunked_fail(self):
+        compare = PandasComparison(tmp_dir=self.tmp_dir)
+        with open(refloc('colours.txt')) as f:
+            lines = f.readlines()
+        lines[100] = lines[100].replace(',', 'x,', 1)
+        actual_path = os.path.join(self.tmp_dir, 'colours_chunked.txt')
+        with open(actual_path, 'w') as f:
+            f.writelines(lines)
+        (code, errs) = compare.check_csv_file(actual_path,
+                                              refloc('colours.txt'),
+                                              chunksize=40)
+        errs = [e for e in errs if not e.startswith('Compare with:')
+                                   and not e.startswith('    ' + diffcmd())]
+        self.assertEqual(code, 1)
+        self.assertEqual(errs[:2], ['Contents check failed.',
+                                    'Column values differ: Name'])
+        self.assertEqual(errs[-1],
+                         'Differences found in chunk starting at record 81')
+
+    def test_pandas_csv_chunked_parser_error(self):
+        # a reader that fails part way through falls back to comparing
+        # the whole files
+        compare = PandasComparison()
+        loads = []
+
+        def loader(csvfile, chunksize=None, **kwargs):
+            loads.append(chunksize)
+            if chunksize is None:
+                return default_csv_loader(csvfile, **kwargs)
+            return failing_chunks(csvfile, chunksize, **kwargs)
+
+        def failing_chunks(csvfile, chunksize, **kwargs):
+            chunks = default_csv_loader(csvfile, chunksize=chunksize,
+                                        **kwargs)
+            yield next(chunks)
+            chunks.close()
+            raise pd.errors.ParserError('confused')
+
+        r = compare.check_csv_file(refloc('colours.txt'),
+                                   refloc('colours.txt'), loader=loader,
+                                   chunksize=10)
+        self.assertEqual(r, (0, []))
+        self.assertEqual(loads, [10, 10, None, None])
+
+    def test_pandas_csv_chunked_length_fail(self):
+        compare = PandasComparison(tmp_dir=self.tmp_dir)
+        with open(refloc('colours.txt')) as f:
+            lines = f.readlines()
+        actual_path = os.path.join(self.tmp_dir, 'colours_chunked_short.txt')
+        with open(actual_path, 'w') as f:
+            f.writelines(lines[:-7])
+        (code, errs) = compare.check_csv_file(actual_path,
+                                              refloc('colours.txt'),
+                                              chunksize=70)
+        errs = [e for e in errs if not e.startswith('Compare with:')
+                                   and not e.startswith('    ' + diffcmd())]
+        self.assertEqual(code, 1)
+        self.assertEqual(errs,
+                         ['Length check failed.',
+                          'Found 0 records, expected 7',
+                          'Differences found in chunk starting at record 141'])
+
+
+@unittest.skipIf(pd is None, 'no pandas')
+class TestReferenceCache(unittest.TestCase):
+    def setUp(self):
+        del LOADS[:]
+
+    def test_cache_in_memory(self):
+        cache = ReferenceCache()
+        compare = PandasComparison(reference_cache=cache)
+        for i in range(3):
+            r = compare.check_csv_file(refloc('colours.txt'),
+                                       refloc('colours.txt'),
+                                       loader=counting_loader)
+            self.assertEqual(r, (0, []))
+        # the actual file is loaded every time, the reference only once
+        self.assertEqual(len(LOADS), 4)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        df = cache.load(refloc('colours.txt'), counting_loader,
+                        usecols=['Name'])
+        self.assertEqual(list(df), ['Name'])
+        self.assertEqual(cache.misses, 2)
+
+    def test_cache_returns_copies(self):
+        cache = ReferenceCache()
+        df = cache.load(refloc('colours.txt'), counting_loader)
+        df.sort_values('Name', inplace=True)
+        df2 = cache.load(refloc('colours.txt'), counting_loader)
+        self.assertEqual(df2['Name'][0], 'indigo')
+        self.assertEqual(len(LOADS), 1)
+
+    def test_cache_eviction(self):
+        cache = ReferenceCache(max_bytes=1)
+        cache.load(refloc('colours.txt'), counting_loader)
+        cache.load(refloc('colours.txt'), counting_loader)
+        self.assertEqual(len(LOADS), 2)
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_cache_on_disk(self):
+        cache_dir = tempfile.mkdtemp()
+        cache = ReferenceCache(cache_dir=cache_dir)
+        df = cache.load(refloc('colours.txt'), counting_loader)
+        other = ReferenceCache(cache_dir=cache_dir)
+        df2 = other.load(refloc('colours.txt'), counting_loader)
+        self.assertEqual(len(LOADS), 1)
+        self.assertTrue(df.equals(df2))
+        other.clear()
+        self.assertEqual(os.listdir(cache_dir), [])
+        shutil.rmtree(cache_dir)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -10,9 +10,27 @@ from __future__ import division
 
 import os
 import tempfile
+import threading
+import time
 import unittest
 
-from tdda.referencetest.referencetest import ReferenceTest
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+try:
+    from tdda.referencetest import referencepytest
+except ImportError:
+    referencepytest = None
+
+from tdda.referencetest.referencetest import (ReferenceTest, reference_lock,
+                                             reference_lock_path)
 
 
 class TestRegenerate(unittest.TestCase):
@@ -23,6 +41,7 @@ class TestRegenerate(unittest.TestCase):
     def setUp(self):
         ReferenceTest.set_default_data_location(self.tmpdir)
         ReferenceTest.set_defaults(verbose=False)
+        ReferenceTest.regenerated.clear()
 
     def tearDown(self):
         ReferenceTest.set_regeneration(regenerate=False)
@@ -57,6 +76,87 @@ class TestRegenerate(unittest.TestCase):
         with open(csvfile) as f:
             self.assertEqual(f.read(), 'Completely different content')
 
+    def test_regenerate_unchanged(self):
+        ReferenceTest.set_regeneration()
+        ref = ReferenceTest(assert_fn=self.assertTrue)
+        refname = 'regenerate_unchanged.txt'
+        newname = 'regenerate_new.txt'
+        reffile = os.path.join(self.tmpdir, refname)
+        newfile = os.path.join(self.tmpdir, newname)
+        if os.path.exists(newfile):
+            os.remove(newfile)
+        ref.assertStringCorrect('Start\nMiddle\nEnd\n', refname)
+        os.utime(reffile, (0, 0))
+        ref.assertStringCorrect('Start\nMiddle\nEnd\n', refname)
+        self.assertEqual(os.path.getmtime(reffile), 0)
+        self.assertEqual(ReferenceTest.regenerated[reffile], 'unchanged')
+        ref.assertStringCorrect('New content\n', newname)
+        self.assertEqual(ReferenceTest.regenerated[newfile], 'new')
+        ref.assertStringCorrect('Start\nEnd\n', refname)
+        self.assertEqual(ReferenceTest.regenerated[reffile], 'written')
+        with open(reffile) as f:
+            self.assertEqual(f.read(), 'Start\nEnd\n')
+        self.assertEqual(ReferenceTest.regeneration_summary(),
+                         'Reference files: 1 written, 0 unchanged, 1 new')
+
+    @unittest.skipIf(pd is None, 'no pandas')
+    def test_regenerate_dataset_unchanged(self):
+        ReferenceTest.set_regeneration()
+        ref = ReferenceTest(assert_fn=self.assertTrue)
+        refname = 'regenerate_unchanged.csv'
+        reffile = os.path.join(self.tmpdir, refname)
+        df = pd.DataFrame({'a': [1, 2, 3], 'b': [1.5, 2.25, 3.125]})
+        ref.assertDataFrameCorrect(df, refname)
+        # a semantically-identical file, serialized differently
+        with open(reffile, 'w') as f:
+            f.write('a,b\n1,1.50\n2,2.250\n3,3.1250\n')
+        ref.assertDataFrameCorrect(df, refname)
+        self.assertEqual(ReferenceTest.regenerated[reffile], 'unchanged')
+        with open(reffile) as f:
+            self.assertEqual(f.read(), 'a,b\n1,1.50\n2,2.250\n3,3.1250\n')
+        ref.assertDataFrameCorrect(df.iloc[:2], refname)
+        self.assertEqual(ReferenceTest.regenerated[reffile], 'written')
+        with open(reffile) as f:
+            self.assertEqual(f.read(), 'a,b\n1,1.5\n2,2.25\n')
+
+    def test_reference_lock(self):
+        reffile = os.path.join(self.tmpdir, 'regenerate_locked.txt')
+        events = []
+
+        def other_worker():
+            with reference_lock(reffile):
+                events.append('other')
+
+        with reference_lock(reffile):
+            t = threading.Thread(target=other_worker)
+            t.start()
+            time.sleep(0.2)
+            events.append('first')
+        t.join()
+        self.assertEqual(events, ['first', 'other'])
+        lockpath = reference_lock_path(reffile)
+        self.assertEqual(os.path.dirname(lockpath),
+                         os.path.join(tempfile.gettempdir(), 'tdda-locks'))
+        if fcntl:
+            self.assertFalse(os.path.exists(lockpath))   # cleaned up
+
+    @unittest.skipIf(referencepytest is None, 'no pytest')
+    def test_aggregate_worker_regeneration(self):
+        class Node(object):
+            def __init__(self, regenerated):
+                self.workeroutput = {'tdda_regenerated': regenerated}
+
+        referencepytest.testnodedown(Node({'a.csv': 'new',
+                                           'b.csv': 'unchanged'}), None)
+        referencepytest.testnodedown(Node({'a.csv': 'unchanged',
+                                           'b.csv': 'written',
+                                           'c.csv': 'unchanged'}), None)
+        self.assertEqual(ReferenceTest.regenerated,
+                         {'a.csv': 'new', 'b.csv': 'written',
+                          'c.csv': 'unchanged'})
+        self.assertEqual(ReferenceTest.regeneration_summary(),
+                         'Reference files: 1 written, 1 unchanged, 1 new')
+
 
 if __name__ == '__main__':
     unittest.main()
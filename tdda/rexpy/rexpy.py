@@ -329,6 +329,13 @@ class Extractor(object):
 
     The examples may be given as a list or as a dictionary:
     if a dictionary, the values are assumed to be string frequencies.
+    More examples can be added later with :py:meth:`add` (or one at a
+    time with :py:meth:`count`), before extraction.
+
+    If ``max_examples`` is set, at most that many distinct examples are
+    kept, chosen by reservoir sampling (using ``seed``, if given), so that
+    memory use is bounded however many examples are added. Any examples
+    not kept may then not match the regular expressions found.
 
     Verbose is usually 0 or ``False``. It can be to ``True`` or 1 for various
     extra output, and to higher numbers for even more verbose output.
@@ -342,12 +349,17 @@ class Extractor(object):
                  max_patterns=MAX_PATTERNS,
                  min_diff_strings_per_pattern=MIN_DIFF_STRINGS_PER_PATTERN,
                  min_strings_per_pattern=MIN_STRINGS_PER_PATTERN,
-                 seed=None, dialect=None, verbose=VERBOSITY):
+                 seed=None, dialect=None, max_examples=None,
+                 verbose=VERBOSITY):
         """
         Set class attributes and clean input strings.
         Also performs exraction unless extract=False.
         """
         self.verbose = verbose
+        self.max_examples = max_examples
+        self.reservoir = []                 # Distinct examples kept, and
+        self.n_distinct = 0                 # number offered, when sampling
+        self.rng = random.Random(seed)
         self.example_freqs = Counter()      # Each string stored only once;
                                             # but multiplicity stored
         if USE_SAMPLING:
@@ -430,27 +442,49 @@ class Extractor(object):
         Compute length of each string and count number of examples
         of each length.
         """
-        isdict = isinstance(examples, dict)
-        for s in examples:
-            n = examples[s] if isdict else 1
-            if s is None:
-                self.n_nulls += 1
-            else:
-                stripped = s.strip() if self.strip else s
-                L = len(stripped)
-                if self.remove_empties and L == 0:
-                    self.n_empties += n
-                else:
-                    self.example_freqs[stripped] += n
-                    if len(stripped) != len(s):
-                        self.n_stripped += n
-        for k in [k for (k, n) in self.example_freqs.items() if n == 0]:
-            del self.example_freqs[k]
+        self.add(examples)
         if self.verbose > 1:
             print('Examples:')
             pprint(self.example_freqs)
             print()
 
+    def add(self, examples):
+        """
+        Add examples (a list, or a dictionary of string frequencies),
+        which can be done repeatedly, for example for each batch of
+        a large number of examples.
+        """
+        isdict = isinstance(examples, dict)
+        for s in examples:
+            self.count(s, examples[s] if isdict else 1)
+
+    def count(self, s, n=1):
+        """
+        Count *n* occurrences of the example string *s*.
+        """
+        if s is None:
+            self.n_nulls += 1
+            return
+        stripped = s.strip() if self.strip else s
+        if self.remove_empties and len(stripped) == 0:
+            self.n_empties += n
+            return
+        if n == 0:
+            return
+        if len(stripped) != len(s):
+            self.n_stripped += n
+        if stripped not in self.example_freqs and self.max_examples:
+            self.n_distinct += 1
+            if len(self.reservoir) < self.max_examples:
+                self.reservoir.append(stripped)
+            else:
+                i = self.rng.randrange(self.n_distinct)
+                if i >= self.max_examples:
+                    return
+                del self.example_freqs[self.reservoir[i]]
+                self.reservoir[i] = stripped
+        self.example_freqs[stripped] += n
+
     def batch_extract(self, examples):
         """
         Find regular expressions for a batch of examples (as given).
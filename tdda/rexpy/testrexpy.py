@@ -1555,6 +1555,34 @@ class TestExtraction(ReferenceTestCase):
         self.assertRaisesRegex(ValueError, 'Non-null, non-string',
                                pdextract, df['ab'])
 
+    def testIncrementalExtraction(self):
+        batches = [['EH1 1AA', 'EH12 3LH'], ['AL6 1BB', None],
+                   {'G1 1AA': 3, 'G2 2BB': 0}]
+        x = Extractor([], extract=False)
+        for batch in batches:
+            x.add(batch)
+        x.extract()
+        self.assertEqual(x.example_freqs,
+                         {'EH1 1AA': 1, 'EH12 3LH': 1, 'AL6 1BB': 1,
+                          'G1 1AA': 3})
+        self.assertEqual(x.n_nulls, 1)
+        self.assertEqual(x.results.rex,
+                         extract(['EH1 1AA', 'EH12 3LH', 'AL6 1BB',
+                                  'G1 1AA']))
+
+    def testExtractionMaxExamples(self):
+        examples = ['%s%d' % (c, i) for c in 'ABCDEFGHIJ' for i in range(100)]
+        x = Extractor([], extract=False, max_examples=50, seed=1)
+        for i in range(0, len(examples), 64):
+            x.add(examples[i:i + 64])
+        self.assertEqual(len(x.example_freqs), 50)
+        self.assertEqual(x.n_distinct, 1000)
+        self.assertTrue(set(x.example_freqs) <= set(examples))
+        # the sample is spread across the examples, not just the first 50
+        self.assertTrue(len(set(k[0] for k in x.example_freqs)) > 1)
+        x.extract()
+        self.assertEqual(x.results.rex, ['^[A-Z]\\d{1,2}$'])
+
     def testRexpyCommandLineAPIQuoting(self):
         inputs = ['EH12 3LH', 'AL64 1BB']
         self.assertEqual(rexpy_streams(inputs, out_path=False),